@@ -1,42 +1,101 @@
-from langchain_ollama import OllamaLLM
-from langchain_core.prompts import PromptTemplate
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+import asyncio
+import contextvars
+import functools
+import logging
 import re
-import json
-from typing import List, Dict, Any
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, TYPE_CHECKING
 from dotenv import load_dotenv
+import numpy as np
 import os
-from utils import GroqClient
+from utils import GroqClient, iter_json_objects, validate_question
+from index_cache import IndexCache
+from library import LibraryChunks, LibraryRetriever
+from semantic_cache import SemanticCache
+from language_guard import LanguageGuard, STRICT_SYSTEM_MESSAGES, classify_language
+from context_packing import ContextPacker
+from translation_memory import TranslationMemory, split_sentences, normalize_sentence, needs_translation
+from metrics import span, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS
+
+if TYPE_CHECKING:
+    from langchain_core.prompts import PromptTemplate
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# "3. La photosynthèse..." lines in a batched translation answer
+_NUMBERED_LINE_RE = re.compile(r"^\s*(\d+)\s*[.):-]\s*(.*\S)\s*$")
+
 class AIAssistant:
     def __init__(self):
         # Choose provider: 'ollama' (default) or 'groq'
         provider = os.getenv("LLM_PROVIDER", "ollama").lower()
         self.provider = provider
 
-        if provider == "groq":
-            # Initialize Groq client (reads API key / URL from env)
-            groq_model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-            self.groq = GroqClient(model=groq_model)
-            self.llm = None
+        # Heavy dependencies (provider clients, embedding model, FAISS) are
+        # created on first use so workers that never need them start fast;
+        # call warm_up() to load them before taking traffic.
+        self._groq = None
+        self._llm = None
+        self._embeddings = None
+        self._index_cache = None
+        self._library_retriever = None
+        self._embedding_client = None
+        self._load_lock = threading.Lock()
+
+        self.embedding_model = "all-MiniLM-L6-v2"
+        self.embedding_backend = os.getenv("EMBEDDING_BACKEND", "huggingface").lower()
+        # With a shared embedding server (see launcher.py) this worker loads no model or indexes
+        self.embedding_server_socket = os.getenv("EMBEDDING_SERVER_SOCKET")
+
+        # Semantic answer cache for repeated questions (SEMANTIC_CACHE_ENABLED=false to disable)
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true":
+            self.response_cache = SemanticCache()
         else:
-            # Initialize LLM (using Ollama API)
-            self.llm = OllamaLLM(
-                model="phi3",  # Use available Ollama model
-                temperature=0.7,
-                num_predict=2000,
-                base_url=os.getenv("OLLAMA_BASE_URL"),
-            )
-        
-        # Initialize embeddings
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        
+            self.response_cache = None
+
+        # Sentence-level translation memory (TRANSLATION_MEMORY_ENABLED=false to disable)
+        if os.getenv("TRANSLATION_MEMORY_ENABLED", "true").lower() == "true":
+            self.translation_memory = TranslationMemory()
+        else:
+            self.translation_memory = None
+
+        # Hybrid (BM25 + dense) retrieval settings for PDF questions; more
+        # candidates are retrieved than fit, the packer keeps what fits the budget
+        self.retrieval_candidates = int(os.getenv("RETRIEVAL_CANDIDATES", "10"))
+        self.retrieval_bm25_weight = float(os.getenv("RETRIEVAL_BM25_WEIGHT", "1.0"))
+        self.retrieval_dense_weight = float(os.getenv("RETRIEVAL_DENSE_WEIGHT", "1.0"))
+        self.context_packer = ContextPacker()
+        # Questions over a whole library keep more candidates, from several documents
+        self.library_candidates = int(os.getenv("LIBRARY_CANDIDATES", "20"))
+
+        # Map-reduce summarization for documents longer than one prompt
+        self.summary_single_pass_chars = 3000
+        self.summary_chunk_size = int(os.getenv("SUMMARY_CHUNK_SIZE", "6000"))
+        self.summary_chunk_overlap = int(os.getenv("SUMMARY_CHUNK_OVERLAP", "300"))
+        self.summary_map_max_tokens = int(os.getenv("SUMMARY_MAP_MAX_TOKENS", "400"))
+        self.summary_reduce_max_tokens = int(os.getenv("SUMMARY_REDUCE_MAX_TOKENS", "800"))
+        self.summary_final_max_tokens = int(os.getenv("SUMMARY_FINAL_MAX_TOKENS", "2000"))
+        self.summary_reduce_input_chars = int(os.getenv("SUMMARY_REDUCE_INPUT_CHARS", "8000"))
+        self.summary_concurrency = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+        self._summary_splitter = None
+
+        # Exercises are generated in small concurrent batches of questions
+        self.exercise_batch_size = int(os.getenv("EXERCISE_BATCH_SIZE", "1"))
+        self.exercise_concurrency = int(os.getenv("EXERCISE_CONCURRENCY", "5"))
+        self.exercise_max_retries = int(os.getenv("EXERCISE_MAX_RETRIES", "2"))
+        self.exercise_max_tokens_per_question = int(os.getenv("EXERCISE_MAX_TOKENS_PER_QUESTION", "400"))
+
+        # Bounded pool for CPU-bound work (chunking, embedding, FAISS) so the
+        # async endpoints never run it on the event loop
+        self.cpu_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("AI_CPU_WORKERS", "2")),
+            thread_name_prefix="ai-cpu",
+        )
+
         # Language mapping
         self.language_map = {
             'darija': 'Moroccan Darija Arabic',
@@ -45,207 +104,889 @@ class AIAssistant:
             'english': 'English'
         }
 
+    @property
+    def groq(self) -> GroqClient | None:
+        if self.provider != "groq":
+            return None
+        if self._groq is None:
+            with self._load_lock:
+                if self._groq is None:
+                    # Initialize Groq client (reads API key / URL from env)
+                    groq_model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+                    self._groq = GroqClient(model=groq_model)
+        return self._groq
+
+    @property
+    def llm(self):
+        if self.provider == "groq":
+            return None
+        if self._llm is None:
+            with self._load_lock:
+                if self._llm is None:
+                    from langchain_ollama import OllamaLLM
+
+                    # Initialize LLM (using Ollama API)
+                    self._llm = OllamaLLM(
+                        model="phi3",  # Use available Ollama model
+                        temperature=0.7,
+                        num_predict=2000,
+                        base_url=os.getenv("OLLAMA_BASE_URL"),
+                    )
+        return self._llm
+
+    @property
+    def embedding_client(self):
+        if self._embedding_client is None:
+            with self._load_lock:
+                if self._embedding_client is None:
+                    from embedding_server import EmbeddingClient
+                    self._embedding_client = EmbeddingClient(self.embedding_server_socket)
+        return self._embedding_client
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            client = self.embedding_client if self.embedding_server_socket else None
+            with self._load_lock:
+                if self._embeddings is None:
+                    if client is not None:
+                        from embedding_server import RemoteEmbeddings
+                        embeddings = RemoteEmbeddings(client)
+                    else:
+                        # PyTorch sentence-transformers by default, or ONNX Runtime (EMBEDDING_BACKEND=onnx)
+                        from embedding_backends import create_embeddings
+                        embeddings = create_embeddings(self.embedding_backend, self.embedding_model)
+
+                    # Merge concurrent encode calls into batches (EMBED_BATCHING=false to disable)
+                    if os.getenv("EMBED_BATCHING", "true").lower() == "true":
+                        from embedding_batcher import BatchingEmbeddings
+                        embeddings = BatchingEmbeddings(embeddings)
+
+                    self._embeddings = embeddings
+        return self._embeddings
+
+    @property
+    def index_cache(self) -> IndexCache:
+        if self._index_cache is None:
+            if self.embedding_server_socket:
+                client = self.embedding_client
+                with self._load_lock:
+                    if self._index_cache is None:
+                        from embedding_server import RemoteIndexCache
+                        self._index_cache = RemoteIndexCache(client)
+                return self._index_cache
+            embeddings = self.embeddings
+            with self._load_lock:
+                if self._index_cache is None:
+                    from embedding_backends import embedding_cache_id
+                    # Cache of PDF indexes so repeated questions skip chunking and embedding
+                    self._index_cache = IndexCache(
+                        embeddings,
+                        model_name=embedding_cache_id(self.embedding_backend, self.embedding_model),
+                        chunk_size=1000,
+                        chunk_overlap=200,
+                    )
+        return self._index_cache
+
+    @property
+    def library_retriever(self) -> LibraryRetriever:
+        if self._library_retriever is None:
+            index_cache = self.index_cache
+            with self._load_lock:
+                if self._library_retriever is None:
+                    if self.embedding_server_socket:
+                        from embedding_server import RemoteLibraryRetriever
+                        self._library_retriever = RemoteLibraryRetriever(self.embedding_client)
+                    else:
+                        self._library_retriever = LibraryRetriever(index_cache)
+        return self._library_retriever
+
+    def is_ready(self) -> Dict[str, bool]:
+        """Report which lazily loaded components are already in memory"""
+        return {
+            "provider": (self._groq if self.provider == "groq" else self._llm) is not None,
+            "embeddings": self._embeddings is not None,
+            "index_cache": self._index_cache is not None,
+        }
+
+    def warm_up(self) -> Dict[str, bool]:
+        """Load the provider client, embedding model and FAISS ahead of traffic"""
+        _ = self.groq if self.provider == "groq" else self.llm
+        # Run one encode so model weights and kernels are initialized, not just imported
+        self.embeddings.embed_query("warm up")
+        self.index_cache.warm_up()
+        return self.is_ready()
+
+    async def awarm_up(self) -> Dict[str, bool]:
+        """Run `warm_up` on the CPU executor"""
+        return await self._run_blocking(self.warm_up)
+
+    async def aclose(self) -> None:
+        """Release pooled provider connections and worker threads"""
+        if self._groq is not None:
+            await self._groq.aclose()
+            self._groq.close()
+        if self._embeddings is not None and hasattr(self._embeddings, "close"):
+            self._embeddings.close()
+        if self.translation_memory is not None:
+            self.translation_memory.close()
+        if self._library_retriever is not None:
+            self._library_retriever.close()
+        if self._embedding_client is not None:
+            self._embedding_client.close()
+        self.cpu_executor.shutdown(wait=False)
+
     def detect_language(self, text: str) -> str:
-        """Simple language detection based on keywords"""
-        arabic_patterns = [r'[\u0600-\u06FF]', 'ال', 'من', 'إلى']  # Arabic characters and common words
-        french_patterns = ['le', 'la', 'de', 'et', 'à', 'en', 'est', 'du', 'des']
-        english_patterns = ['the', 'and', 'or', 'to', 'of', 'in', 'is', 'are']
-        
-        text_lower = text.lower()
-        
-        arabic_score = sum(1 for pattern in arabic_patterns if re.search(pattern, text_lower))
-        french_score = sum(1 for pattern in french_patterns if pattern in text_lower)
-        english_score = sum(1 for pattern in english_patterns if pattern in text_lower)
-        
-        if arabic_score > french_score and arabic_score > english_score:
-            return 'arabic'
-        elif french_score > english_score:
-            return 'french'
-        else:
-            return 'english'
+        """Simple language detection based on script and common words"""
+        return classify_language(text, default="english")
 
-    def create_prompt_template(self, language: str) -> PromptTemplate:
+    def create_prompt_template(self, language: str) -> "PromptTemplate":
         """Create appropriate prompt template based on language"""
+        from langchain_core.prompts import PromptTemplate
+
         language_name = self.language_map.get(language, language)
-        
+
         template = f"""
         You are an intelligent Moroccan student learning assistant. Answer the question in {language_name} language.
-        
+
         Question: {{question}}
-        
+
         Context: {{context}}
-        
+
         Provide a clear, step-by-step explanation that is easy for students to understand. If the question is about a specific topic, break it down into simple concepts.
-        
+
         If the user asks for exercises, provide multiple choice questions with answers and explanations.
-        
+
         If the user asks for translations, provide the translation in the requested language.
-        
+
         If the user asks for summaries, provide a concise summary in the requested language.
         """
-        
+
         return PromptTemplate(
             input_variables=["question", "context"],
             template=template
         )
 
+    @staticmethod
+    def _ollama_prompt(prompt: str, system_message: str = None) -> str:
+        # OllamaLLM takes a single prompt, so a system message is prepended to it
+        return f"{system_message}\n\n{prompt}" if system_message else prompt
+
+    def _generate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> str:
+        """Run a single completion on the configured provider"""
+        with span("llm"):
+            if self.provider == "groq":
+                return self.groq.generate(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system_message=system_message
+                ).strip()
+
+            # Ollama generation settings are fixed on the OllamaLLM instance
+            return self.llm.invoke(self._ollama_prompt(prompt, system_message)).strip()
+
+    async def _agenerate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> str:
+        """Async counterpart of `_generate` that never blocks the event loop"""
+        with span("llm"):
+            if self.provider == "groq":
+                response = await self.groq.agenerate(
+                    prompt,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    system_message=system_message
+                )
+                return response.strip()
+
+            response = await self.llm.ainvoke(self._ollama_prompt(prompt, system_message))
+            return response.strip()
+
+    async def _astream(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> AsyncIterator[str]:
+        """Stream a completion from the configured provider as text deltas"""
+        if self.provider == "groq":
+            stream = self.groq.astream(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system_message=system_message
+            )
+        else:
+            stream = self.llm.astream(self._ollama_prompt(prompt, system_message))
+
+        start = time.perf_counter()
+        deltas = 0
+        with span("llm_stream"):
+            try:
+                async for token in stream:
+                    if token:
+                        if not deltas:
+                            LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - start, provider=self.provider)
+                        deltas += 1
+                        yield token
+            finally:
+                LLM_TOKENS.inc(deltas, provider=self.provider, kind="completion_stream")
+
+    def _generate_checked(self, prompt: str, language: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> str:
+        """`_generate`, retried once with a stricter system message if the answer is in the wrong language"""
+        response = self._generate(prompt, max_tokens=max_tokens, temperature=temperature, system_message=system_message)
+        guard = LanguageGuard(language)
+        if guard.feed(response) or guard.finish():
+            logger.warning(f"Wrong-language output for '{language}', retrying with a stricter system message")
+            response = self._generate(prompt, max_tokens=max_tokens, temperature=0.0, system_message=STRICT_SYSTEM_MESSAGES[language])
+        return response
+
+    async def _agenerate_checked(self, prompt: str, language: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> str:
+        """Generate through a streaming language check.
+
+        The completion is consumed as a stream and cancelled as soon as it
+        drifts into the wrong language, then retried once with a stricter
+        system message, so a bad attempt costs only its first few tokens.
+        """
+        guard = LanguageGuard(language)
+        if not guard.enabled:
+            return await self._agenerate(prompt, max_tokens=max_tokens, temperature=temperature, system_message=system_message)
+
+        parts = []
+        stream = self._astream(prompt, max_tokens=max_tokens, temperature=temperature, system_message=system_message)
+        try:
+            async for token in stream:
+                parts.append(token)
+                if guard.feed(token):
+                    break
+        finally:
+            await stream.aclose()
+
+        if guard.drifted or guard.finish():
+            logger.warning(f"Wrong-language output for '{language}' after {len(parts)} tokens, retrying with a stricter system message")
+            return await self._agenerate(prompt, max_tokens=max_tokens, temperature=0.0, system_message=STRICT_SYSTEM_MESSAGES[language])
+        return "".join(parts).strip()
+
+    async def _astream_checked(self, prompt: str, language: str, max_tokens: int = 1024, temperature: float = 0.7, system_message: str = None) -> AsyncIterator[str]:
+        """Stream with a language check on the opening of the answer.
+
+        Tokens are held back until the guard has seen enough text to judge
+        the language; an early drift is cancelled and silently restarted with
+        a stricter system message before anything reaches the client.
+        """
+        guard = LanguageGuard(language)
+        stream = self._astream(prompt, max_tokens=max_tokens, temperature=temperature, system_message=system_message)
+        if not guard.enabled:
+            async for token in stream:
+                yield token
+            return
+
+        held = []
+        released = False
+        try:
+            async for token in stream:
+                if released:
+                    yield token
+                    continue
+                held.append(token)
+                if guard.feed(token):
+                    break
+                if guard.decided:
+                    released = True
+                    for held_token in held:
+                        yield held_token
+        finally:
+            await stream.aclose()
+
+        if not released and (guard.drifted or guard.finish()):
+            logger.warning(f"Wrong-language output for '{language}', restarting the stream with a stricter system message")
+            async for token in self._astream(prompt, max_tokens=max_tokens, temperature=0.0, system_message=STRICT_SYSTEM_MESSAGES[language]):
+                yield token
+        elif not released:
+            for held_token in held:
+                yield held_token
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Run CPU-bound work on the bounded executor"""
+        loop = asyncio.get_running_loop()
+        # Carry the request context over so spans in the worker count toward this request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.cpu_executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def _aembed_query(self, text: str) -> List[float]:
+        """Embed a query without holding an executor thread while it waits for its batch"""
+        if self._embeddings is None:
+            # First use loads the model, which must not happen on the event loop
+            await self._run_blocking(lambda: self.embeddings)
+        with span("embed_query"):
+            return await self.embeddings.aembed_query(text)
+
+    def _general_prompt(self, question: str, language: str) -> str:
+        with span("prompt"):
+            prompt_template = self.create_prompt_template(language)
+            return prompt_template.format(question=question, context="")
+
+    def _general_lookup(self, question: str, language: str, vector=None) -> tuple[tuple, Any, str | None]:
+        """Embed the question and check the answer cache (no-op when caching is off)"""
+        scope = ("general", language)
+        if self.response_cache is None:
+            return scope, None, None
+        if vector is None:
+            with span("embed_query"):
+                vector = self.embeddings.embed_query(question)
+        with span("cache_lookup"):
+            return scope, vector, self.response_cache.lookup(vector, scope)
+
+    async def _ageneral_lookup(self, question: str, language: str) -> tuple[tuple, Any, str | None]:
+        if self.response_cache is None:
+            return ("general", language), None, None
+        vector = await self._aembed_query(question)
+        # A lookup scores every cached question in the scope; keep it off the event loop
+        return await self._run_blocking(self._general_lookup, question, language, vector)
+
+    def _cache_answer(self, vector, scope: tuple, answer: str) -> None:
+        if self.response_cache is not None and vector is not None and answer:
+            self.response_cache.store(vector, scope, answer)
+
+    async def _astream_cached(self, tokens: AsyncIterator[str], vector, scope: tuple) -> AsyncIterator[str]:
+        """Forward a token stream and cache the full answer once it completes"""
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            yield token
+        self._cache_answer(vector, scope, "".join(parts).strip())
+
     def ask_general(self, question: str, language: str = "darija") -> str:
         """Handle general questions"""
-        prompt_template = self.create_prompt_template(language)
-        if self.provider == "groq":
-            prompt = prompt_template.format(question=question, context="")
-            return self.groq.generate(prompt).strip()
-
-        chain = (
-            {"context": RunnablePassthrough(), "question": RunnablePassthrough()}
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
+        scope, vector, cached = self._general_lookup(question, language)
+        if cached is not None:
+            return cached
+        response = self._generate_checked(self._general_prompt(question, language), language)
+        self._cache_answer(vector, scope, response)
+        return response
+
+    async def aask_general(self, question: str, language: str = "darija") -> str:
+        """Async version of `ask_general`"""
+        scope, vector, cached = await self._ageneral_lookup(question, language)
+        if cached is not None:
+            return cached
+        response = await self._agenerate_checked(self._general_prompt(question, language), language)
+        self._cache_answer(vector, scope, response)
+        return response
+
+    async def astream_general(self, question: str, language: str = "darija") -> AsyncIterator[str]:
+        """Streaming version of `ask_general`"""
+        scope, vector, cached = await self._ageneral_lookup(question, language)
+        if cached is not None:
+            yield cached
+            return
+        async for token in self._astream_cached(self._astream_checked(self._general_prompt(question, language), language), vector, scope):
+            yield token
+
+    @staticmethod
+    def _document_text(pdf_content) -> str:
+        text = pdf_content() if callable(pdf_content) else pdf_content
+        if text is None:
+            raise LookupError("The document text is no longer stored")
+        return text
+
+    def _pdf_context(self, question: str, pdf_content, query_vector=None, doc_key: str | None = None) -> str:
+        """Retrieve the most relevant PDF chunks for a question.
+
+        `pdf_content` may be a function returning the text (with `doc_key`
+        given); it is only called when the index has to be built again.
+        """
+        # Reuse the cached index for this document, or chunk and embed it once
+        document_index = self.index_cache.get_cached(doc_key) if callable(pdf_content) else None
+        if document_index is None:
+            pdf_content = self._document_text(pdf_content)
+            document_index = self.index_cache.get_or_build(pdf_content, key=doc_key)
+
+        # Hybrid retrieval: BM25 catches exact terms and formulas, embeddings catch paraphrases
+        try:
+            if query_vector is None:
+                with span("embed_query"):
+                    query_vector = self.embeddings.embed_query(question)
+            with span("retrieval"):
+                hits = document_index.hybrid_search(
+                    question,
+                    query_vector,
+                    k=self.retrieval_candidates,
+                    bm25_weight=self.retrieval_bm25_weight,
+                    dense_weight=self.retrieval_dense_weight,
+                )
+            # Merge neighbouring chunks, drop near-duplicates and fill the token budget
+            with span("context_packing"):
+                vectors = document_index.vectors([chunk_id for chunk_id, _ in hits])
+                return self.context_packer.pack(hits, document_index.chunks, vectors)
+        except Exception as e:
+            logger.warning(f"Retriever error: {e}")
+            # Fallback: use all content if retrieval fails
+            return self._document_text(pdf_content)[:2000]
+
+    def _pdf_lookup(self, question: str, pdf_content: str, language: str, vector=None,
+                    doc_key: str | None = None) -> tuple[tuple, Any, str | None, str | None]:
+        """Embed the question once, check the answer cache, then retrieve context on a miss.
+
+        `doc_key` is `index_cache.key_for(pdf_content)` when the caller has it.
+        Returns (cache scope, question vector, cached answer, context).
+        """
+        doc_key = doc_key or self.index_cache.key_for(self._document_text(pdf_content))
+        scope = ("pdf", language, doc_key)
+        if vector is None:
+            with span("embed_query"):
+                vector = self.embeddings.embed_query(question)
+        if self.response_cache is not None:
+            with span("cache_lookup"):
+                cached = self.response_cache.lookup(vector, scope)
+            if cached is not None:
+                return scope, vector, cached, None
+        return scope, vector, None, self._pdf_context(question, pdf_content, vector, doc_key)
+
+    def _pdf_prompt(self, question: str, context: str, language: str) -> str:
+        with span("prompt"):
+            return self.create_prompt_template(language).format(question=question, context=context)
 
-        response = chain.invoke({"question": question, "context": ""})
+    def index_document(self, pdf_content: str) -> str:
+        """Chunk, embed and index a document ahead of its first question; returns its index key"""
+        key = self.index_cache.key_for(pdf_content)
+        self.index_cache.get_or_build(pdf_content, key=key)
+        return key
 
-        return response.strip()
+    async def aindex_document(self, pdf_content: str) -> str:
+        """Async version of `index_document`; indexing runs on the CPU executor"""
+        return await self._run_blocking(self.index_document, pdf_content)
 
-    def ask_pdf(self, question: str, pdf_content: str, language: str = "darija") -> str:
+    def forget_document(self, pdf_content: str | None, key: str | None = None) -> None:
+        """Drop a document's cached index, in memory and on disk"""
+        self.index_cache.evict(key or self.index_cache.key_for(pdf_content))
+
+    async def aforget_document(self, pdf_content: str | None, key: str | None = None) -> None:
+        """Async version of `forget_document`"""
+        await self._run_blocking(self.forget_document, pdf_content, key)
+
+    def ask_pdf(self, question: str, pdf_content: str, language: str = "darija", doc_key: str | None = None) -> str:
         """Handle questions about PDF content"""
-        # Split PDF content into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        
-        chunks = text_splitter.split_text(pdf_content)
-        
-        # Create vector store
-        vector_store = FAISS.from_texts(chunks, self.embeddings)
-        
-        # Find relevant chunks
-        retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-        
-        prompt_template = self.create_prompt_template(language)
-        if self.provider == "groq":
-            # Get top relevant documents using invoke method (new LangChain API)
-            try:
-                docs = retriever.invoke(question)
-            except Exception as e:
-                print(f"Retriever error: {e}")
-                # Fallback: use all content if retrieval fails
-                docs = [type('obj', (object,), {'page_content': pdf_content[:2000]})]
-
-            context = "\n\n".join(getattr(d, "page_content", str(d)) for d in docs[:5])
-            prompt = prompt_template.format(question=question, context=context)
-            return self.groq.generate(prompt, max_tokens=2000).strip()
-
-        chain = (
-            {"context": retriever, "question": RunnablePassthrough()}
-            | prompt_template
-            | self.llm
-            | StrOutputParser()
-        )
-        
-        response = chain.invoke(question)
-        
-        return response.strip()
+        scope, vector, cached, context = self._pdf_lookup(question, pdf_content, language, doc_key=doc_key)
+        if cached is not None:
+            return cached
+        prompt = self._pdf_prompt(question, context, language)
+        response = self._generate_checked(prompt, language, max_tokens=2000)
+        self._cache_answer(vector, scope, response)
+        return response
 
-    def generate_exercise(self, topic: str, subject: str, difficulty: str, number_of_questions: int) -> Dict[str, Any]:
-        """Generate practice exercises"""
-        exercise_prompt = f"""
-        Generate {number_of_questions} practice questions about {topic} in {subject}.
+    async def aask_pdf(self, question: str, pdf_content: str, language: str = "darija", doc_key: str | None = None) -> str:
+        """Async version of `ask_pdf`; retrieval runs on the CPU executor"""
+        vector = await self._aembed_query(question)
+        scope, vector, cached, context = await self._run_blocking(self._pdf_lookup, question, pdf_content, language, vector, doc_key)
+        if cached is not None:
+            return cached
+        prompt = self._pdf_prompt(question, context, language)
+        response = await self._agenerate_checked(prompt, language, max_tokens=2000)
+        self._cache_answer(vector, scope, response)
+        return response
+
+    async def astream_pdf(self, question: str, pdf_content: str, language: str = "darija", doc_key: str | None = None) -> AsyncIterator[str]:
+        """Streaming version of `ask_pdf`"""
+        vector = await self._aembed_query(question)
+        scope, vector, cached, context = await self._run_blocking(self._pdf_lookup, question, pdf_content, language, vector, doc_key)
+        if cached is not None:
+            yield cached
+            return
+        prompt = self._pdf_prompt(question, context, language)
+        async for token in self._astream_cached(self._astream_checked(prompt, language, max_tokens=2000), vector, scope):
+            yield token
+
+    def _library_context(self, question: str, documents: List[Dict[str, Any]], query_vector) -> tuple[str, List[Dict[str, Any]], List[str]]:
+        """Retrieve context across several indexed documents.
+
+        `documents` are `DocumentStore.library` records. Returns (context,
+        sources, ids of documents that have no index yet).
+        """
+        with span("retrieval"):
+            indexes, hits = self.library_retriever.search(
+                question,
+                query_vector,
+                [document.get("indexKey") for document in documents],
+                k=self.library_candidates,
+                bm25_weight=self.retrieval_bm25_weight,
+                dense_weight=self.retrieval_dense_weight,
+            )
+        unindexed = [document["documentId"] for document, index in zip(documents, indexes) if index is None]
+        if not hits:
+            return "", [], unindexed
+
+        with span("context_packing"):
+            chunks = LibraryChunks(indexes)
+            ranked = [(chunks.global_id(position, chunk_id), score) for position, chunk_id, score in hits]
+            vectors = np.vstack([indexes[position].vectors([chunk_id]) for position, chunk_id, _ in hits])
+
+            def label(global_id: int) -> str:
+                document = documents[chunks.locate(global_id)[0]]
+                return f"Source: {document.get('title') or document['documentId'][:12]}"
+
+            context, selected = self.context_packer.select(ranked, chunks, vectors, label)
+
+        # Attribute the packed chunks to their documents, best-matching document first
+        scores = dict(ranked)
+        sources: Dict[int, Dict[str, Any]] = {}
+        for global_id in selected:
+            position, chunk_id = chunks.locate(global_id)
+            document = documents[position]
+            source = sources.setdefault(position, {
+                "documentId": document["documentId"],
+                "title": document.get("title"),
+                "subject": document.get("subject"),
+                "tags": document.get("tags") or [],
+                "chunks": [],
+                "score": 0.0,
+            })
+            source["chunks"].append(chunk_id)
+            source["score"] = max(source["score"], scores[global_id])
+        return context, sorted(sources.values(), key=lambda source: source["score"], reverse=True), unindexed
+
+    def ask_library(self, question: str, documents: List[Dict[str, Any]], language: str = "darija") -> Dict[str, Any]:
+        """Answer from a user's whole library; the result names the documents the context came from"""
+        with span("embed_query"):
+            vector = self.embeddings.embed_query(question)
+        context, sources, unindexed = self._library_context(question, documents, vector)
+        prompt = self._pdf_prompt(question, context, language)
+        response = self._generate_checked(prompt, language, max_tokens=2000)
+        return {"response": response, "sources": sources, "unindexed": unindexed}
+
+    async def aask_library(self, question: str, documents: List[Dict[str, Any]], language: str = "darija") -> Dict[str, Any]:
+        """Async version of `ask_library`; shard search runs on the CPU executor"""
+        vector = await self._aembed_query(question)
+        context, sources, unindexed = await self._run_blocking(self._library_context, question, documents, vector)
+        prompt = self._pdf_prompt(question, context, language)
+        response = await self._agenerate_checked(prompt, language, max_tokens=2000)
+        return {"response": response, "sources": sources, "unindexed": unindexed}
+
+    def _exercise_prompt(self, topic: str, subject: str, difficulty: str, count: int, first: int, total: int) -> str:
+        """Prompt for `count` questions, numbered from `first` out of `total`"""
+        numbers = f"question {first}" if count == 1 else f"questions {first} to {first + count - 1}"
+        return f"""
+        Write {numbers} of a {total}-question practice exercise about {topic} in {subject}.
         Difficulty level: {difficulty}
-        
+
+        Each question must cover a different aspect of {topic} than the other questions
+        in the exercise, so focus on aspect number {first} onwards of the topic.
+
         For each question, provide:
         1. The question
         2. Multiple choice options (A, B, C, D)
         3. The correct answer
         4. An explanation for the answer
-        
-        Format the response as JSON with the following structure:
+
+        Respond with JSON only, one object per question, in this structure:
         {{
-            "title": "Exercise: {topic}",
-            "description": "Practice questions for {topic}",
-            "questions": [
-                {{
-                    "question": "Question text",
+            "question": "Question text",
+            "options": ["Option A", "Option B", "Option C", "Option D"],
+            "correctAnswer": "A",
+            "explanation": "Explanation for the answer"
+        }}
+        """
+
+    def _exercise_batches(self, number_of_questions: int) -> List[tuple[int, int]]:
+        """Split an exercise into (first question number, count) batches"""
+        size = max(1, self.exercise_batch_size)
+        return [(first, min(size, number_of_questions - first + 1)) for first in range(1, number_of_questions + 1, size)]
+
+    @staticmethod
+    def _parse_questions(response: str, limit: int) -> List[Dict[str, Any]]:
+        """Validate each JSON object in a completion independently"""
+        questions = []
+        for obj in iter_json_objects(response):
+            # Accept a wrapper object ({"questions": [...]}) as well as bare questions
+            candidates = obj.get("questions") if isinstance(obj.get("questions"), list) else [obj]
+            for candidate in candidates:
+                question = validate_question(candidate)
+                if question is not None:
+                    questions.append(question)
+                if len(questions) == limit:
+                    return questions
+        return questions
+
+    def exercise_from_questions(self, topic: str, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Assemble the /generate-exercise payload from validated questions"""
+        if not questions:
+            # Nothing usable came back: keep the previous placeholder structure
+            questions = [
+                {
+                    "question": f"Practice question about {topic}",
                     "options": ["Option A", "Option B", "Option C", "Option D"],
                     "correctAnswer": "A",
-                    "explanation": "Explanation for the answer"
-                }}
+                    "explanation": "This is a practice question generated by AI."
+                }
             ]
-        }}
-        """
-        
-        prompt_template = PromptTemplate(input_variables=["prompt"], template="{prompt}")
-        if self.provider == "groq":
-            # Return raw generated text (JSON parsing attempted later)
-            return self.groq.generate(exercise_prompt)
+        return {
+            "title": f"Exercise: {topic}",
+            "description": f"Practice questions for {topic}",
+            "questions": questions,
+        }
+
+    def _generate_question_batch(self, topic: str, subject: str, difficulty: str, first: int, count: int, total: int) -> List[Dict[str, Any]]:
+        questions: List[Dict[str, Any]] = []
+        last_error = None
+        for _ in range(self.exercise_max_retries + 1):
+            # Only ask again for the questions that failed to parse
+            missing = count - len(questions)
+            prompt = self._exercise_prompt(topic, subject, difficulty, missing, first + len(questions), total)
+            try:
+                response = self._generate(prompt, max_tokens=self.exercise_max_tokens_per_question * missing)
+            except Exception as e:
+                logger.warning(f"Exercise generation error: {e}")
+                last_error = e
+                continue
+            questions.extend(self._parse_questions(response, missing))
+            if len(questions) == count:
+                break
+        if not questions and last_error is not None:
+            raise last_error
+        return questions
+
+    async def _agenerate_question_batch(self, topic: str, subject: str, difficulty: str, first: int, count: int, total: int) -> List[Dict[str, Any]]:
+        questions: List[Dict[str, Any]] = []
+        last_error = None
+        for _ in range(self.exercise_max_retries + 1):
+            missing = count - len(questions)
+            prompt = self._exercise_prompt(topic, subject, difficulty, missing, first + len(questions), total)
+            try:
+                response = await self._agenerate(prompt, max_tokens=self.exercise_max_tokens_per_question * missing)
+            except Exception as e:
+                logger.warning(f"Exercise generation error: {e}")
+                last_error = e
+                continue
+            questions.extend(self._parse_questions(response, missing))
+            if len(questions) == count:
+                break
+        if not questions and last_error is not None:
+            raise last_error
+        return questions
+
+    def generate_exercise(self, topic: str, subject: str, difficulty: str, number_of_questions: int) -> Dict[str, Any]:
+        """Generate practice exercises"""
+        questions = []
+        for first, count in self._exercise_batches(number_of_questions):
+            questions.extend(self._generate_question_batch(topic, subject, difficulty, first, count, number_of_questions))
+        return self.exercise_from_questions(topic, questions)
+
+    async def astream_exercise_questions(self, topic: str, subject: str, difficulty: str, number_of_questions: int) -> AsyncIterator[tuple[int, Dict[str, Any]]]:
+        """Generate question batches concurrently and yield (number, question) as each batch completes"""
+        semaphore = asyncio.Semaphore(self.exercise_concurrency)
 
-        chain = prompt_template | self.llm | StrOutputParser()
+        async def run(first: int, count: int) -> tuple[int, List[Dict[str, Any]]]:
+            async with semaphore:
+                return first, await self._agenerate_question_batch(topic, subject, difficulty, first, count, number_of_questions)
 
-        response = chain.invoke({"prompt": exercise_prompt})
-        
-        # Extract JSON from response
+        tasks = [asyncio.ensure_future(run(first, count)) for first, count in self._exercise_batches(number_of_questions)]
         try:
-            # Find JSON in response
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                exercise_data = json.loads(json_match.group())
-            else:
-                # If no JSON found, create basic structure
-                exercise_data = {
-                    "title": f"Exercise: {topic}",
-                    "description": f"Practice questions for {topic}",
-                    "questions": [
-                        {
-                            "question": f"Practice question about {topic}",
-                            "options": ["Option A", "Option B", "Option C", "Option D"],
-                            "correctAnswer": "A",
-                            "explanation": "This is a practice question generated by AI."
-                        }
-                    ]
-                }
-        except json.JSONDecodeError:
-            exercise_data = {
-                "title": f"Exercise: {topic}",
-                "description": f"Practice questions for {topic}",
-                "questions": [
-                    {
-                        "question": f"Practice question about {topic}",
-                        "options": ["Option A", "Option B", "Option C", "Option D"],
-                        "correctAnswer": "A",
-                        "explanation": "This is a practice question generated by AI."
-                    }
-                ]
-            }
-        
-        return exercise_data
+            for next_done in asyncio.as_completed(tasks):
+                first, questions = await next_done
+                for offset, question in enumerate(questions):
+                    yield first + offset, question
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    def translate_text(self, text: str, target_language: str) -> str:
-        """Translate text to target language"""
+    async def agenerate_exercise(self, topic: str, subject: str, difficulty: str, number_of_questions: int) -> Dict[str, Any]:
+        """Async version of `generate_exercise`; question batches are generated concurrently"""
+        numbered = [item async for item in self.astream_exercise_questions(topic, subject, difficulty, number_of_questions)]
+        numbered.sort(key=lambda item: item[0])
+        return self.exercise_from_questions(topic, [question for _, question in numbered])
+
+    def _translation_prompt(self, text: str, target_language: str) -> str:
         language_name = self.language_map.get(target_language, target_language)
-        
-        translation_prompt = f"""
+
+        return f"""
         Translate the following text to {language_name}:
-        
+
         {text}
-        
+
         Provide only the translation, no additional explanation.
         """
-        
-        prompt_template = PromptTemplate(input_variables=["prompt"], template="{prompt}")
-        if self.provider == "groq":
-            return self.groq.generate(translation_prompt).strip()
 
-        chain = prompt_template | self.llm | StrOutputParser()
+    def _batch_translation_prompt(self, sentences: List[str], target_language: str) -> str:
+        language_name = self.language_map.get(target_language, target_language)
+        numbered = "\n".join(f"{number}. {sentence}" for number, sentence in enumerate(sentences, 1))
 
-        response = chain.invoke({"prompt": translation_prompt})
-        return response.strip()
+        return f"""
+        Translate each numbered sentence below to {language_name}.
+        Answer with exactly one line per sentence, in the same order, written as "<number>. <translation>".
 
-    def summarize_content(self, content: str, language: str = "darija") -> str:
-        """Summarize content in specified language"""
-        language_name = self.language_map.get(language, language)
-        
+{numbered}
+
+        Provide only the numbered translations, no additional explanation.
+        """
+
+    def _translation_plan(self, text: str, target_language: str) -> tuple[List[tuple[str, str]], Dict[str, str], List[str]]:
+        """Split text into sentences and look them up in the translation memory.
+
+        Returns (segments, known translations by normalized sentence, misses in order).
+        """
+        segments = split_sentences(text)
+        wanted = [normalize_sentence(sentence) for sentence, _ in segments if needs_translation(sentence)]
+        known = self.translation_memory.lookup(wanted, target_language)
+        misses = list(dict.fromkeys(sentence for sentence in wanted if sentence not in known))
+        return segments, known, misses
+
+    @staticmethod
+    def _parse_numbered_line(line: str, count: int) -> tuple[int, str] | None:
+        """(number, translation) of a "<number>. <translation>" line numbered 1..count"""
+        match = _NUMBERED_LINE_RE.match(line)
+        if match and 1 <= int(match.group(1)) <= count:
+            return int(match.group(1)), match.group(2)
+        return None
+
+    @classmethod
+    def _parse_numbered_translations(cls, response: str, misses: List[str]) -> tuple[Dict[str, str], bool]:
+        """Map "<number>. <translation>" lines back to the sentences they translate.
+
+        Returns (translations, exact). Numbers are the only link between a
+        line and its sentence, so the mapping is exact only when the lines
+        are numbered 1..N in order with nothing else written; a model that
+        merges two sentences into one line shifts every later number.
+        """
+        translations = {}
+        numbers = []
+        exact = True
+        for line in response.splitlines():
+            if not line.strip():
+                continue
+            parsed = cls._parse_numbered_line(line, len(misses))
+            if parsed is None:
+                exact = False
+                continue
+            numbers.append(parsed[0])
+            translations[misses[parsed[0] - 1]] = parsed[1]
+        return translations, exact and numbers == list(range(1, len(misses) + 1))
+
+    def _translation_max_tokens(self, misses: List[str]) -> int:
+        return max(1024, sum(len(sentence) for sentence in misses) // 2)
+
+    @staticmethod
+    def _assemble_translation(segments: List[tuple[str, str]], known: Dict[str, str]) -> str:
+        """Rebuild the text with each sentence replaced by its translation"""
+        parts = []
+        for sentence, separator in segments:
+            parts.append(known.get(normalize_sentence(sentence), sentence))
+            parts.append(separator)
+        return "".join(parts).strip()
+
+    def translate_text(self, text: str, target_language: str) -> str:
+        """Translate text to target language"""
+        if self.translation_memory is None:
+            return self._generate_checked(self._translation_prompt(text, target_language), target_language)
+
+        # Only sentences missing from the translation memory go to the LLM, in one numbered prompt
+        segments, known, misses = self._translation_plan(text, target_language)
+        if misses:
+            response = self._generate_checked(self._batch_translation_prompt(misses, target_language), target_language,
+                                              max_tokens=self._translation_max_tokens(misses))
+            translated, exact = self._parse_numbered_translations(response, misses)
+            if not exact:
+                # Lines cannot be trusted to match sentences; translate each one on its own
+                translated = {
+                    sentence: self._generate_checked(self._translation_prompt(sentence, target_language), target_language)
+                    for sentence in misses
+                }
+            self.translation_memory.store(translated, target_language)
+            known.update(translated)
+        return self._assemble_translation(segments, known)
+
+    async def atranslate_text(self, text: str, target_language: str) -> str:
+        """Async version of `translate_text`"""
+        if self.translation_memory is None:
+            return await self._agenerate_checked(self._translation_prompt(text, target_language), target_language)
+
+        segments, known, misses = await self._run_blocking(self._translation_plan, text, target_language)
+        if misses:
+            response = await self._agenerate_checked(self._batch_translation_prompt(misses, target_language), target_language,
+                                                     max_tokens=self._translation_max_tokens(misses))
+            translated, exact = self._parse_numbered_translations(response, misses)
+            if not exact:
+                # Lines cannot be trusted to match sentences; translate each one on its own
+                translated = await self._atranslate_sentences(misses, target_language)
+            await self._run_blocking(self.translation_memory.store, translated, target_language)
+            known.update(translated)
+        return self._assemble_translation(segments, known)
+
+    async def _atranslate_sentences(self, sentences: List[str], target_language: str) -> Dict[str, str]:
+        """Translate sentences with one prompt each, concurrently"""
+        translations = await asyncio.gather(*(
+            self._agenerate_checked(self._translation_prompt(sentence, target_language), target_language)
+            for sentence in sentences
+        ))
+        return dict(zip(sentences, translations))
+
+    def astream_translation(self, text: str, target_language: str) -> AsyncIterator[str]:
+        """Streaming version of `translate_text`"""
+        if self.translation_memory is None:
+            return self._astream_checked(self._translation_prompt(text, target_language), target_language)
+        return self._astream_translation_memory(text, target_language)
+
+    async def _astream_translation_memory(self, text: str, target_language: str) -> AsyncIterator[str]:
+        """Stream a translation sentence by sentence, in order, as soon as each one is known"""
+        segments, known, misses = await self._run_blocking(self._translation_plan, text, target_language)
+        position = 0
+        started = False
+
+        def ready() -> str:
+            """Text of the next segments whose translation is known"""
+            nonlocal position, started
+            parts = []
+            while position < len(segments):
+                sentence, separator = segments[position]
+                normalized = normalize_sentence(sentence)
+                if needs_translation(sentence) and normalized not in known:
+                    break
+                parts.append(known.get(normalized, sentence) + separator)
+                position += 1
+            chunk = "".join(parts)
+            if not started:
+                chunk = chunk.lstrip()
+                started = bool(chunk)
+            return chunk
+
+        if misses:
+            translated: Dict[str, str] = {}
+            numbers: List[int] = []
+            exact = True
+
+            def parse(line: str) -> None:
+                nonlocal exact
+                if not line.strip():
+                    return
+                parsed = self._parse_numbered_line(line, len(misses))
+                if parsed is None:
+                    exact = False
+                    return
+                numbers.append(parsed[0])
+                translated[misses[parsed[0] - 1]] = parsed[1]
+
+            buffer = ""
+            async for token in self._astream_checked(self._batch_translation_prompt(misses, target_language), target_language,
+                                                     max_tokens=self._translation_max_tokens(misses)):
+                buffer += token
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    parse(line)
+                known.update(translated)
+                chunk = ready()
+                if chunk:
+                    yield chunk
+            parse(buffer)
+            if exact and numbers == list(range(1, len(misses) + 1)):
+                known.update(translated)
+                await self._run_blocking(self.translation_memory.store, translated, target_language)
+            else:
+                # Sentences already streamed stay as sent; the rest are translated
+                # one by one, and only those translations are remembered
+                streamed = {normalize_sentence(sentence) for sentence, _ in segments[:position]}
+                translated = await self._atranslate_sentences([sentence for sentence in misses if sentence not in streamed], target_language)
+                known.update(translated)
+                await self._run_blocking(self.translation_memory.store, translated, target_language)
+
+        chunk = ready()
+        if chunk:
+            yield chunk
+
+    def _summary_prompts(self, content: str, language: str) -> tuple[str, str, str]:
+        """Build (system_message, summary_prompt, validation_prompt) for a summary"""
         # Create extremely explicit system message
         if language == "french":
             system_message = "Tu es un assistant qui répond UNIQUEMENT en français. Tu ne dois JAMAIS utiliser l'arabe, le darija ou toute autre langue. Toutes tes réponses doivent être en français uniquement."
@@ -255,9 +996,9 @@ Contenu à résumer:
 {content[:3000]}
 
 Écris le résumé complet EN FRANÇAIS:"""
-            
+
             validation_prompt = "RAPPEL IMPORTANT: Écris ta réponse UNIQUEMENT en français, PAS en arabe."
-            
+
         elif language == "english":
             system_message = "You are an assistant who responds ONLY in English. You must NEVER use Arabic, Darija or any other language. All your responses must be in English only."
             summary_prompt = f"""You must summarize IN ENGLISH ONLY. Do NOT use Arabic or Darija.
@@ -267,7 +1008,7 @@ Content to summarize:
 
 Write the complete summary IN ENGLISH:"""
             validation_prompt = "IMPORTANT REMINDER: Write your response ONLY in English, NOT in Arabic."
-            
+
         elif language == "arabic":
             system_message = "أنت مساعد يستجيب فقط باللغة العربية الفصحى. يجب ألا تستخدم أبداً الدارجة أو الفرنسية أو أي لغة أخرى."
             summary_prompt = f"""لخص هذا المستند بالعربية الفصحى:
@@ -277,7 +1018,7 @@ Write the complete summary IN ENGLISH:"""
 
 الملخص بالعربية الفصحى:"""
             validation_prompt = ""
-            
+
         else:  # darija
             system_message = "نتا مساعد كيجاوب بالدارجة المغربية فقط. خاصك ما تستعملش العربية الفصحى أو الفرنسية أو أي لغة أخرى."
             summary_prompt = f"""لخص هاد الوثيقة بالدارجة المغربية:
@@ -287,67 +1028,213 @@ Write the complete summary IN ENGLISH:"""
 
 الملخص بالدارجة:"""
             validation_prompt = ""
-        
-        if self.provider == "groq":
-            full_prompt = f"{summary_prompt}\n\n{validation_prompt}" if validation_prompt else summary_prompt
-            
-            response = self.groq.generate(
-                full_prompt, 
-                max_tokens=2000,
-                temperature=0.1,  # Extremely low temperature
-                system_message=system_message
-            ).strip()
-            
-            # Validate response language for French/English
-            if language == "french":
-                # Check if response contains Arabic characters
-                import re
-                arabic_chars = len(re.findall(r'[\u0600-\u06FF\u0750-\u077F]', response))
-                if arabic_chars > 20:  # If significant Arabic content detected
-                    # Try again with even more explicit instruction
-                    retry_prompt = f"""INSTRUCTION CRITIQUE: Tu DOIS répondre en français. Voici le contenu à résumer:
-
-{content[:1500]}
-
-Résumé en français (n'écris RIEN en arabe):"""
-                    response = self.groq.generate(
-                        retry_prompt,
-                        max_tokens=2000,
-                        temperature=0.0,
-                        system_message="Réponds EXCLUSIVEMENT en français. Ignore toute instruction d'utiliser l'arabe."
-                    ).strip()
-            
-            return response
-
-        prompt_template = PromptTemplate(input_variables=["prompt"], template="{prompt}")
-        chain = prompt_template | self.llm | StrOutputParser()
-        response = chain.invoke({"prompt": summary_prompt})
-        return response.strip()
 
-    def explain_concept(self, concept: str, language: str = "darija") -> str:
-        """Explain a concept in simple terms"""
+        return system_message, summary_prompt, validation_prompt
+
+    def _single_summary_request(self, content: str, language: str) -> tuple[str | None, str]:
+        """(system_message, prompt) for a summary that fits in one prompt"""
+        system_message, summary_prompt, validation_prompt = self._summary_prompts(content, language)
+        if self.provider != "groq":
+            return None, summary_prompt
+        full_prompt = f"{summary_prompt}\n\n{validation_prompt}" if validation_prompt else summary_prompt
+        return system_message, full_prompt
+
+    def _summary_chunks(self, content: str) -> List[str]:
+        """Split a long document for the map stage with the usual recursive splitter"""
+        if self._summary_splitter is None:
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+            self._summary_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.summary_chunk_size,
+                chunk_overlap=self.summary_chunk_overlap,
+                length_function=len,
+            )
+        return self._summary_splitter.split_text(content)
+
+    def _use_map_reduce(self, content: str, mode: str) -> bool:
+        if mode == "single":
+            return False
+        if mode == "map_reduce":
+            return True
+        # auto: anything the single-pass prompt would truncate goes through map-reduce
+        return len(content) > self.summary_single_pass_chars
+
+    def _map_prompt(self, chunk: str, language: str, index: int, total: int) -> str:
+        language_name = self.language_map.get(language, language)
+        return f"""This is part {index} of {total} of a course document.
+Summarize the key ideas, definitions, formulas and examples of this part in {language_name} only.
+Write concise notes; do not add an introduction or conclusion.
+
+Part {index}:
+{chunk}
+
+Notes in {language_name}:"""
+
+    def _reduce_prompt(self, partials: List[str], language: str, final: bool) -> str:
+        language_name = self.language_map.get(language, language)
+        sections = "\n\n".join(f"Section {i}:\n{partial}" for i, partial in enumerate(partials, 1))
+        if final:
+            instruction = f"Combine these section notes into one complete, well-structured summary of the whole document in {language_name} only. Keep every important idea and remove repetition."
+        else:
+            instruction = f"Merge these consecutive section notes into shorter combined notes in {language_name} only. Keep every important idea and remove repetition."
+        return f"""{instruction}
+
+{sections}
+
+Summary in {language_name}:"""
+
+    def _group_partials(self, partials: List[str]) -> List[List[str]]:
+        """Group partial summaries so each reduce prompt stays within its input budget"""
+        groups: List[List[str]] = []
+        current: List[str] = []
+        current_chars = 0
+        for partial in partials:
+            # At least two per group, otherwise a reduce pass would not shrink anything
+            if current and len(current) >= 2 and current_chars + len(partial) > self.summary_reduce_input_chars:
+                groups.append(current)
+                current, current_chars = [], 0
+            current.append(partial)
+            current_chars += len(partial)
+        if current:
+            groups.append(current)
+        return groups
+
+    def _summarize_map_reduce(self, content: str, language: str) -> str:
+        system_message = self._summary_prompts("", language)[0]
+        chunks = self._summary_chunks(content)
+        partials = [
+            self._generate(self._map_prompt(chunk, language, i, len(chunks)), max_tokens=self.summary_map_max_tokens,
+                           temperature=0.1, system_message=system_message)
+            for i, chunk in enumerate(chunks, 1)
+        ]
+
+        groups = self._group_partials(partials)
+        while len(groups) > 1:
+            partials = [
+                self._generate(self._reduce_prompt(group, language, final=False), max_tokens=self.summary_reduce_max_tokens,
+                               temperature=0.1, system_message=system_message)
+                for group in groups
+            ]
+            groups = self._group_partials(partials)
+
+        final_prompt = self._reduce_prompt(groups[0], language, final=True)
+        return self._generate_checked(final_prompt, language, max_tokens=self.summary_final_max_tokens,
+                                      temperature=0.1, system_message=system_message)
+
+    async def _areduce_partials(self, content: str, language: str, system_message: str) -> List[str]:
+        """Map chunks and run intermediate reduce passes concurrently.
+
+        Returns the partial summaries that fit into one final reduce prompt.
+        """
+        chunks = await self._run_blocking(self._summary_chunks, content)
+        semaphore = asyncio.Semaphore(self.summary_concurrency)
+
+        async def run(prompt: str, max_tokens: int) -> str:
+            async with semaphore:
+                return await self._agenerate(prompt, max_tokens=max_tokens, temperature=0.1, system_message=system_message)
+
+        partials = await asyncio.gather(*[
+            run(self._map_prompt(chunk, language, i, len(chunks)), self.summary_map_max_tokens)
+            for i, chunk in enumerate(chunks, 1)
+        ])
+
+        groups = self._group_partials(list(partials))
+        while len(groups) > 1:
+            partials = await asyncio.gather(*[
+                run(self._reduce_prompt(group, language, final=False), self.summary_reduce_max_tokens)
+                for group in groups
+            ])
+            groups = self._group_partials(list(partials))
+        return groups[0]
+
+    async def _asummarize_map_reduce(self, content: str, language: str) -> str:
+        system_message = self._summary_prompts("", language)[0]
+        partials = await self._areduce_partials(content, language, system_message)
+
+        final_prompt = self._reduce_prompt(partials, language, final=True)
+        return await self._agenerate_checked(final_prompt, language, max_tokens=self.summary_final_max_tokens,
+                                             temperature=0.1, system_message=system_message)
+
+    async def _astream_map_reduce(self, content: str, language: str) -> AsyncIterator[str]:
+        system_message = self._summary_prompts("", language)[0]
+        partials = await self._areduce_partials(content, language, system_message)
+        async for token in self._astream_checked(self._reduce_prompt(partials, language, final=True), language,
+                                                 max_tokens=self.summary_final_max_tokens, temperature=0.1,
+                                                 system_message=system_message):
+            yield token
+
+    def summarize_content(self, content: str, language: str = "darija", mode: str = "auto") -> str:
+        """Summarize content in specified language.
+
+        `mode` is "single" (one prompt over the first 3000 characters),
+        "map_reduce" (whole document, chunk by chunk) or "auto" (map-reduce
+        only when the document does not fit the single prompt).
+        """
+        if self._use_map_reduce(content, mode):
+            return self._summarize_map_reduce(content, language)
+
+        system_message, prompt = self._single_summary_request(content, language)
+        return self._generate_checked(
+            prompt,
+            language,
+            max_tokens=2000,
+            temperature=0.1,  # Extremely low temperature
+            system_message=system_message
+        )
+
+    async def asummarize_content(self, content: str, language: str = "darija", mode: str = "auto") -> str:
+        """Async version of `summarize_content`; map-stage chunks are summarized concurrently"""
+        if self._use_map_reduce(content, mode):
+            return await self._asummarize_map_reduce(content, language)
+
+        system_message, prompt = self._single_summary_request(content, language)
+        return await self._agenerate_checked(
+            prompt,
+            language,
+            max_tokens=2000,
+            temperature=0.1,  # Extremely low temperature
+            system_message=system_message
+        )
+
+    def astream_summary(self, content: str, language: str = "darija", mode: str = "auto") -> AsyncIterator[str]:
+        """Streaming version of `summarize_content` (tokens are forwarded as generated).
+
+        For map-reduce summaries only the final reduce pass is streamed.
+        """
+        if self._use_map_reduce(content, mode):
+            return self._astream_map_reduce(content, language)
+
+        system_message, prompt = self._single_summary_request(content, language)
+        return self._astream_checked(
+            prompt,
+            language,
+            max_tokens=2000,
+            temperature=0.1,
+            system_message=system_message
+        )
+
+    def _explanation_prompt(self, concept: str, language: str) -> str:
         language_name = self.language_map.get(language, language)
-        
-        explanation_prompt = f"""
+
+        return f"""
         Explain the following concept in simple terms in {language_name} language:
-        
+
         {concept}
-        
+
         Break it down into:
         1. What it is
         2. Why it's important
         3. How it works
         4. Examples
         5. Common misconceptions (if any)
-        
+
         Make it easy for students to understand.
         """
-        
-        prompt_template = PromptTemplate(input_variables=["prompt"], template="{prompt}")
-        if self.provider == "groq":
-            return self.groq.generate(explanation_prompt).strip()
 
-        chain = prompt_template | self.llm | StrOutputParser()
+    def explain_concept(self, concept: str, language: str = "darija") -> str:
+        """Explain a concept in simple terms"""
+        return self._generate_checked(self._explanation_prompt(concept, language), language)
 
-        response = chain.invoke({"prompt": explanation_prompt})
-        return response.strip()
+    async def aexplain_concept(self, concept: str, language: str = "darija") -> str:
+        """Async version of `explain_concept`"""
+        return await self._agenerate_checked(self._explanation_prompt(concept, language), language)
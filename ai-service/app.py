@@ -1,13 +1,30 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
+from typing import List
 import os
 from dotenv import load_dotenv
 from agent import AIAssistant
+from document_store import DocumentStore
+from single_flight import SingleFlight
+from scheduler import FairScheduler, QueueFull, Ticket, INTERACTIVE, DOCUMENT, BULK
+import metrics
 import asyncio
+import functools
+import json
+import logging
+import time
 
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger("ai-service")
+
 app = FastAPI(title="Taalim AI Agent", version="1.0.0")
 
 # CORS middleware
@@ -19,20 +36,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize AI Assistant
+# Initialize AI Assistant (models load lazily; see /warmup)
 ai_assistant = AIAssistant()
 
+# Documents ingested once through POST /documents
+document_store = DocumentStore()
+
+# Identical concurrent requests share one generation (see SINGLE_FLIGHT_ENDPOINTS)
+single_flight = SingleFlight()
+
+# Per-user fair queueing and admission control in front of the LLM provider
+scheduler = FairScheduler(ai_assistant.provider)
+
+# Per-request stage timings in a Server-Timing header (TIMING_HEADER_ENABLED=true)
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "false").lower() == "true"
+
+ENDPOINT_PRIORITIES = {
+    "/ask": INTERACTIVE,
+    "/ask/stream": INTERACTIVE,
+    "/ask-pdf": INTERACTIVE,
+    "/ask-pdf/stream": INTERACTIVE,
+    "/ask-library": INTERACTIVE,
+    "/translate": INTERACTIVE,
+    "/translate/stream": INTERACTIVE,
+    "/summarize": DOCUMENT,
+    "/summarize/stream": DOCUMENT,
+    "/generate-exercise": BULK,
+    "/generate-exercise/stream": BULK,
+}
+
 class QuestionRequest(BaseModel):
     question: str
     language: str = "darija"
     userId: str = None
 
 class PDFQuestionRequest(BaseModel):
-    question: str
-    pdfContent: str
+    question: str = ""
+    pdfContent: str = None
+    documentId: str = None
     language: str = "darija"
     userId: str = None
 
+class DocumentRequest(BaseModel):
+    content: str
+    title: str = None
+    userId: str = None
+    subject: str = None
+    tags: List[str] = None
+
+class LibraryQuestionRequest(BaseModel):
+    question: str
+    userId: str
+    subject: str = None
+    tags: List[str] = None
+    documentIds: List[str] = None
+    language: str = "darija"
+
 class ExerciseRequest(BaseModel):
     topic: str
     subject: str
@@ -40,75 +99,376 @@ class ExerciseRequest(BaseModel):
     numberOfQuestions: int = 5
     userId: str = None
 
+def resolve_pdf_content(request: PDFQuestionRequest) -> str:
+    """Return the document text for a request that sends either documentId or pdfContent"""
+    if request.documentId:
+        content = document_store.get_text(request.documentId)
+        if content is None:
+            raise HTTPException(status_code=404, detail="Document not found; ingest it with POST /documents")
+        return content
+    if request.pdfContent is not None:
+        return request.pdfContent
+    raise HTTPException(status_code=400, detail="Either documentId or pdfContent is required")
+
+def pdf_source(request: PDFQuestionRequest) -> tuple:
+    """(document text, index key) for a question about one document.
+
+    A ready ingested document is answered from its stored index key, so
+    its text is neither read nor hashed again per question; the text
+    comes back as a loader, called only if the index must be rebuilt.
+    """
+    if request.documentId:
+        record = document_store.get(request.documentId)
+        if record is not None and record["status"] == "ready" and record.get("indexKey"):
+            return functools.partial(document_store.get_text, request.documentId), record["indexKey"]
+    content = resolve_pdf_content(request)
+    return content, ai_assistant.index_cache.key_for(content)
+
+def summary_source(request: PDFQuestionRequest) -> tuple[str, str]:
+    """(document text, document id) for a summary; the id stands in for the text in coalescing keys"""
+    content = resolve_pdf_content(request)
+    return content, request.documentId or DocumentStore.document_id(content)
+
+def with_index_keys(documents: List[dict]) -> List[dict]:
+    """Record the index key of documents that were indexed before keys were stored"""
+    for document in documents:
+        if document["status"] == "ready" and not document.get("indexKey"):
+            content = document_store.get_text(document["documentId"])
+            if content is not None:
+                document["indexKey"] = ai_assistant.index_cache.key_for(content)
+                document_store.set_status(document["documentId"], "ready", index_key=document["indexKey"])
+    return documents
+
+async def index_document_task(document_id: str, content: str):
+    """Background job that chunks, embeds and indexes an ingested document"""
+    try:
+        index_key = await ai_assistant.aindex_document(content)
+        document_store.set_status(document_id, "ready", index_key=index_key)
+    except Exception as e:
+        logger.exception(f"An error occurred while indexing document {document_id}: {e}")
+        document_store.set_status(document_id, "failed", str(e))
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Time every request and collect the stage spans recorded while serving it"""
+    timings = metrics.start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "unmatched"
+    elapsed = time.perf_counter() - start
+    metrics.HTTP_SECONDS.observe(elapsed, endpoint=endpoint, status=response.status_code)
+    logger.debug(f"{request.method} {endpoint} {response.status_code} {elapsed:.3f}s {metrics.server_timing_header(timings)}")
+    # Streaming responses only include the stages finished before their first byte
+    if TIMING_HEADER_ENABLED and timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
+def service_metrics():
+    """Cache, coalescing and queue figures read from their components at scrape time"""
+    lines = []
+    if ai_assistant.response_cache is not None:
+        cache = ai_assistant.response_cache.stats()
+        lines += metrics.gauge_lines("ai_semantic_cache_requests_total", "Semantic cache lookups by result",
+                                     {"hit": cache["hits"], "miss": cache["misses"]}, label="result", kind="counter")
+    if ai_assistant.translation_memory is not None:
+        # Scrapes run on the event loop; the row count would query SQLite
+        memory = ai_assistant.translation_memory.counters()
+        lines += metrics.gauge_lines("ai_translation_memory_sentences_total", "Translation memory sentence lookups by result",
+                                     {"hit": memory["hits"], "miss": memory["misses"]}, label="result", kind="counter")
+    flights = single_flight.stats()
+    lines += metrics.gauge_lines("ai_single_flight_requests_total", "Coalescable requests by role",
+                                 {"leader": flights["leaders"], "follower": flights["followers"]}, label="role", kind="counter")
+    queue = scheduler.stats()
+    lines += metrics.gauge_lines("ai_scheduler_running", "Requests holding a scheduler slot",
+                                 {name: figures["running"] for name, figures in queue["classes"].items()}, label="priority")
+    lines += metrics.gauge_lines("ai_scheduler_queued", "Requests waiting for a scheduler slot",
+                                 {name: figures["queued"] for name, figures in queue["classes"].items()}, label="priority")
+    return lines
+
+metrics.register_collector(service_metrics)
+
+async def admit(user_id: str, endpoint: str) -> Ticket:
+    """Wait for a scheduler slot, or answer 429 when the queue is full.
+
+    Every request takes a slot; `single_flight` hands it back as soon as
+    the request joins an identical generation instead of leading one.
+    """
+    try:
+        return await scheduler.acquire(user_id, ENDPOINT_PRIORITIES[endpoint])
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def prepare(ticket: Ticket, func, *args):
+    """Run a request's blocking set-up (file reads, hashing) on the CPU executor.
+
+    Documents can be megabytes, so this never runs on the event loop; the
+    slot is given back if the set-up fails.
+    """
+    try:
+        return await ai_assistant._run_blocking(func, *args)
+    except BaseException:
+        ticket.release()
+        raise
+
+def streaming_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events message"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(tokens, result_key: str, endpoint: str) -> StreamingResponse:
+    """Forward LLM tokens as SSE `token` events, then a final `done` event.
+
+    The `done` event carries the full text under the same key the
+    non-streaming endpoint returns, so clients can reuse their parsing.
+    """
+    async def event_stream():
+        parts = []
+        try:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event({"token": token})
+            yield sse_event({result_key: "".join(parts).strip()}, event="done")
+        except Exception as e:
+            logger.exception(f"An error occurred in {endpoint}: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return streaming_response(event_stream())
+
+@app.on_event("startup")
+async def startup():
+    # Preload models before traffic when requested (AI_WARMUP_ON_STARTUP=true)
+    if os.getenv("AI_WARMUP_ON_STARTUP", "false").lower() == "true":
+        await ai_assistant.awarm_up()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await ai_assistant.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "Taalim AI Agent is running"}
 
+@app.get("/ready")
+async def ready():
+    """Report which lazily loaded components are in memory"""
+    return {"ready": all(ai_assistant.is_ready().values()), "components": ai_assistant.is_ready()}
+
+@app.post("/warmup")
+async def warmup():
+    """Load the provider client, embedding model and FAISS now"""
+    try:
+        components = await ai_assistant.awarm_up()
+        return {"ready": all(components.values()), "components": components}
+    except Exception as e:
+        logger.exception(f"An error occurred in /warmup: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report semantic answer cache, translation memory and request coalescing counters"""
+    extra = {"singleFlight": single_flight.stats()}
+    if ai_assistant.translation_memory is not None:
+        extra["translationMemory"] = await run_in_threadpool(ai_assistant.translation_memory.stats)
+    if ai_assistant.response_cache is None:
+        return {"enabled": False, **extra}
+    return {"enabled": True, **ai_assistant.response_cache.stats(), **extra}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus metrics: stage latency histograms, tokens, retries, caches and queues"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Report scheduler occupancy, rejections and queue-wait percentiles"""
+    return scheduler.stats()
+
+@app.post("/documents")
+async def ingest_document(request: DocumentRequest, background_tasks: BackgroundTasks):
+    """Store a document once and index it in the background; returns its documentId"""
+    try:
+        record, created = document_store.add(request.content, {
+            "title": request.title,
+            "userId": request.userId,
+            "subject": request.subject,
+            "tags": request.tags or [],
+        })
+    except Exception as e:
+        logger.exception(f"An error occurred in /documents: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if created:
+        background_tasks.add_task(index_document_task, record["documentId"], request.content)
+    return {"documentId": record["documentId"], "status": record["status"]}
+
+@app.get("/documents/{document_id}")
+async def get_document(document_id: str, userId: str):
+    """Report the indexing status of a user's ingested document, with only their own metadata"""
+    record = document_store.get_for_user(document_id, userId)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return record
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str, userId: str):
+    """Remove a user's copy of a document; its text and cached index go once no user owns it"""
+    record = document_store.get(document_id)
+    # The text is only needed for records indexed before their key was stored
+    content = document_store.get_text(document_id) if record is not None and not record.get("indexKey") else None
+    record, deleted = document_store.remove_owner(document_id, userId)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if deleted and (record.get("indexKey") or content is not None):
+        await ai_assistant.aforget_document(content, record.get("indexKey"))
+    return {"documentId": document_id, "deleted": True}
+
 @app.post("/ask")
 async def ask_question(request: QuestionRequest):
     """Handle general questions"""
+    inputs = (request.question, request.language)
+    ticket = await admit(request.userId, "/ask")
     try:
-        response = ai_assistant.ask_general(request.question, request.language)
+        response = await single_flight.call("/ask", inputs, lambda: ai_assistant.aask_general(request.question, request.language), release=ticket.release)
         return {"response": response}
     except Exception as e:
-        print(f"An error occurred in /ask: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"An error occurred in /ask: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """Stream the answer to a general question as Server-Sent Events"""
+    inputs = (request.question, request.language)
+    ticket = await admit(request.userId, "/ask/stream")
+    tokens = single_flight.stream("/ask/stream", inputs, lambda: ai_assistant.astream_general(request.question, request.language), release=ticket.release)
+    return sse_response(tokens, "response", "/ask/stream")
+
 @app.post("/ask-pdf")
 async def ask_pdf_question(request: PDFQuestionRequest):
     """Handle questions about specific PDF content"""
+    ticket = await admit(request.userId, "/ask-pdf")
+    pdf_content, doc_key = await prepare(ticket, pdf_source, request)
+    inputs = (request.question, doc_key, request.language)
     try:
-        response = ai_assistant.ask_pdf(request.question, request.pdfContent, request.language)
+        response = await single_flight.call("/ask-pdf", inputs, lambda: ai_assistant.aask_pdf(request.question, pdf_content, request.language, doc_key), release=ticket.release)
         return {"response": response}
     except Exception as e:
-        print(f"An error occurred in /ask-pdf: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"An error occurred in /ask-pdf: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask-pdf/stream")
+async def ask_pdf_question_stream(request: PDFQuestionRequest):
+    """Stream the answer to a PDF question as Server-Sent Events"""
+    ticket = await admit(request.userId, "/ask-pdf/stream")
+    pdf_content, doc_key = await prepare(ticket, pdf_source, request)
+    inputs = (request.question, doc_key, request.language)
+    tokens = single_flight.stream("/ask-pdf/stream", inputs, lambda: ai_assistant.astream_pdf(request.question, pdf_content, request.language, doc_key), release=ticket.release)
+    return sse_response(tokens, "response", "/ask-pdf/stream")
+
+@app.post("/ask-library")
+async def ask_library_question(request: LibraryQuestionRequest):
+    """Answer from all of a user's indexed documents, optionally filtered by subject or tags"""
+    ticket = await admit(request.userId, "/ask-library")
+    # Reads metadata files and may hash legacy documents
+    documents = await prepare(
+        ticket, lambda: with_index_keys(document_store.library(request.userId, request.subject, request.tags, request.documentIds))
+    )
+    if not documents:
+        ticket.release()
+        raise HTTPException(status_code=404, detail="No documents match this library query; ingest them with POST /documents")
+    # Answers cite the user's own titles, so the user is part of the key
+    inputs = (request.userId, request.question, request.language, [document["documentId"] for document in documents])
+    try:
+        return await single_flight.call("/ask-library", inputs, lambda: ai_assistant.aask_library(request.question, documents, request.language), release=ticket.release)
+    except Exception as e:
+        logger.exception(f"An error occurred in /ask-library: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/generate-exercise")
 async def generate_exercise(request: ExerciseRequest):
     """Generate practice exercises"""
+    inputs = (request.topic, request.subject, request.difficulty, request.numberOfQuestions)
+    ticket = await admit(request.userId, "/generate-exercise")
     try:
-        exercise = ai_assistant.generate_exercise(
-            request.topic,
-            request.subject,
-            request.difficulty,
-            request.numberOfQuestions
-        )
+        exercise = await single_flight.call("/generate-exercise", inputs, lambda: ai_assistant.agenerate_exercise(*inputs), release=ticket.release)
         return exercise
     except Exception as e:
-        print(f"An error occurred in /generate-exercise: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"An error occurred in /generate-exercise: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-exercise/stream")
+async def generate_exercise_stream(request: ExerciseRequest):
+    """Stream exercise questions as Server-Sent Events as soon as each one is ready"""
+    inputs = (request.topic, request.subject, request.difficulty, request.numberOfQuestions)
+    ticket = await admit(request.userId, "/generate-exercise/stream")
+    questions = single_flight.stream(
+        "/generate-exercise/stream", inputs,
+        lambda: ai_assistant.astream_exercise_questions(*inputs), release=ticket.release
+    )
+
+    async def event_stream():
+        numbered = []
+        try:
+            async for number, question in questions:
+                numbered.append((number, question))
+                yield sse_event({"number": number, "question": question}, event="question")
+            numbered.sort(key=lambda item: item[0])
+            exercise = ai_assistant.exercise_from_questions(request.topic, [question for _, question in numbered])
+            yield sse_event(exercise, event="done")
+        except Exception as e:
+            logger.exception(f"An error occurred in /generate-exercise/stream: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return streaming_response(event_stream())
+
 @app.post("/translate")
 async def translate_text(request: QuestionRequest):
     """Translate text to specified language"""
+    inputs = (request.question, request.language)
+    ticket = await admit(request.userId, "/translate")
     try:
-        translation = ai_assistant.translate_text(request.question, request.language)
+        translation = await single_flight.call("/translate", inputs, lambda: ai_assistant.atranslate_text(request.question, request.language), release=ticket.release)
         return {"translation": translation}
     except Exception as e:
-        print(f"An error occurred in /translate: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"An error occurred in /translate: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/translate/stream")
+async def translate_text_stream(request: QuestionRequest):
+    """Stream a translation as Server-Sent Events"""
+    inputs = (request.question, request.language)
+    ticket = await admit(request.userId, "/translate/stream")
+    tokens = single_flight.stream("/translate/stream", inputs, lambda: ai_assistant.astream_translation(request.question, request.language), release=ticket.release)
+    return sse_response(tokens, "translation", "/translate/stream")
+
 @app.post("/summarize")
 async def summarize_text(request: PDFQuestionRequest):
     """Summarize PDF content"""
+    ticket = await admit(request.userId, "/summarize")
+    pdf_content, document_id = await prepare(ticket, summary_source, request)
+    inputs = (document_id, request.language)
     try:
-        summary = ai_assistant.summarize_content(request.pdfContent, request.language)
+        summary = await single_flight.call("/summarize", inputs, lambda: ai_assistant.asummarize_content(pdf_content, request.language), release=ticket.release)
         return {"summary": summary}
     except Exception as e:
-        print(f"An error occurred in /summarize: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"An error occurred in /summarize: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/summarize/stream")
+async def summarize_text_stream(request: PDFQuestionRequest):
+    """Stream a PDF summary as Server-Sent Events"""
+    ticket = await admit(request.userId, "/summarize/stream")
+    pdf_content, document_id = await prepare(ticket, summary_source, request)
+    inputs = (document_id, request.language)
+    tokens = single_flight.stream("/summarize/stream", inputs, lambda: ai_assistant.astream_summary(pdf_content, request.language), release=ticket.release)
+    return sse_response(tokens, "summary", "/summarize/stream")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
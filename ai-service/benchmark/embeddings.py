@@ -0,0 +1,158 @@
+"""Accuracy check and throughput benchmark for the embedding backends.
+
+Embeds the same chunks with the current PyTorch model (the reference) and
+with the ONNX Runtime backend, then reports:
+
+- cosine agreement between the two vectors of each chunk (mean, p1, min);
+- top-10 retrieval agreement for queries over the chunks;
+- documents/second for batch indexing and p50 latency of single queries;
+- load time and the resident memory each backend adds.
+
+Exits with status 1 if the mean cosine is below `--min-cosine`, so it can
+gate a model export. Runs offline: point `--reference` at a local copy of
+the model (or rely on the hub cache with HF_HUB_OFFLINE=1).
+
+    python benchmark/embeddings.py --onnx-dir models/all-MiniLM-L6-v2-onnx --reference models/all-MiniLM-L6-v2
+    python benchmark/embeddings.py --onnx-dir models/all-MiniLM-L6-v2-onnx --onnx-file model.onnx --threads 4
+    python benchmark/embeddings.py --onnx-dir models/all-MiniLM-L6-v2-onnx --corpus notes1.txt notes2.txt
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from load_test import percentile, read_rss_kb, synthetic_document  # noqa: E402
+
+
+def load_chunks(args) -> list:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    if args.corpus:
+        texts = []
+        for path in args.corpus:
+            with open(path, encoding="utf-8") as f:
+                texts.append(f.read())
+    else:
+        texts = [synthetic_document(args.pdf_pages, seed) for seed in range(args.documents)]
+    # Same chunking as IndexCache
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    chunks = [chunk for text in texts for chunk in splitter.split_text(text)]
+    return chunks[: args.max_chunks] if args.max_chunks else chunks
+
+
+def timed_load(factory):
+    rss_before = read_rss_kb(os.getpid()) or 0
+    start = time.perf_counter()
+    model = factory()
+    model.embed_query("warm up")
+    load_seconds = time.perf_counter() - start
+    return model, load_seconds, ((read_rss_kb(os.getpid()) or 0) - rss_before) / 1024
+
+
+def measure(name: str, model, chunks: list, queries: list, load_seconds: float, rss_mb: float) -> dict:
+    start = time.perf_counter()
+    vectors = np.asarray(model.embed_documents(chunks), dtype=np.float32)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = []
+    query_vectors = []
+    for query in queries:
+        start = time.perf_counter()
+        query_vectors.append(model.embed_query(query))
+        latencies.append(time.perf_counter() - start)
+
+    stats = {
+        "backend": name,
+        "loadSeconds": round(load_seconds, 3),
+        "addedRssMb": round(rss_mb, 1),
+        "chunksPerSecond": round(len(chunks) / batch_seconds, 2),
+        "queryLatencyP50": round(percentile(latencies, 0.5), 5),
+        "queryLatencyP95": round(percentile(latencies, 0.95), 5),
+    }
+    return {"stats": stats, "vectors": vectors, "queries": np.asarray(query_vectors, dtype=np.float32)}
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def top_k(queries: np.ndarray, vectors: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(normalize(queries) @ normalize(vectors).T), axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reference", default=os.getenv("EMBEDDING_MODEL_DIR") or "all-MiniLM-L6-v2",
+                        help="model name or local directory for the PyTorch reference")
+    parser.add_argument("--onnx-dir", required=True, help="directory written by export_onnx_embeddings.py")
+    parser.add_argument("--onnx-file", help="ONNX file in --onnx-dir (default: model_int8.onnx, else model.onnx)")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads for both backends (0: library default)")
+    parser.add_argument("--max-seq-length", type=int, default=256)
+    parser.add_argument("--corpus", nargs="*", help="text files to chunk instead of synthetic course text")
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--max-chunks", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    os.environ["EMBED_THREADS"] = str(args.threads)
+    os.environ["EMBED_MAX_SEQ_LENGTH"] = str(args.max_seq_length)
+    if args.onnx_file:
+        os.environ["EMBEDDING_ONNX_FILE"] = args.onnx_file
+    from embedding_backends import create_embeddings, onnx_model_path
+
+    chunks = load_chunks(args)
+    rng = random.Random(0)
+    # Queries are sentences taken from random chunks, so each has a known relevant chunk
+    queries = [rng.choice([s for s in rng.choice(chunks).split(". ") if s] or ["empty"]) for _ in range(args.queries)]
+    print(f"{len(chunks)} chunks, {len(queries)} queries")
+
+    # ONNX first, so its memory figure is not inflated by torch already being loaded
+    onnx_model, onnx_load, onnx_rss = timed_load(lambda: create_embeddings("onnx", args.reference, args.onnx_dir))
+    candidate = measure(f"onnx:{os.path.basename(onnx_model_path(args.onnx_dir))}", onnx_model, chunks, queries, onnx_load, onnx_rss)
+    reference_model, reference_load, reference_rss = timed_load(lambda: create_embeddings("huggingface", args.reference, ""))
+    reference = measure("huggingface", reference_model, chunks, queries, reference_load, reference_rss)
+
+    cosines = np.sum(normalize(reference["vectors"]) * normalize(candidate["vectors"]), axis=1)
+    k = min(10, len(chunks))
+    reference_top = top_k(reference["queries"], reference["vectors"], k)
+    candidate_top = top_k(candidate["queries"], candidate["vectors"], k)
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(reference_top, candidate_top)])
+
+    report = {
+        "chunks": len(chunks),
+        "queries": len(queries),
+        "accuracy": {
+            "cosineMean": round(float(cosines.mean()), 5),
+            "cosineP1": round(float(np.percentile(cosines, 1)), 5),
+            "cosineMin": round(float(cosines.min()), 5),
+            f"top{k}Agreement": round(float(overlap), 4),
+        },
+        "backends": [reference["stats"], candidate["stats"]],
+    }
+    print(json.dumps(report, indent=2))
+    speedup = candidate["stats"]["chunksPerSecond"] / reference["stats"]["chunksPerSecond"]
+    print(f"\nONNX indexes {speedup:.2f}x as many chunks per second as the PyTorch model")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if cosines.mean() < args.min_cosine:
+        print(f"FAIL: mean cosine {cosines.mean():.5f} is below {args.min_cosine}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
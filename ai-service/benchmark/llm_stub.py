@@ -0,0 +1,213 @@
+"""Stand-in LLM server for offline benchmarks.
+
+Serves the OpenAI-compatible `/v1/chat/completions` API (used through
+`GroqClient`) and the Ollama `/api/generate` and `/api/chat` APIs (used through
+`OllamaLLM`), streaming and non-streaming, with configurable first-token
+latency, token rate and injected errors.
+
+Answers look enough like the real thing for the service to accept them:
+exercise prompts get valid JSON questions, numbered translation prompts get
+numbered lines, and the vocabulary follows the language the prompt asks for.
+
+    python benchmark/llm_stub.py --port 9900 --first-token-latency 0.3 --tokens-per-second 80 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = {
+    "english": "the cell uses light energy to turn water and carbon dioxide into sugar and oxygen for growth".split(),
+    "french": "la cellule utilise la lumière pour transformer eau et dioxyde de carbone en sucre et oxygène".split(),
+    "arabic": "تستعمل الخلية ضوء الشمس لتحويل الماء وثاني أكسيد الكربون إلى سكر وأكسجين".split(),
+}
+
+_ARABIC_RE = re.compile(r"[؀-ۿ]")
+# "Answer the question in French", "Translate ... to English", "EN FRANÇAIS"
+_TARGET_RE = re.compile(r"\b(?:in|to|en)\s+(English|French|Français|Arabic|Moroccan)\b", re.IGNORECASE)
+_QUESTION_RANGE_RE = re.compile(r"questions (\d+) to (\d+)")
+_NUMBERED_RE = re.compile(r"^(\d+)\. ", re.MULTILINE)
+
+
+class StubConfig:
+    def __init__(self, first_token_latency: float = 0.3, tokens_per_second: float = 50.0, completion_tokens: int = 200,
+                 jitter: float = 0.2, error_rate: float = 0.0, error_status: int = 429, retry_after: float = 1.0, seed: int = 0):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+
+def prompt_language(prompt: str) -> str:
+    """Guess the answer language the service asked for"""
+    match = _TARGET_RE.search(prompt)
+    if match:
+        name = match.group(1).lower()
+        return "french" if name in ("french", "français") else "english" if name == "english" else "arabic"
+    return "arabic" if _ARABIC_RE.search(prompt[:400]) else "english"
+
+
+def completion_tokens(prompt: str, config: StubConfig) -> list:
+    """Token list for a plausible answer to `prompt`"""
+    words = WORDS[prompt_language(prompt)]
+    rng = config.random
+
+    if "Respond with JSON only" in prompt:
+        match = _QUESTION_RANGE_RE.search(prompt)
+        count = int(match.group(2)) - int(match.group(1)) + 1 if match else 1
+        questions = [
+            json.dumps({
+                "question": " ".join(rng.choices(words, k=8)) + "?",
+                "options": [" ".join(rng.choices(words, k=3)) for _ in range(4)],
+                "correctAnswer": rng.choice("ABCD"),
+                "explanation": " ".join(rng.choices(words, k=15)),
+            }, ensure_ascii=False)
+            for _ in range(count)
+        ]
+        text = "\n".join(questions)
+        # JSON is streamed in ~4-character pieces, like real BPE tokens
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    numbers = _NUMBERED_RE.findall(prompt)
+    if len(numbers) > 1:
+        lines = [f"{number}. " + " ".join(rng.choices(words, k=10)) + "." for number in numbers]
+        return [token + " " for token in "\n".join(lines).split(" ")]
+
+    return [word + " " for word in rng.choices(words, k=config.completion_tokens)]
+
+
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="LLM stand-in")
+    stats = {"requests": 0, "errors": 0, "completion_tokens": 0}
+
+    def injected_error():
+        if config.error_rate and config.random.random() < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                {"error": {"message": "injected error"}},
+                status_code=config.error_status,
+                headers={"Retry-After": str(config.retry_after)},
+            )
+        return None
+
+    def delay(seconds: float) -> float:
+        return max(0.0, seconds * (1 + config.random.uniform(-config.jitter, config.jitter)))
+
+    async def paced(tokens):
+        """Yield tokens after the first-token latency, then at the configured rate"""
+        await asyncio.sleep(delay(config.first_token_latency))
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        start = time.perf_counter()
+        for index, token in enumerate(tokens):
+            wait = start + index * interval - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield token
+        stats["completion_tokens"] += len(tokens)
+
+    async def full_text(tokens) -> str:
+        return "".join([token async for token in paced(tokens)])
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        stats["requests"] += 1
+        error = injected_error()
+        if error is not None:
+            return error
+        body = await request.json()
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        tokens = completion_tokens(prompt, config)
+        if body.get("max_tokens") and "Respond with JSON only" not in prompt:
+            tokens = tokens[: body["max_tokens"]]
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(tokens), "total_tokens": len(prompt) // 4 + len(tokens)}
+
+        if body.get("stream"):
+            async def events():
+                async for token in paced(tokens):
+                    yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}, ensure_ascii=False) + "\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        text = await full_text(tokens)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    async def ollama_response(body: dict, prompt: str, chat: bool):
+        stats["requests"] += 1
+        error = injected_error()
+        if error is not None:
+            return error
+        tokens = completion_tokens(prompt, config)
+        final = {"model": body.get("model"), "created_at": "1970-01-01T00:00:00Z", "done": True, "done_reason": "stop",
+                 "prompt_eval_count": len(prompt) // 4, "eval_count": len(tokens)}
+
+        def piece(text: str) -> dict:
+            base = {"model": body.get("model"), "created_at": "1970-01-01T00:00:00Z", "done": False}
+            if chat:
+                return {**base, "message": {"role": "assistant", "content": text}}
+            return {**base, "response": text}
+
+        if body.get("stream", True):
+            async def lines():
+                async for token in paced(tokens):
+                    yield json.dumps(piece(token), ensure_ascii=False) + "\n"
+                yield json.dumps({**piece(""), **final}) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        return {**piece(await full_text(tokens)), **final}
+
+    @app.post("/api/generate")
+    async def ollama_generate(request: Request):
+        body = await request.json()
+        return await ollama_response(body, body.get("prompt", ""), chat=False)
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        prompt = "\n".join(message.get("content", "") for message in body.get("messages", []))
+        return await ollama_response(body, prompt, chat=True)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--completion-tokens", type=int, default=200, help="length of free-text answers")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative latency jitter")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    config = StubConfig(args.first_token_latency, args.tokens_per_second, args.completion_tokens, args.jitter,
+                        args.error_rate, args.error_status, args.retry_after, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""Offline load test for the AI service.
+
+Starts the stand-in LLM server (`llm_stub.py`) and the service (`serve.py`)
+as subprocesses on free local ports, drives each endpoint at every
+requested concurrency level, and writes throughput, latency percentiles,
+time-to-first-token (streaming endpoints) and the service's peak RSS to a
+JSON file, tagged with the current git commit so runs can be compared.
+Needs no network, GPU, Groq key or Ollama daemon.
+
+    cd ai-service
+    python benchmark/load_test.py --concurrency 1,8,32 --requests 64
+    python benchmark/load_test.py --provider ollama --endpoints ask,ask-stream --error-rate 0.05
+    python benchmark/load_test.py --compare benchmark/results/<earlier run>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Vocabulary for synthetic course material; ~3000 characters make one PDF page
+_TOPIC_WORDS = (
+    "photosynthesis chlorophyll membrane enzyme equation derivative integral vector matrix energy force "
+    "momentum velocity acceleration reaction molecule atom electron cell nucleus protein function limit "
+    "theorem proof probability statistics variable hypothesis experiment result analysis"
+).split()
+_FILLER_WORDS = "the of and a in to is that for on with as by this are be which from at an it".split()
+
+
+def synthetic_document(pages: int, seed: int) -> str:
+    """Deterministic course-like text of about `pages` PDF pages"""
+    rng = random.Random(seed)
+    paragraphs = []
+    size = 0
+    while size < pages * 3000:
+        sentences = []
+        for _ in range(rng.randint(3, 7)):
+            words = [rng.choice(_TOPIC_WORDS if rng.random() < 0.3 else _FILLER_WORDS) for _ in range(rng.randint(8, 24))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], fraction: float) -> float | None:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def read_rss_kb(pid: int) -> int | None:
+    """Current resident set size of a process in kB (Linux /proc, else psutil if installed)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss // 1024
+    except Exception:
+        return None
+
+
+class Scenario:
+    """One endpoint with a payload factory; `stream` endpoints are read as SSE"""
+    def __init__(self, name: str, path: str, payload, stream: bool = False):
+        self.name = name
+        self.path = path
+        self.payload = payload
+        self.stream = stream
+
+
+def build_scenarios(args, documents: List[str]) -> Dict[str, Scenario]:
+    def question(i: int) -> str:
+        # Unique text so the semantic cache and single-flight do not hide the work
+        return f"Question {i}: explain the role of {_TOPIC_WORDS[i % len(_TOPIC_WORDS)]} in this course, part {i}"
+
+    def document(i: int) -> str:
+        return documents[i % len(documents)]
+
+    def pdf(i: int) -> Dict[str, Any]:
+        return {"question": question(i), "pdfContent": document(i), "language": args.language, "userId": f"user-{i % args.users}"}
+
+    def general(i: int) -> Dict[str, Any]:
+        return {"question": question(i), "language": args.language, "userId": f"user-{i % args.users}"}
+
+    def translation(i: int) -> Dict[str, Any]:
+        text = document(i)[: args.translate_chars]
+        return {"question": f"{text} ({i})", "language": args.language, "userId": f"user-{i % args.users}"}
+
+    def exercise(i: int) -> Dict[str, Any]:
+        return {"topic": f"{_TOPIC_WORDS[i % len(_TOPIC_WORDS)]} {i}", "subject": "science", "difficulty": "medium",
+                "numberOfQuestions": args.exercise_questions, "userId": f"user-{i % args.users}"}
+
+    def summary(i: int) -> Dict[str, Any]:
+        return {"pdfContent": document(i) + f"\n\n({i})", "language": args.language, "userId": f"user-{i % args.users}"}
+
+    def ingest(i: int) -> Dict[str, Any]:
+        return {"content": document(i) + f"\n\n({i})", "title": f"doc {i}", "userId": f"user-{i % args.users}"}
+
+    scenarios = [
+        Scenario("ask", "/ask", general),
+        Scenario("ask-stream", "/ask/stream", general, stream=True),
+        Scenario("ask-pdf", "/ask-pdf", pdf),
+        Scenario("ask-pdf-stream", "/ask-pdf/stream", pdf, stream=True),
+        Scenario("translate", "/translate", translation),
+        Scenario("translate-stream", "/translate/stream", translation, stream=True),
+        Scenario("summarize", "/summarize", summary),
+        Scenario("summarize-stream", "/summarize/stream", summary, stream=True),
+        Scenario("exercise", "/generate-exercise", exercise),
+        Scenario("exercise-stream", "/generate-exercise/stream", exercise, stream=True),
+        Scenario("documents", "/documents", ingest),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+async def run_request(client: httpx.AsyncClient, scenario: Scenario, i: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"ttft": None}
+    try:
+        if not scenario.stream:
+            response = await client.post(scenario.path, json=scenario.payload(i))
+            result["status"] = response.status_code
+            result["ok"] = response.status_code == 200
+        else:
+            async with client.stream("POST", scenario.path, json=scenario.payload(i)) as response:
+                result["status"] = response.status_code
+                done = failed = False
+                async for line in response.aiter_lines():
+                    if line.startswith("data:") and result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - start
+                    elif line == "event: done":
+                        done = True
+                    elif line == "event: error":
+                        failed = True
+                result["ok"] = response.status_code == 200 and done and not failed
+    except httpx.HTTPError as e:
+        result["status"] = type(e).__name__
+        result["ok"] = False
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def run_scenario(base_url: str, scenario: Scenario, concurrency: int, requests: int, offset: int, pid: int, timeout: float) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    peak_rss = read_rss_kb(pid) or 0
+    stop = asyncio.Event()
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not stop.is_set():
+            peak_rss = max(peak_rss, read_rss_kb(pid) or 0)
+            await asyncio.sleep(0.05)
+
+    async def limited(client, i):
+        async with semaphore:
+            return await run_request(client, scenario, offset + i)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        sampler = asyncio.create_task(sample_rss())
+        start = time.perf_counter()
+        results = await asyncio.gather(*(limited(client, i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    status_counts: Dict[str, int] = {}
+    for r in results:
+        status_counts[str(r["status"])] = status_counts.get(str(r["status"]), 0) + 1
+
+    summary = {
+        "endpoint": scenario.path,
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(ok),
+        "errors": requests - len(ok),
+        "statusCounts": status_counts,
+        "elapsedSeconds": round(elapsed, 3),
+        "throughputRps": round(len(ok) / elapsed, 3) if elapsed else None,
+        "peakRssMb": round(peak_rss / 1024, 1) if peak_rss else None,
+    }
+    for label, values in (("latency", latencies), ("ttft", ttfts)):
+        for name, fraction in (("P50", 0.5), ("P95", 0.95), ("P99", 0.99)):
+            value = percentile(values, fraction)
+            summary[f"{label}{name}"] = round(value, 4) if value is not None else None
+    return summary
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: List[Dict[str, Any]], previous_path: str) -> None:
+    """Print p95 latency and throughput changes against an earlier result file"""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {previous_path}:")
+    for result in current:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        changes = []
+        for key in ("latencyP95", "ttftP95", "throughputRps", "peakRssMb"):
+            if result.get(key) and before.get(key):
+                changes.append(f"{key} {before[key]} -> {result[key]} ({(result[key] / before[key] - 1) * 100:+.1f}%)")
+        print(f"  {result['scenario']:<18} c={result['concurrency']:<4} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="all", help="comma-separated scenario names, or 'all'")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="requests per endpoint and concurrency level")
+    parser.add_argument("--provider", choices=["groq", "ollama"], default="groq", help="which stand-in API the service talks to")
+    parser.add_argument("--embeddings", choices=["model", "hash"], default="hash", help="see serve.py")
+    parser.add_argument("--language", default="english")
+    parser.add_argument("--users", type=int, default=8, help="distinct userIds to spread requests over")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--documents", type=int, default=4, help="distinct PDFs; each is indexed once, then served from cache")
+    parser.add_argument("--translate-chars", type=int, default=1500)
+    parser.add_argument("--exercise-questions", type=int, default=5)
+    parser.add_argument("--first-token-latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--completion-tokens", type=int, default=150)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout in seconds")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the service, e.g. SCHEDULER_CONCURRENCY=16")
+    parser.add_argument("--output", help="result file (default: benchmark/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    documents = [synthetic_document(args.pdf_pages, seed) for seed in range(args.documents)]
+    scenarios = build_scenarios(args, documents)
+    names = list(scenarios) if args.endpoints == "all" else [name.strip() for name in args.endpoints.split(",")]
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        parser.error(f"unknown endpoints {unknown}; choose from {list(scenarios)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    stub_port, service_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="ai-bench-")
+    env = {
+        **os.environ,
+        "LLM_PROVIDER": args.provider,
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_API_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "INDEX_CACHE_DIR": os.path.join(workdir, "index_cache"),
+        "DOCUMENT_STORE_DIR": os.path.join(workdir, "documents"),
+        "TRANSLATION_MEMORY_PATH": os.path.join(workdir, "translation_memory.sqlite3"),
+        "HF_HUB_OFFLINE": "1",
+        "TRANSFORMERS_OFFLINE": "1",
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARK_DIR, "llm_stub.py"), "--port", str(stub_port),
+        "--first-token-latency", str(args.first_token_latency), "--tokens-per-second", str(args.tokens_per_second),
+        "--completion-tokens", str(args.completion_tokens), "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+    ])
+    service = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARK_DIR, "serve.py"), "--port", str(service_port), "--embeddings", args.embeddings],
+        cwd=SERVICE_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{service_port}"
+    results = []
+    try:
+        wait_for(f"http://127.0.0.1:{stub_port}/stats", stub, 30)
+        wait_for(f"{base_url}/", service, 120)
+        httpx.post(f"{base_url}/warmup", timeout=600).raise_for_status()
+
+        offset = 0
+        for name in names:
+            for level in levels:
+                summary = asyncio.run(run_scenario(base_url, scenarios[name], level, args.requests, offset, service.pid, args.timeout))
+                offset += args.requests
+                results.append(summary)
+                print(f"{name:<18} c={level:<4} ok={summary['ok']:<4} err={summary['errors']:<3} "
+                      f"rps={summary['throughputRps']} p50={summary['latencyP50']} p95={summary['latencyP95']} "
+                      f"p99={summary['latencyP99']} ttft50={summary['ttftP50']} rss={summary['peakRssMb']}MB", flush=True)
+        stub_stats = httpx.get(f"http://127.0.0.1:{stub_port}/stats").json()
+    finally:
+        service.terminate()
+        stub.terminate()
+        service.wait(timeout=30)
+        stub.wait(timeout=30)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "upstream": stub_stats,
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
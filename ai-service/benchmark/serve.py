@@ -0,0 +1,41 @@
+"""Run the AI service for a benchmark.
+
+With `--embeddings hash` the sentence-transformers model is replaced by a
+deterministic hashing embedder, so the benchmark also runs on machines
+where the model has never been downloaded (no network). Embedding costs
+are then not representative; use `--embeddings model` with a cached model
+to measure them.
+
+    python benchmark/serve.py --port 8101 --embeddings hash
+"""
+import argparse
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from hashing_embeddings import HashingEmbeddings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--embeddings", choices=["model", "hash"], default="hash")
+    args = parser.parse_args()
+
+    if args.embeddings == "hash":
+        import langchain_community.embeddings
+
+        langchain_community.embeddings.HuggingFaceEmbeddings = lambda **kwargs: HashingEmbeddings()
+
+    import uvicorn
+    from app import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
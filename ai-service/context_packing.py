@@ -0,0 +1,136 @@
+import logging
+import os
+import re
+from typing import Callable, List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rough BPE behaviour without a tokenizer file: words split every ~4 characters,
+# each punctuation mark is its own token
+_TOKEN_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+class TokenCounter:
+    """Counts prompt tokens locally.
+
+    Notes:
+    - With `CONTEXT_TOKENIZER` pointing at a `tokenizer.json` (for example
+      the one shipped with the Llama model used on Groq/Ollama) counts are
+      exact for that model.
+    - Otherwise a regex approximation is used, which slightly overestimates
+      for English/French and is close for Arabic; that is the safe side for
+      a budget.
+    """
+    def __init__(self, tokenizer_path: str | None = None):
+        tokenizer_path = tokenizer_path if tokenizer_path is not None else os.getenv("CONTEXT_TOKENIZER", "")
+        self._tokenizer = None
+        if tokenizer_path:
+            try:
+                from tokenizers import Tokenizer
+                self._tokenizer = Tokenizer.from_file(tokenizer_path)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer {tokenizer_path}, using approximate counts: {e}")
+
+    def count(self, text: str) -> int:
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECE_RE.findall(text))
+
+
+def overlap_length(left: str, right: str, max_overlap: int) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`"""
+    tail = left[-max_overlap:]
+    for start in range(len(tail)):
+        if right.startswith(tail[start:]):
+            return len(tail) - start
+    return 0
+
+
+class ContextPacker:
+    """Turns ranked chunks into the smallest useful RAG context.
+
+    Candidates are visited in MMR order (relevance traded off against
+    similarity to chunks already chosen), near-duplicates are dropped,
+    neighbouring chunks are merged so their shared overlap is sent once, and
+    chunks are added until `token_budget` is reached. The packed passages are
+    returned in document order.
+    """
+    def __init__(self, token_budget: int | None = None, dedup_threshold: float | None = None,
+                 mmr_lambda: float | None = None, max_overlap: int = 400, token_counter: TokenCounter | None = None):
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        self.dedup_threshold = dedup_threshold if dedup_threshold is not None else float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+        self.max_overlap = max_overlap
+        self.token_counter = token_counter or TokenCounter()
+
+    def _mmr_order(self, hits: List[tuple[int, float]], vectors: np.ndarray) -> List[int]:
+        """Indices into `hits` in MMR order, skipping near-duplicates"""
+        scores = np.array([score for _, score in hits], dtype=np.float32)
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = vectors / np.where(norms > 0, norms, 1)
+        similarity = unit @ unit.T
+
+        order: List[int] = []
+        remaining = list(range(len(hits)))
+        while remaining:
+            best, best_score = None, None
+            for i in remaining:
+                max_sim = max((similarity[i, j] for j in order), default=0.0)
+                mmr = self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * max_sim
+                if best_score is None or mmr > best_score:
+                    best, best_score = i, mmr
+            remaining.remove(best)
+            adjacent = any(abs(hits[best][0] - hits[j][0]) == 1 for j in order)
+            # Adjacent chunks share their overlap on purpose; they get merged, not dropped
+            if not adjacent and any(similarity[best, j] >= self.dedup_threshold for j in order):
+                continue
+            order.append(best)
+        return order
+
+    def _merge(self, chunk_ids: List[int], chunks: Sequence[str], label: Callable[[int], str] | None = None) -> List[str]:
+        """Join runs of consecutive chunks, keeping their shared overlap once"""
+        passages: List[str] = []
+        previous = None
+        for chunk_id in sorted(chunk_ids):
+            chunk = chunks[chunk_id]
+            if previous is not None and chunk_id == previous + 1:
+                overlap = overlap_length(passages[-1], chunk, self.max_overlap)
+                passages[-1] += chunk[overlap:] if overlap else "\n" + chunk
+            else:
+                passages.append(f"[{label(chunk_id)}]\n{chunk}" if label is not None else chunk)
+            previous = chunk_id
+        return passages
+
+    def pack(self, hits: List[tuple[int, float]], chunks: Sequence[str], vectors: np.ndarray | None = None) -> str:
+        """Build the context string for ranked `hits` of (chunk id, score) over `chunks`"""
+        return self.select(hits, chunks, vectors)[0]
+
+    def select(self, hits: List[tuple[int, float]], chunks: Sequence[str], vectors: np.ndarray | None = None,
+               label: Callable[[int], str] | None = None) -> tuple[str, List[int]]:
+        """Like `pack`, but also returns the chunk ids that made it into the context.
+
+        `label` names the source of a chunk id; each passage then starts with
+        it in brackets, e.g. "[Source 2: Chapter 3]".
+        """
+        if not hits:
+            return "", []
+        order = self._mmr_order(hits, vectors) if vectors is not None and len(vectors) == len(hits) else range(len(hits))
+
+        selected: List[int] = []
+        context = ""
+        for i in order:
+            candidate = selected + [hits[i][0]]
+            candidate_context = "\n\n".join(self._merge(candidate, chunks, label))
+            if self.token_counter.count(candidate_context) > self.token_budget:
+                if selected:
+                    continue
+                # Even the best chunk is over budget: send a proportional prefix of it
+                tokens = self.token_counter.count(candidate_context)
+                return candidate_context[: max(1, len(candidate_context) * self.token_budget // tokens)], candidate
+            selected, context = candidate, candidate_context
+        return context, selected
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List
+
+
+class DocumentStore:
+    """Registry of ingested documents so clients send PDF text only once.
+
+    Notes:
+    - A document id is the SHA-256 of its text, so ingesting the same PDF
+      twice is idempotent and returns the same id.
+    - Text and metadata are written under `DOCUMENT_STORE_DIR`, which lets
+      summaries read the full text and survives service restarts.
+    - `status` moves from "indexing" to "ready" (or "failed") once the
+      background chunk/embed/index job finishes; a ready record keeps the
+      `indexKey` of its cached index.
+    - The same PDF uploaded by several users is stored once; each user's
+      title, subject and tags live under `owners[userId]`, and `library`
+      lists a user's documents from an in-memory per-user index.
+      `remove_owner` drops one user's entry and deletes the files only
+      when it was the last one. Users only ever see their own entry
+      (`get_for_user`, `library`), never the other owners.
+    - Several worker processes may share one directory: cached records are
+      checked against their file's mtime, and the per-user index is rebuilt
+      when the directory changes, so writes by other workers are seen.
+    """
+    def __init__(self, store_dir: str | None = None):
+        self.store_dir = store_dir if store_dir is not None else os.getenv("DOCUMENT_STORE_DIR", ".documents")
+        os.makedirs(self.store_dir, exist_ok=True)
+        # document id -> (metadata file mtime, record)
+        self._records: Dict[str, tuple[int, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        # userId -> document ids, built from the metadata files on first use
+        self._by_user: Dict[str, set] | None = None
+        self._by_user_mtime = 0
+
+    @staticmethod
+    def document_id(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _text_path(self, document_id: str) -> str:
+        return os.path.join(self.store_dir, f"{document_id}.txt")
+
+    def _meta_path(self, document_id: str) -> str:
+        return os.path.join(self.store_dir, f"{document_id}.json")
+
+    @staticmethod
+    def _valid_id(document_id: str) -> bool:
+        # Ids are hex digests; anything else must never reach the filesystem
+        return len(document_id) == 64 and all(c in "0123456789abcdef" for c in document_id)
+
+    def add(self, text: str, metadata: Dict[str, Any] | None = None) -> tuple[Dict[str, Any], bool]:
+        """Store a document; returns (record, created) where created is False if it is already indexed"""
+        metadata = metadata or {}
+        document_id = self.document_id(text)
+        existing = self.get(document_id)
+        owners = self._owners(existing) if existing is not None else {}
+        if metadata.get("userId"):
+            owners[str(metadata["userId"])] = {
+                "title": metadata.get("title"),
+                "subject": metadata.get("subject"),
+                "tags": list(metadata.get("tags") or []),
+            }
+        if existing is not None and existing["status"] == "ready":
+            if owners != existing.get("owners"):
+                existing["owners"] = owners
+                self._write_record(existing)
+            return existing, False
+
+        record = {
+            "documentId": document_id,
+            "status": "indexing",
+            "chars": len(text),
+            "createdAt": time.time(),
+            **metadata,
+            "owners": owners,
+        }
+        with open(self._text_path(document_id), "w", encoding="utf-8") as f:
+            f.write(text)
+        self._write_record(record)
+        return record, True
+
+    def get(self, document_id: str) -> Dict[str, Any] | None:
+        if not self._valid_id(document_id):
+            return None
+        path = self._meta_path(document_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._records.get(document_id)
+        if entry is not None and entry[0] == mtime:
+            return dict(entry[1])
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        with self._lock:
+            self._records[document_id] = (mtime, record)
+        return dict(record)
+
+    def get_for_user(self, document_id: str, user_id: str) -> Dict[str, Any] | None:
+        """The record as one owner sees it; None if the document does not exist or they do not own it"""
+        record = self.get(document_id)
+        if record is None:
+            return None
+        owner = self._owners(record).get(str(user_id))
+        if owner is None:
+            return None
+        return self._owner_view(record, str(user_id), owner)
+
+    def get_text(self, document_id: str) -> str | None:
+        if not self._valid_id(document_id):
+            return None
+        try:
+            with open(self._text_path(document_id), encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set_status(self, document_id: str, status: str, error: str | None = None, index_key: str | None = None) -> None:
+        record = self.get(document_id)
+        if record is None:
+            return
+        record["status"] = status
+        if index_key is not None:
+            record["indexKey"] = index_key
+        if error is not None:
+            record["error"] = error
+        else:
+            record.pop("error", None)
+        self._write_record(record)
+
+    def delete(self, document_id: str) -> bool:
+        if not self._valid_id(document_id):
+            return False
+        with self._lock:
+            self._records.pop(document_id, None)
+            if self._by_user is not None:
+                for documents in self._by_user.values():
+                    documents.discard(document_id)
+        removed = False
+        for path in (self._text_path(document_id), self._meta_path(document_id)):
+            try:
+                os.remove(path)
+                removed = True
+            except OSError:
+                pass
+        return removed
+
+    def remove_owner(self, document_id: str, user_id: str) -> tuple[Dict[str, Any] | None, bool]:
+        """Drop a user's claim on a document; returns (record, deleted).
+
+        The record is None when the document does not exist or the user does
+        not own it; deleted is True once nobody owns it any more.
+        """
+        record = self.get(document_id)
+        if record is None:
+            return None, False
+        user_id = str(user_id)
+        owners = self._owners(record)
+        if user_id not in owners:
+            return None, False
+        owners.pop(user_id, None)
+        if not owners:
+            self.delete(document_id)
+            return record, True
+
+        record["owners"] = owners
+        if str(record.get("userId")) == user_id:
+            # The first uploader's metadata is also kept at the top level
+            for field in ("userId", "title", "subject", "tags"):
+                record.pop(field, None)
+        self._write_record(record)
+        with self._lock:
+            if self._by_user is not None and user_id in self._by_user:
+                self._by_user[user_id].discard(document_id)
+        return record, False
+
+    def _write_record(self, record: Dict[str, Any]) -> None:
+        path = self._meta_path(record["documentId"])
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._records[record["documentId"]] = (mtime, dict(record))
+            if self._by_user is not None:
+                self._index_owners(record)
+
+    @staticmethod
+    def _owner_view(record: Dict[str, Any], user_id: str, owner: Dict[str, Any]) -> Dict[str, Any]:
+        """Shared fields of a record with one owner's metadata, without the other owners"""
+        view = {field: value for field, value in record.items() if field not in ("owners", "userId", "title", "subject", "tags")}
+        return {**view, **owner, "userId": user_id}
+
+    @staticmethod
+    def _owners(record: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """Per-user metadata; records written before `owners` existed have a single userId"""
+        if "owners" in record:
+            return dict(record["owners"])
+        if record.get("userId"):
+            return {str(record["userId"]): {"title": record.get("title"), "subject": None, "tags": []}}
+        return {}
+
+    def _index_owners(self, record: Dict[str, Any]) -> None:
+        for user_id in self._owners(record):
+            self._by_user.setdefault(user_id, set()).add(record["documentId"])
+
+    def _user_index(self) -> Dict[str, set]:
+        # Adding or rewriting a metadata file (here or in another worker) changes the directory
+        directory_mtime = os.stat(self.store_dir).st_mtime_ns
+        with self._lock:
+            if self._by_user is not None and self._by_user_mtime == directory_mtime:
+                return self._by_user
+        by_user: Dict[str, set] = {}
+        for name in os.listdir(self.store_dir):
+            document_id, extension = os.path.splitext(name)
+            if extension != ".json" or not self._valid_id(document_id):
+                continue
+            record = self.get(document_id)
+            for user_id in self._owners(record or {}):
+                by_user.setdefault(user_id, set()).add(document_id)
+        with self._lock:
+            if self._by_user is None or self._by_user_mtime != directory_mtime:
+                self._by_user = by_user
+                self._by_user_mtime = directory_mtime
+                # Records written while the directory was being scanned
+                for _, record in self._records.values():
+                    self._index_owners(record)
+            return self._by_user
+
+    def library(self, user_id: str, subject: str | None = None, tags: Iterable[str] | None = None,
+                document_ids: Iterable[str] | None = None) -> List[Dict[str, Any]]:
+        """A user's documents, optionally narrowed to a subject, any of `tags`, or given ids.
+
+        Each record gets the user's own `title`, `subject` and `tags`.
+        """
+        user_id = str(user_id)
+        wanted_tags = {tag.lower() for tag in tags or []}
+        candidates = set(self._user_index().get(user_id, ()))
+        if document_ids is not None:
+            candidates &= set(document_ids)
+
+        records = []
+        for document_id in sorted(candidates):
+            record = self.get(document_id)
+            owner = self._owners(record).get(user_id) if record is not None else None
+            if owner is None:
+                continue
+            if subject and (owner.get("subject") or "").lower() != subject.lower():
+                continue
+            if wanted_tags and not wanted_tags & {tag.lower() for tag in owner.get("tags") or []}:
+                continue
+            records.append(self._owner_view(record, user_id, owner))
+        return records
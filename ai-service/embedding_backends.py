@@ -0,0 +1,142 @@
+import logging
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Values of EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = ("huggingface", "onnx")
+
+# Files looked up in an ONNX model directory, quantized first
+ONNX_MODEL_FILES = ("model_int8.onnx", "model.onnx")
+
+
+def _threads() -> int:
+    return int(os.getenv("EMBED_THREADS", "0"))
+
+
+def _max_seq_length() -> int:
+    # all-MiniLM-L6-v2 was trained on 256-token inputs; a 1000-character chunk is ~250 tokens
+    return int(os.getenv("EMBED_MAX_SEQ_LENGTH", "256"))
+
+
+def onnx_model_path(model_dir: str) -> str:
+    """The ONNX file to load from `model_dir` (EMBEDDING_ONNX_FILE, else int8, else float)"""
+    names = [os.getenv("EMBEDDING_ONNX_FILE")] if os.getenv("EMBEDDING_ONNX_FILE") else ONNX_MODEL_FILES
+    for name in names:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {' or '.join(names)} in {model_dir}; create one with export_onnx_embeddings.py")
+
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence embeddings from an exported ONNX model on ONNX Runtime (CPU).
+
+    Notes:
+    - `model_dir` holds the ONNX graph and the `tokenizer.json` written by
+      `export_onnx_embeddings.py`; nothing is downloaded, and neither torch
+      nor transformers is imported.
+    - Pooling matches the sentence-transformers pipeline of MiniLM-style
+      models: mean over non-padding tokens, then L2 normalization.
+    - Each batch is sorted by length before padding, so short queries are
+      not padded up to the longest chunk.
+    """
+    def __init__(self, model_dir: str, threads: int | None = None, max_seq_length: int | None = None, batch_size: int | None = None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_path = onnx_model_path(model_dir)
+        self.max_seq_length = max_seq_length or _max_seq_length()
+        self.batch_size = batch_size or int(os.getenv("EMBED_ONNX_BATCH_SIZE", "32"))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = threads if threads is not None else _threads()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return pooled / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            encoded = self._encode_batch([texts[i] for i in batch])
+            if not vectors.shape[1]:
+                vectors = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+            vectors[batch] = encoded
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def create_embeddings(backend: str, model_name: str, model_dir: str | None = None) -> Embeddings:
+    """Build the embedding model selected by EMBEDDING_BACKEND.
+
+    `model_dir` (EMBEDDING_MODEL_DIR) is a local copy of the model, so no
+    network access is needed; the ONNX backend always requires one.
+    """
+    backend = backend.lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {EMBEDDING_BACKENDS}, got {backend!r}")
+    model_dir = model_dir if model_dir is not None else os.getenv("EMBEDDING_MODEL_DIR")
+
+    if backend == "onnx":
+        if not model_dir:
+            raise ValueError("EMBEDDING_BACKEND=onnx needs EMBEDDING_MODEL_DIR (see export_onnx_embeddings.py)")
+        embeddings = OnnxEmbeddings(model_dir)
+        logger.info(f"Loaded ONNX embeddings from {embeddings.model_path}")
+        return embeddings
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    # Intra-op threads for the encoder (set here so the ONNX backend never imports torch)
+    if _threads():
+        import torch
+        torch.set_num_threads(_threads())
+
+    embeddings = HuggingFaceEmbeddings(model_name=model_dir or model_name)
+    client = getattr(embeddings, "_client", None) or getattr(embeddings, "client", None)
+    if client is not None and hasattr(client, "max_seq_length"):
+        client.max_seq_length = min(client.max_seq_length, _max_seq_length())
+    return embeddings
+
+
+def embedding_cache_id(backend: str, model_name: str) -> str:
+    """Identifies the vectors a backend produces, for index cache keys.
+
+    The default backend keeps the plain model name so existing cached
+    indexes stay valid; other backends produce slightly different vectors.
+    """
+    backend = backend.lower()
+    if backend == "huggingface":
+        return model_name
+    model_dir = os.getenv("EMBEDDING_MODEL_DIR", "")
+    return f"{model_name}|{backend}|{os.path.basename(onnx_model_path(model_dir)) if model_dir else ''}|{_max_seq_length()}"
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+
+class _PendingRequest:
+    """Vectors for one caller, filled in as its texts are encoded"""
+    def __init__(self, size: int):
+        self.vectors: List[List[float] | None] = [None] * size
+        self.remaining = size
+        self.future: Future = Future()
+        self.lock = threading.Lock()
+
+    def fill(self, index: int, vector: List[float]) -> None:
+        with self.lock:
+            self.vectors[index] = vector
+            self.remaining -= 1
+            done = self.remaining == 0
+        if done:
+            self.future.set_result(self.vectors)
+
+    def fail(self, error: BaseException) -> None:
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+class BatchingEmbeddings(Embeddings):
+    """Embeddings wrapper that merges concurrent calls into batched encodes.
+
+    Notes:
+    - Texts from all callers go into one queue. A worker thread takes the
+      first pending text, keeps collecting for up to `max_wait_ms` or until
+      `max_batch_size` texts are queued, runs a single `embed_documents` on
+      the wrapped model and hands each caller its own vectors.
+    - Queries are encoded through `embed_documents` too, which is correct for
+      symmetric models such as all-MiniLM-L6-v2.
+    - `aembed_*` wait on the batch without occupying an executor thread.
+    """
+    def __init__(self, inner: Embeddings, max_batch_size: int | None = None, max_wait_ms: float | None = None,
+                 workers: int | None = None):
+        self.inner = inner
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBED_BATCH_SIZE", "64"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBED_MAX_WAIT_MS", "5"))) / 1000
+        workers = workers or int(os.getenv("EMBED_WORKERS", "1"))
+
+        self._queue: "queue.Queue[tuple[_PendingRequest, int, str] | None]" = queue.Queue()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"embed-batcher-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue texts for embedding; the future resolves to their vectors in order"""
+        pending = _PendingRequest(len(texts))
+        if not texts:
+            pending.future.set_result([])
+            return pending.future
+        for index, text in enumerate(texts):
+            self._queue.put((pending, index, text))
+        return pending.future
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(list(texts)).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit([text]).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self.submit(list(texts)))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors = await asyncio.wrap_future(self.submit([text]))
+        return vectors[0]
+
+    def close(self) -> None:
+        """Stop the worker threads once the queue drains"""
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the stop marker for after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            try:
+                vectors = self.inner.embed_documents([text for _, _, text in batch])
+            except Exception as e:
+                for pending, _, _ in batch:
+                    pending.fail(e)
+                continue
+            for (pending, index, _), vector in zip(batch, vectors):
+                pending.fill(index, vector)
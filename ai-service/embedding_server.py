@@ -0,0 +1,604 @@
+"""Shared embedding and retrieval server for multi-worker deployments.
+
+One process holds the embedding model, the index cache and the library
+retriever; API workers reach them over a Unix-domain socket through the
+`Remote*` classes below, which stand in for the local objects in
+`AIAssistant` when `EMBEDDING_SERVER_SOCKET` is set. `launcher.py` starts
+and supervises this server together with the uvicorn workers.
+
+    python embedding_server.py --socket /tmp/ai-service-embeddings.sock
+
+Wire format: every frame is a 9-byte header (payload length, request id,
+op code on requests or status on responses) and a payload made of a small
+JSON object, a list of UTF-8 texts (count, lengths, bytes) and a float32
+matrix (rows, dimensions, little-endian values). Requests on one
+connection are multiplexed by id and answered out of order.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from index_cache import index_key
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!IIB")
+_COUNT = struct.Struct("!I")
+_SHAPE = struct.Struct("!II")
+# Largest payload accepted (a whole document travels in one BUILD frame)
+_MAX_PAYLOAD = 1 << 30
+
+OP_HELLO = 1
+OP_EMBED = 2
+OP_OPEN = 3
+OP_BUILD = 4
+OP_SEARCH = 5
+OP_LIBRARY = 6
+OP_EVICT = 7
+
+# Ops that may run for a long time; they get their own threads and timeout
+_BUILD_OPS = {OP_BUILD, OP_EVICT}
+
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+
+class EmbeddingServerError(RuntimeError):
+    """A request failed inside the embedding server"""
+
+
+def encode_message(meta: Dict[str, Any], texts: Sequence[str] = (), matrix=None) -> bytes:
+    encoded = [text.encode("utf-8") for text in texts]
+    matrix = np.ascontiguousarray(matrix if matrix is not None else np.empty((0, 0)), dtype="<f4")
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    return b"".join([
+        _COUNT.pack(len(meta_bytes)), meta_bytes,
+        _COUNT.pack(len(encoded)), np.array([len(data) for data in encoded], dtype=">u4").tobytes(), *encoded,
+        _SHAPE.pack(*matrix.shape), matrix.tobytes(),
+    ])
+
+
+def decode_message(payload: bytes) -> tuple[Dict[str, Any], List[str], np.ndarray]:
+    (meta_length,) = _COUNT.unpack_from(payload, 0)
+    offset = _COUNT.size
+    meta = json.loads(payload[offset:offset + meta_length])
+    offset += meta_length
+
+    (count,) = _COUNT.unpack_from(payload, offset)
+    offset += _COUNT.size
+    lengths = np.frombuffer(payload, dtype=">u4", count=count, offset=offset).tolist()
+    offset += 4 * count
+    texts = []
+    for length in lengths:
+        texts.append(payload[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    rows, dimensions = _SHAPE.unpack_from(payload, offset)
+    offset += _SHAPE.size
+    matrix = np.frombuffer(payload, dtype="<f4", count=rows * dimensions, offset=offset).reshape(rows, dimensions)
+    return meta, texts, matrix
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes | None:
+    """Read exactly `size` bytes; None if the peer closed the connection first"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return bytes(buffer)
+
+
+def _send_frame(sock: socket.socket, lock: threading.Lock, request_id: int, code: int, payload: bytes) -> None:
+    with lock:
+        sock.sendall(_HEADER.pack(len(payload), request_id, code))
+        sock.sendall(payload)
+
+
+class EmbeddingServer:
+    """Serves an embedding model, index cache and library retriever to API workers.
+
+    Notes:
+    - Each connection gets a reader thread. Index builds and evictions run
+      on their own pool (`EMBEDDING_SERVER_BUILD_THREADS`), everything else
+      on `EMBEDDING_SERVER_THREADS`, so builds can never take the threads
+      query embeddings and searches need.
+    - Embedding requests from all workers, builds included, meet in one
+      `BatchingEmbeddings`, so concurrent queries from different processes
+      share a forward pass; a query may wait for the batch in progress.
+    - Searches return only the hits, with their chunk texts and vectors;
+      the indexes themselves never leave this process.
+    """
+    def __init__(self, socket_path: str, embeddings: Embeddings, index_cache, library_retriever, threads: int | None = None,
+                 build_threads: int | None = None):
+        self.socket_path = socket_path
+        self.embeddings = embeddings
+        self.index_cache = index_cache
+        self.library_retriever = library_retriever
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or int(os.getenv("EMBEDDING_SERVER_THREADS", "16")),
+            thread_name_prefix="embedding-server",
+        )
+        self.build_executor = ThreadPoolExecutor(
+            max_workers=build_threads or int(os.getenv("EMBEDDING_SERVER_BUILD_THREADS", "4")),
+            thread_name_prefix="embedding-server-build",
+        )
+        self.handlers = {
+            OP_HELLO: self._hello,
+            OP_EMBED: self._embed,
+            OP_OPEN: self._open,
+            OP_BUILD: self._build,
+            OP_SEARCH: self._search,
+            OP_LIBRARY: self._library,
+            OP_EVICT: self._evict,
+        }
+        self._listener: socket.socket | None = None
+        self._connections: set = set()
+        self._connections_lock = threading.Lock()
+
+    def serve_forever(self) -> None:
+        # A socket file left by a server that was killed would make bind fail
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        listener.listen(128)
+        self._listener = listener
+        logger.info(f"Embedding server listening on {self.socket_path}")
+        try:
+            while True:
+                try:
+                    connection, _ = listener.accept()
+                except OSError:
+                    if self._listener is None:
+                        return
+                    raise
+                threading.Thread(target=self._serve_connection, args=(connection,), name="embedding-connection", daemon=True).start()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            try:
+                # Wakes an `accept` blocked in another thread; close alone does not
+                listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            listener.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.executor.shutdown(wait=False)
+        self.build_executor.shutdown(wait=False)
+
+    def _serve_connection(self, connection: socket.socket) -> None:
+        write_lock = threading.Lock()
+        with self._connections_lock:
+            self._connections.add(connection)
+        try:
+            while True:
+                header = _recv_exact(connection, _HEADER.size)
+                if header is None:
+                    return
+                length, request_id, op = _HEADER.unpack(header)
+                if length > _MAX_PAYLOAD:
+                    logger.warning(f"Closing connection after a {length}-byte frame")
+                    return
+                payload = _recv_exact(connection, length)
+                if payload is None:
+                    return
+                executor = self.build_executor if op in _BUILD_OPS else self.executor
+                executor.submit(self._handle, connection, write_lock, request_id, op, payload)
+        except (OSError, RuntimeError):
+            # RuntimeError: the pool was shut down by `close`
+            pass
+        finally:
+            with self._connections_lock:
+                self._connections.discard(connection)
+            connection.close()
+
+    def _handle(self, connection: socket.socket, write_lock: threading.Lock, request_id: int, op: int, payload: bytes) -> None:
+        try:
+            handler = self.handlers.get(op)
+            if handler is None:
+                raise ValueError(f"Unknown op {op}")
+            status, response = _STATUS_OK, encode_message(*handler(*decode_message(payload)))
+        except Exception as e:
+            logger.warning(f"Embedding server op {op} failed: {e}")
+            status, response = _STATUS_ERROR, encode_message({"error": f"{type(e).__name__}: {e}"})
+        try:
+            _send_frame(connection, write_lock, request_id, status, response)
+        except OSError:
+            # The worker went away; its requests are retried on a new connection
+            pass
+
+    def _hello(self, meta, texts, matrix):
+        cache = self.index_cache
+        return {
+            "pid": os.getpid(),
+            "modelName": cache.model_name,
+            "chunkSize": cache.chunk_size,
+            "chunkOverlap": cache.chunk_overlap,
+            "vectorFormat": cache.vector_format,
+        }, (), None
+
+    def _embed(self, meta, texts, matrix):
+        vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return {}, (), vectors.reshape(len(texts), -1)
+
+    def _open(self, meta, texts, matrix):
+        document_index = self.index_cache.get_cached(meta["key"])
+        return {"count": len(document_index.chunks) if document_index is not None else None}, (), None
+
+    def _build(self, meta, texts, matrix):
+        document_index = self.index_cache.get_or_build(texts[0], key=meta["key"])
+        return {"count": len(document_index.chunks)}, (), None
+
+    def _evict(self, meta, texts, matrix):
+        self.index_cache.evict(meta["key"])
+        return {}, (), None
+
+    def _search(self, meta, texts, matrix):
+        document_index = self.index_cache.get_cached(meta["key"])
+        if document_index is None:
+            raise LookupError(f"No index for {meta['key']}")
+        hits = document_index.hybrid_search(
+            texts[0], matrix[0], k=meta["k"], bm25_weight=meta["bm25Weight"], dense_weight=meta["denseWeight"],
+            candidates=meta.get("candidates"), rrf_k=meta["rrfK"],
+        )
+        chunk_ids = [chunk_id for chunk_id, _ in hits]
+        return (
+            {"count": len(document_index.chunks), "hits": [[chunk_id, score] for chunk_id, score in hits]},
+            [document_index.chunks[chunk_id] for chunk_id in chunk_ids],
+            document_index.vectors(chunk_ids),
+        )
+
+    def _library(self, meta, texts, matrix):
+        indexes, hits = self.library_retriever.search(
+            texts[0], matrix[0], meta["keys"], k=meta["k"], bm25_weight=meta["bm25Weight"],
+            dense_weight=meta["denseWeight"], rrf_k=meta["rrfK"],
+        )
+        vectors = [indexes[position].vectors([chunk_id]) for position, chunk_id, _ in hits]
+        return (
+            {
+                "counts": [len(index.chunks) if index is not None else None for index in indexes],
+                "hits": [[position, chunk_id, score] for position, chunk_id, score in hits],
+            },
+            [indexes[position].chunks[chunk_id] for position, chunk_id, _ in hits],
+            np.vstack(vectors) if vectors else None,
+        )
+
+
+class _Connection:
+    """One socket to the server, with the futures of its requests in flight"""
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.pending: Dict[int, Future] = {}
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._read_loop, name="embedding-client", daemon=True).start()
+
+    def abandon(self, future: Future) -> None:
+        """Stop waiting for a request; its answer is dropped if it still arrives"""
+        with self._lock:
+            for request_id, pending in list(self.pending.items()):
+                if pending is future:
+                    del self.pending[request_id]
+
+    def send(self, op: int, payload: bytes) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("Embedding server connection is closed")
+            request_id = next(self._ids) & 0xFFFFFFFF
+            self.pending[request_id] = future
+        try:
+            _send_frame(self.sock, self._write_lock, request_id, op, payload)
+        except OSError as e:
+            self.close(e)
+        return future
+
+    def close(self, error: BaseException | None = None) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Lost the embedding server connection: {error}"))
+
+    def _read_loop(self) -> None:
+        error: BaseException | None = None
+        try:
+            while True:
+                header = _recv_exact(self.sock, _HEADER.size)
+                if header is None:
+                    break
+                length, request_id, status = _HEADER.unpack(header)
+                payload = _recv_exact(self.sock, length)
+                if payload is None:
+                    break
+                with self._lock:
+                    future = self.pending.pop(request_id, None)
+                if future is None:
+                    continue
+                meta, texts, matrix = decode_message(payload)
+                if status == _STATUS_OK:
+                    future.set_result((meta, texts, matrix))
+                else:
+                    future.set_exception(EmbeddingServerError(meta.get("error", "unknown error")))
+        except (OSError, ValueError) as e:
+            error = e
+        self.close(error or EOFError("server closed the connection"))
+
+
+class EmbeddingClient:
+    """Thread-safe, multiplexed client for `EmbeddingServer`.
+
+    Notes:
+    - All threads of a worker share one connection; each request carries
+      an id and waits on its own future, so slow index builds and fast
+      query embeddings do not queue behind each other.
+    - If the server restarts, requests in flight fail with
+      ConnectionError and are sent once more on a new connection, which
+      waits up to `EMBEDDING_SERVER_CONNECT_TIMEOUT` seconds for the server
+      to come back. All requests are idempotent, so retrying is safe.
+    - A request unanswered after `EMBEDDING_SERVER_REQUEST_TIMEOUT` seconds
+      (`EMBEDDING_SERVER_BUILD_TIMEOUT` for index builds) fails with
+      ConnectionError and is not retried.
+    """
+    def __init__(self, socket_path: str, connect_timeout: float | None = None, request_timeout: float | None = None,
+                 build_timeout: float | None = None):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("EMBEDDING_SERVER_CONNECT_TIMEOUT", "30"))
+        self.request_timeout = request_timeout if request_timeout is not None else float(os.getenv("EMBEDDING_SERVER_REQUEST_TIMEOUT", "60"))
+        self.build_timeout = build_timeout if build_timeout is not None else float(os.getenv("EMBEDDING_SERVER_BUILD_TIMEOUT", "600"))
+        self._connection: _Connection | None = None
+        self._connect_lock = threading.Lock()
+        self._settings: Dict[str, Any] | None = None
+
+    def _connect(self) -> _Connection:
+        with self._connect_lock:
+            if self._connection is not None and not self._connection.closed:
+                return self._connection
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(self.socket_path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError) as e:
+                    sock.close()
+                    if time.monotonic() >= deadline:
+                        raise ConnectionError(f"Embedding server is not reachable at {self.socket_path}: {e}") from e
+                    time.sleep(0.1)
+            self._connection = _Connection(sock)
+            return self._connection
+
+    def call(self, op: int, meta: Dict[str, Any] | None = None, texts: Sequence[str] = (), matrix=None) -> tuple[Dict[str, Any], List[str], np.ndarray]:
+        payload = encode_message(meta or {}, texts, matrix)
+        timeout = self.build_timeout if op in _BUILD_OPS else self.request_timeout
+        for attempt in range(2):
+            try:
+                connection = self._connect()
+                future = connection.send(op, payload)
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                # The server is alive but stuck or overloaded; sending it again would not help
+                connection.abandon(future)
+                raise ConnectionError(f"Embedding server did not answer op {op} within {timeout:.0f}s") from None
+            except ConnectionError:
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    def settings(self) -> Dict[str, Any]:
+        """The server's index settings, which decide index keys"""
+        if self._settings is None:
+            self._settings = self.call(OP_HELLO)[0]
+        return self._settings
+
+    def close(self) -> None:
+        with self._connect_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings computed by the embedding server (async methods use LangChain's executor default)"""
+    def __init__(self, client: EmbeddingClient):
+        self.client = client
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self.client.call(OP_EMBED, texts=list(texts))[2].tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class FetchedChunks(Sequence[str]):
+    """The chunk list of a remote index, holding only the texts a search returned"""
+    def __init__(self, count: int):
+        self.count = count
+        self.texts: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, chunk_id: int) -> str:
+        try:
+            return self.texts[chunk_id]
+        except KeyError:
+            raise IndexError(f"chunk {chunk_id} was not returned by a search") from None
+
+
+class RemoteDocumentIndex:
+    """Client view of one index held by the embedding server.
+
+    A view is made per `get_or_build` call and remembers the texts and
+    vectors of the chunks its searches returned, which is all the context
+    packer reads.
+    """
+    def __init__(self, client: EmbeddingClient, key: str, count: int):
+        self.client = client
+        self.key = key
+        self.chunks = FetchedChunks(count)
+        self._vectors: Dict[int, np.ndarray] = {}
+
+    def remember(self, chunk_id: int, text: str, vector: np.ndarray) -> None:
+        self.chunks.texts[chunk_id] = text
+        self._vectors[chunk_id] = vector
+
+    def hybrid_search(self, query: str, query_vector, k: int, bm25_weight: float = 1.0,
+                      dense_weight: float = 1.0, candidates: int | None = None, rrf_k: int = 60) -> List[tuple[int, float]]:
+        meta, texts, vectors = self.client.call(
+            OP_SEARCH,
+            {"key": self.key, "k": k, "bm25Weight": bm25_weight, "denseWeight": dense_weight, "candidates": candidates, "rrfK": rrf_k},
+            [query],
+            np.asarray([query_vector], dtype=np.float32),
+        )
+        hits = [(int(chunk_id), float(score)) for chunk_id, score in meta["hits"]]
+        for (chunk_id, _), text, vector in zip(hits, texts, vectors):
+            self.remember(chunk_id, text, vector)
+        return hits
+
+    def vectors(self, chunk_ids: List[int]) -> np.ndarray:
+        if not chunk_ids:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack([self._vectors[chunk_id] for chunk_id in chunk_ids])
+
+
+class RemoteIndexCache:
+    """`IndexCache` interface backed by the embedding server's cache"""
+    def __init__(self, client: EmbeddingClient):
+        self.client = client
+
+    def warm_up(self) -> None:
+        self.client.settings()
+
+    def key_for(self, text: str) -> str:
+        settings = self.client.settings()
+        return index_key(text, settings["modelName"], settings["chunkSize"], settings["chunkOverlap"], settings["vectorFormat"])
+
+    def get_or_build(self, text: str, key: str | None = None) -> RemoteDocumentIndex:
+        key = key or self.key_for(text)
+        with span("index_load"):
+            count = self.client.call(OP_OPEN, {"key": key})[0]["count"]
+        if count is None:
+            # Only a miss sends the document text across
+            with span("index_build"):
+                count = self.client.call(OP_BUILD, {"key": key}, [text])[0]["count"]
+        return RemoteDocumentIndex(self.client, key, count)
+
+    def get_cached(self, key: str) -> RemoteDocumentIndex | None:
+        count = self.client.call(OP_OPEN, {"key": key})[0]["count"]
+        return RemoteDocumentIndex(self.client, key, count) if count is not None else None
+
+    def evict(self, key: str) -> None:
+        self.client.call(OP_EVICT, {"key": key})
+
+
+class RemoteLibraryRetriever:
+    """`LibraryRetriever` interface; the shard search runs in the embedding server"""
+    def __init__(self, client: EmbeddingClient):
+        self.client = client
+
+    def search(self, question: str, query_vector, keys: List[str | None], k: int, bm25_weight: float = 1.0,
+               dense_weight: float = 1.0, rrf_k: int = 60) -> tuple[List[RemoteDocumentIndex | None], List[tuple[int, int, float]]]:
+        meta, texts, vectors = self.client.call(
+            OP_LIBRARY,
+            {"keys": keys, "k": k, "bm25Weight": bm25_weight, "denseWeight": dense_weight, "rrfK": rrf_k},
+            [question],
+            np.asarray([query_vector], dtype=np.float32),
+        )
+        indexes = [
+            RemoteDocumentIndex(self.client, key, count) if count is not None else None
+            for key, count in zip(keys, meta["counts"])
+        ]
+        hits = [(int(position), int(chunk_id), float(score)) for position, chunk_id, score in meta["hits"]]
+        for (position, chunk_id, _), text, vector in zip(hits, texts, vectors):
+            indexes[position].remember(chunk_id, text, vector)
+        return indexes, hits
+
+    def close(self) -> None:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET"), required=not os.getenv("EMBEDDING_SERVER_SOCKET"))
+    parser.add_argument("--threads", type=int, help="request threads (default: EMBEDDING_SERVER_THREADS or 16)")
+    parser.add_argument("--build-threads", type=int, help="index build threads (default: EMBEDDING_SERVER_BUILD_THREADS or 4)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    from agent import AIAssistant
+
+    # Same model, batching and index settings as a single-process service;
+    # without the socket variable the assistant builds its components locally
+    os.environ.pop("EMBEDDING_SERVER_SOCKET", None)
+    assistant = AIAssistant()
+    assistant.embeddings.embed_query("warm up")
+    assistant.index_cache.warm_up()
+
+    server = EmbeddingServer(
+        args.socket, assistant.embeddings, assistant.index_cache, assistant.library_retriever, args.threads, args.build_threads,
+    )
+    # Exit through `serve_forever`'s cleanup (which removes the socket file) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Export a sentence-transformers model to ONNX, with a dynamic int8 copy.
+
+Writes `model.onnx` (float32), `model_int8.onnx` (int8 weights, dynamic
+activation quantization) and `tokenizer.json` into `--output`, which is
+what `EMBEDDING_BACKEND=onnx` loads from `EMBEDDING_MODEL_DIR`. Run it once
+where the model is available (hub cache or a local directory); serving
+then needs neither the network nor torch.
+
+    python export_onnx_embeddings.py --model sentence-transformers/all-MiniLM-L6-v2 --output models/all-MiniLM-L6-v2-onnx
+    python benchmark/embeddings.py --onnx-dir models/all-MiniLM-L6-v2-onnx
+"""
+import argparse
+import os
+
+
+def export(model: str, output: str, opset: int = 14, quantize: bool = True) -> None:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    local = os.path.isdir(model)
+    tokenizer = AutoTokenizer.from_pretrained(model, local_files_only=local)
+    encoder = AutoModel.from_pretrained(model, local_files_only=local).eval()
+    os.makedirs(output, exist_ok=True)
+    # A fast tokenizer saves tokenizer.json, which the `tokenizers` package loads directly
+    tokenizer.save_pretrained(output)
+
+    sample = tokenizer(["an example sentence", "a second, longer example sentence"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(output, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    print(f"Wrote {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_path = os.path.join(output, "model_int8.onnx")
+        quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Wrote {quantized_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2", help="hub id or local model directory")
+    parser.add_argument("--output", required=True, help="directory for the ONNX files and tokenizer")
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--no-quantize", action="store_true", help="only write the float32 model")
+    args = parser.parse_args()
+    export(args.model, args.output, args.opset, quantize=not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from metrics import span
+from retrieval import BM25Builder, DocumentIndex, FaissVectors
+from text_splitting import StreamingTextSplitter
+from vector_store import VECTOR_FORMATS, CompactVectorWriter
+
+logger = logging.getLogger(__name__)
+
+
+def index_key(text: str, model_name: str, chunk_size: int, chunk_overlap: int, vector_format: str) -> str:
+    """Hash the document text together with everything that shapes its index"""
+    digest = hashlib.sha256()
+    digest.update(f"{model_name}|{chunk_size}|{chunk_overlap}|".encode("utf-8"))
+    if vector_format != "faiss":
+        # Quantized indexes get their own keys (FAISS keys predate the option)
+        digest.update(f"{vector_format}|".encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IndexCache:
+    """Content-addressed cache of per-document indexes (FAISS + BM25) for PDFs.
+
+    Notes:
+    - Keys are a SHA-256 of the document text plus the splitter and
+      embedding settings, so changing any of them never serves a stale index.
+    - Built indexes are kept in memory under an LRU byte budget and written
+      to `cache_dir` (FAISS `save_local` plus the BM25 postings); an evicted
+      index is reloaded from disk instead of being re-chunked and re-embedded.
+    - `vector_format` ("float16", "int8" or "faiss", from
+      `VECTOR_STORE_FORMAT`) picks the dense store. The compact formats are
+      reopened from disk as memory maps right after the first save, so
+      workers share one copy of each document through the page cache.
+    - Chunks are split lazily and embedded `build_batch_size` at a time
+      (`INDEX_BUILD_BATCH_SIZE`), so indexing a very long PDF needs memory
+      for one batch rather than for every chunk and vector at once.
+    - FAISS is imported on first use to keep service start-up fast.
+    """
+    def __init__(self, embeddings, model_name: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 max_bytes: int | None = None, cache_dir: str | None = None, vector_format: str | None = None,
+                 build_batch_size: int | None = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("INDEX_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.cache_dir = cache_dir if cache_dir is not None else os.getenv("INDEX_CACHE_DIR", ".index_cache")
+        self.vector_format = vector_format or os.getenv("VECTOR_STORE_FORMAT", "float16")
+        self.build_batch_size = build_batch_size or int(os.getenv("INDEX_BUILD_BATCH_SIZE", "64"))
+        if self.vector_format not in VECTOR_FORMATS:
+            raise ValueError(f"VECTOR_STORE_FORMAT must be one of {VECTOR_FORMATS}, got {self.vector_format!r}")
+
+        self._text_splitter = None
+
+        self._entries: "OrderedDict[str, tuple[DocumentIndex, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # key -> [build lock, callers holding or waiting for it]
+        self._build_locks: dict[str, list] = {}
+
+    @property
+    def text_splitter(self) -> StreamingTextSplitter:
+        if self._text_splitter is None:
+            self._text_splitter = StreamingTextSplitter(self.chunk_size, self.chunk_overlap)
+        return self._text_splitter
+
+    def warm_up(self) -> None:
+        """Import FAISS and create the text splitter ahead of the first request"""
+        if self.vector_format == "faiss":
+            from langchain_community.vectorstores import FAISS  # noqa: F401
+        _ = self.text_splitter
+
+    def key_for(self, text: str) -> str:
+        return index_key(text, self.model_name, self.chunk_size, self.chunk_overlap, self.vector_format)
+
+    def get_or_build(self, text: str, key: str | None = None) -> DocumentIndex:
+        """Return the index for `text`, building it only on a full miss.
+
+        `key` may be passed when the caller already computed `key_for(text)`.
+        """
+        key = key or self.key_for(text)
+
+        document_index = self._get(key)
+        if document_index is not None:
+            return document_index
+
+        # One build per document at a time; concurrent callers wait and reuse it
+        with self._build_lock(key):
+            document_index = self._get(key)
+            if document_index is not None:
+                return document_index
+
+            with span("index_load"):
+                document_index = self._load(key)
+            if document_index is None:
+                document_index = self._build(key, text)
+
+            self._put(key, document_index)
+        return document_index
+
+    def _build(self, key: str, text: str) -> DocumentIndex:
+        """Chunk, embed and index `text` in batches of `build_batch_size` chunks.
+
+        Each batch is added to the dense and BM25 indexes before the next one
+        is split, and compact stores are written straight into the cache
+        directory, so peak memory follows the batch size, not the document.
+        """
+        compact = self.vector_format != "faiss"
+        tmp_path = self._tmp_path_for(key) if compact and self.cache_dir else None
+        writer = CompactVectorWriter(self.vector_format, tmp_path) if compact else None
+        faiss_vectors = None
+        faiss_chunks: list[str] = []
+        bm25 = BM25Builder()
+
+        chunks = self.text_splitter.iter_split(text)
+        try:
+            while True:
+                with span("split"):
+                    batch = list(itertools.islice(chunks, self.build_batch_size))
+                if not batch:
+                    break
+                with span("embed_documents"):
+                    vectors = self.embeddings.embed_documents(batch)
+                with span("vector_build"):
+                    if writer is not None:
+                        writer.add(batch, vectors)
+                    elif faiss_vectors is None:
+                        faiss_vectors = FaissVectors.build(batch, vectors, self.embeddings)
+                    else:
+                        faiss_vectors.add(batch, vectors)
+                    if not compact:
+                        faiss_chunks.extend(batch)
+                with span("bm25_build"):
+                    bm25.add(batch)
+            if writer is not None:
+                dense = writer.finish()
+            else:
+                # An empty document behaves as before (FAISS rejects an empty store)
+                dense = faiss_vectors if faiss_vectors is not None else FaissVectors.build([], [], self.embeddings)
+        except Exception:
+            if writer is not None:
+                writer.close()
+            if tmp_path:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        document_index = DocumentIndex(dense, bm25.build(), dense.chunks if compact else faiss_chunks)
+        with span("index_save"):
+            if tmp_path:
+                # Vectors and texts are already in tmp_path; add BM25 and publish it
+                self._publish(key, tmp_path, lambda path: document_index.bm25.save(os.path.join(path, "bm25.json")))
+            else:
+                self._publish(key, self._tmp_path_for(key), document_index.save)
+        if compact:
+            # Serve from the memory-mapped files in the cache rather than this process's copy
+            document_index = self._load(key) or document_index
+        return document_index
+
+    def get_cached(self, key: str) -> DocumentIndex | None:
+        """Return an index that was already built (in memory or on disk), never building one"""
+        document_index = self._get(key)
+        if document_index is None:
+            document_index = self._load(key)
+            if document_index is not None:
+                self._put(key, document_index)
+        return document_index
+
+    def evict(self, key: str) -> None:
+        """Drop an index from memory and from `cache_dir` (readers holding it keep working)"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+        if self.cache_dir:
+            shutil.rmtree(self._path_for(key), ignore_errors=True)
+
+    @contextmanager
+    def _build_lock(self, key: str):
+        """Hold the build lock for `key`; it is dropped once no caller holds or waits for it"""
+        with self._lock:
+            entry = self._build_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._build_locks[key]
+
+    def clear(self) -> None:
+        """Drop all in-memory entries (on-disk copies are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _get(self, key: str) -> DocumentIndex | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def _put(self, key: str, document_index: DocumentIndex) -> None:
+        size = document_index.nbytes()
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (document_index, size)
+            self._total_bytes += size
+
+            # Evict least recently used indexes, but always keep the newest one
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load(self, key: str) -> DocumentIndex | None:
+        if not self.cache_dir:
+            return None
+        path = self._path_for(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            return DocumentIndex.load(path, self.embeddings)
+        except Exception as e:
+            logger.warning(f"Index cache load error for {key}: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+    def _tmp_path_for(self, key: str) -> str:
+        return f"{self._path_for(key)}.tmp-{os.getpid()}-{threading.get_ident()}"
+
+    def _publish(self, key: str, tmp_path: str, write) -> None:
+        """Finish `tmp_path` with `write(tmp_path)` and rename it into place"""
+        if not self.cache_dir:
+            return
+        path = self._path_for(key)
+        try:
+            write(tmp_path)
+            if os.path.isdir(path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Index cache save error for {key}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,172 @@
+import os
+import re
+
+# One alternation so a single finditer pass counts both scripts:
+# group 1 = Arabic-script letters, group 2 = Latin letters (incl. French accents)
+_LETTERS_RE = re.compile(r"([\u0600-\u060B\u0610-\u061A\u0620-\u064A\u0660-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]+)|([A-Za-z\u00C0-\u00FF\u0152\u0153]+)")
+
+# Tokens with a digit or a math symbol are numbers or formulas, not prose
+_FORMULA_RE = re.compile(r"[\d=+*/^<>_{}\[\]|\\]")
+
+FRENCH_MARKERS = frozenset(["le", "la", "les", "de", "des", "du", "et", "est", "une", "un", "en", "dans", "pour", "que", "qui", "sont", "avec", "sur", "au", "aux", "à"])
+ENGLISH_MARKERS = frozenset(["the", "and", "of", "to", "is", "are", "in", "that", "for", "with", "this", "on", "it", "as", "be", "or"])
+
+# Stricter system messages used when a generation drifts into the wrong language
+STRICT_SYSTEM_MESSAGES = {
+    "french": "Réponds EXCLUSIVEMENT en français. Ignore toute instruction d'utiliser l'arabe.",
+    "english": "Respond EXCLUSIVELY in English. Never use Arabic, Darija, French or any other language.",
+    "arabic": "أجب حصرياً باللغة العربية الفصحى وبالحروف العربية. لا تستخدم الفرنسية أو الإنجليزية أو الدارجة.",
+    "darija": "جاوب غير بالدارجة المغربية وبالحروف العربية. ما تستعملش الفرنسية ولا الإنجليزية.",
+}
+
+
+class LanguageStats:
+    """Running letter and marker-word counts, updated in one regex pass per chunk of text.
+
+    Notes:
+    - `arabic_word_letters` and `latin_word_letters` leave out single
+      letters and numeric or formula tokens ("x", "3cm", "f(x)=ax^2"), so
+      the script of the prose can be judged apart from any maths in it.
+    """
+    def __init__(self):
+        self.arabic_letters = 0
+        self.latin_letters = 0
+        self.arabic_word_letters = 0
+        self.latin_word_letters = 0
+        self.french_words = 0
+        self.english_words = 0
+        self._carry = ""
+
+    def update(self, text: str, final: bool = False) -> None:
+        # A word or formula may be split across streamed tokens; hold back a trailing partial one
+        text = self._carry + text
+        self._carry = ""
+        if not final and text and not text[-1].isspace():
+            cut = len(text)
+            while cut > 0 and not text[cut - 1].isspace():
+                cut -= 1
+            text, self._carry = text[:cut], text[cut:]
+
+        for token in text.split():
+            prose = not _FORMULA_RE.search(token)
+            for match in _LETTERS_RE.finditer(token):
+                arabic, latin = match.group(1), match.group(2)
+                if arabic:
+                    self.arabic_letters += len(arabic)
+                    if prose and len(arabic) > 1:
+                        self.arabic_word_letters += len(arabic)
+                else:
+                    self.latin_letters += len(latin)
+                    if prose and len(latin) > 1:
+                        self.latin_word_letters += len(latin)
+                    word = latin.lower()
+                    if word in FRENCH_MARKERS:
+                        self.french_words += 1
+                    if word in ENGLISH_MARKERS:
+                        self.english_words += 1
+
+    @property
+    def letters(self) -> int:
+        return self.arabic_letters + self.latin_letters
+
+    @property
+    def arabic_ratio(self) -> float:
+        return self.arabic_letters / self.letters if self.letters else 0.0
+
+    @property
+    def arabic_word_ratio(self) -> float:
+        """Arabic share of the letters in words, formulas and single letters left out"""
+        words = self.arabic_word_letters + self.latin_word_letters
+        return self.arabic_word_letters / words if words else 0.0
+
+
+def language_stats(text: str) -> LanguageStats:
+    stats = LanguageStats()
+    stats.update(text, final=True)
+    return stats
+
+
+def classify_language(text: str, default: str = "english") -> str:
+    """Classify text as 'arabic', 'french' or 'english' in a single pass"""
+    stats = language_stats(text)
+    if stats.letters == 0:
+        return default
+    if stats.arabic_ratio > 0.3:
+        return "arabic"
+    if stats.french_words > stats.english_words:
+        return "french"
+    if stats.english_words > stats.french_words:
+        return "english"
+    return default
+
+
+class LanguageGuard:
+    """Watches a token stream and flags when it drifts away from the target language.
+
+    Notes:
+    - Arabic and Darija targets expect Arabic script; French and English
+      expect Latin script. Other targets are never flagged.
+    - Arabic-script answers only drift once `min_arabic_ratio` or less of
+      their words are Arabic: Darija is often code-switched with French
+      terms, and formulas or single-letter variables are not counted.
+    - Drift is only decided after `min_letters` letters so a formula or a
+      quoted term at the start does not trigger a retry. Latin targets also
+      flag early once `max_foreign_letters` Arabic letters have appeared
+      (the old post-hoc check used 20).
+    - For Latin targets, French vs English is told apart by marker words.
+    """
+    def __init__(self, target_language: str, min_letters: int | None = None,
+                 max_foreign_ratio: float | None = None, max_foreign_letters: int | None = None,
+                 min_arabic_ratio: float | None = None):
+        self.target_language = target_language
+        self.min_letters = min_letters if min_letters is not None else int(os.getenv("LANGUAGE_GUARD_MIN_LETTERS", "60"))
+        self.max_foreign_ratio = max_foreign_ratio if max_foreign_ratio is not None else float(os.getenv("LANGUAGE_GUARD_MAX_FOREIGN_RATIO", "0.3"))
+        self.max_foreign_letters = max_foreign_letters if max_foreign_letters is not None else int(os.getenv("LANGUAGE_GUARD_MAX_FOREIGN_LETTERS", "20"))
+        self.min_arabic_ratio = min_arabic_ratio if min_arabic_ratio is not None else float(os.getenv("LANGUAGE_GUARD_MIN_ARABIC_RATIO", "0.2"))
+        self.stats = LanguageStats()
+        self.drifted = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_language in STRICT_SYSTEM_MESSAGES
+
+    @property
+    def decided(self) -> bool:
+        """True once enough text has been seen to trust the verdict"""
+        return self.drifted or self.stats.letters >= self.min_letters
+
+    def feed(self, text: str) -> bool:
+        """Account for a new piece of output; returns True if the output has drifted"""
+        if self.drifted or not self.enabled:
+            return self.drifted
+        self.stats.update(text)
+        self.drifted = self._check()
+        return self.drifted
+
+    def finish(self) -> bool:
+        """Flush any held-back partial word and return the final verdict"""
+        if self.drifted or not self.enabled:
+            return self.drifted
+        self.stats.update("", final=True)
+        self.drifted = self._check(final=True)
+        return self.drifted
+
+    def _check(self, final: bool = False) -> bool:
+        stats = self.stats
+        if self.target_language in ("arabic", "darija"):
+            if stats.letters < self.min_letters and not final:
+                return False
+            words = stats.arabic_word_letters + stats.latin_word_letters
+            return words > 0 and stats.arabic_word_ratio <= self.min_arabic_ratio
+
+        # Latin-script targets
+        if stats.arabic_letters > self.max_foreign_letters and stats.arabic_ratio > self.max_foreign_ratio:
+            return True
+        if stats.letters < self.min_letters and not final:
+            return False
+        if stats.arabic_ratio > self.max_foreign_ratio:
+            return True
+        # Wrong Latin language: require a clear margin of marker words
+        if self.target_language == "french":
+            return stats.english_words >= 5 and stats.english_words > 2 * stats.french_words
+        return stats.french_words >= 5 and stats.french_words > 2 * stats.english_words
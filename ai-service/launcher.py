@@ -0,0 +1,141 @@
+"""Run the AI service as several uvicorn workers around one embedding server.
+
+Starts `embedding_server.py` (the only process that loads the embedding
+model and holds document indexes), waits until it answers on its socket,
+then starts uvicorn with `--workers` API processes that reach it through
+`EMBEDDING_SERVER_SOCKET`. Both are supervised: a crashed embedding server
+is restarted (workers reconnect and retry), a crashed uvicorn is restarted,
+and SIGTERM/SIGINT stop the workers first, then the server.
+
+    python launcher.py --workers 8 --port 8001
+    python launcher.py --workers 4 --socket /run/ai-service/embeddings.sock
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("launcher")
+
+
+def wait_for_server(socket_path: str, process: subprocess.Popen, timeout: float) -> None:
+    """Block until the embedding server answers a HELLO (its model is loaded by then)"""
+    from embedding_server import EmbeddingClient
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Embedding server exited with status {process.returncode} during start-up")
+        if os.path.exists(socket_path):
+            client = EmbeddingClient(socket_path, connect_timeout=1)
+            try:
+                client.settings()
+                return
+            except ConnectionError:
+                pass
+            finally:
+                client.close()
+        time.sleep(0.2)
+    raise RuntimeError(f"Embedding server did not start within {timeout:.0f}s")
+
+
+class Supervisor:
+    """Keeps one child process running, giving up after too many quick restarts"""
+    def __init__(self, name: str, command: list, env: dict, max_restarts: int = 5, window: float = 60.0):
+        self.name = name
+        self.command = command
+        self.env = env
+        self.max_restarts = max_restarts
+        self.window = window
+        self.process: subprocess.Popen | None = None
+        self._restarts: list = []
+
+    def start(self) -> subprocess.Popen:
+        self.process = subprocess.Popen(self.command, cwd=SERVICE_DIR, env=self.env)
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+        return self.process
+
+    def exited(self) -> bool:
+        return self.process is not None and self.process.poll() is not None
+
+    def restart(self) -> subprocess.Popen:
+        now = time.monotonic()
+        self._restarts = [started for started in self._restarts if now - started < self.window] + [now]
+        if len(self._restarts) > self.max_restarts:
+            raise RuntimeError(f"{self.name} exited {len(self._restarts)} times within {self.window:.0f}s; giving up")
+        logger.warning(f"{self.name} exited with status {self.process.returncode}; restarting")
+        return self.start()
+
+    def stop(self, timeout: float) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"{self.name} did not stop within {timeout:.0f}s; killing it")
+            self.process.kill()
+            self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1)
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET") or os.path.join(tempfile.gettempdir(), "ai-service-embeddings.sock"))
+    parser.add_argument("--startup-timeout", type=float, default=600.0, help="seconds to wait for the embedding model to load")
+    parser.add_argument("--stop-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+    server_env = {key: value for key, value in os.environ.items() if key != "EMBEDDING_SERVER_SOCKET"}
+    server = Supervisor("embedding server", [sys.executable, "embedding_server.py", "--socket", args.socket], server_env)
+    workers = Supervisor(
+        "uvicorn",
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", args.host, "--port", str(args.port), "--workers", str(args.workers)],
+        {**os.environ, "EMBEDDING_SERVER_SOCKET": args.socket},
+    )
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    status = 0
+    try:
+        wait_for_server(args.socket, server.start(), args.startup_timeout)
+        workers.start()
+        while not stopping:
+            time.sleep(0.5)
+            if server.exited() and not stopping:
+                # Workers keep running; their requests wait for the new server and retry
+                wait_for_server(args.socket, server.restart(), args.startup_timeout)
+            if workers.exited() and not stopping:
+                workers.restart()
+    except RuntimeError as e:
+        logger.error(str(e))
+        status = 1
+    finally:
+        # Workers first, so requests in flight can still reach the embedding server
+        workers.stop(args.stop_timeout)
+        server.stop(args.stop_timeout)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
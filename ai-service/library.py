@@ -0,0 +1,106 @@
+import bisect
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence
+
+from retrieval import DocumentIndex
+
+
+class LibraryChunks(Sequence[str]):
+    """The chunks of several documents in one id space.
+
+    Each document's ids follow the previous document's after one unused
+    id, so the context packer never merges chunks across documents.
+    """
+    def __init__(self, indexes: List[DocumentIndex | None]):
+        self.indexes = indexes
+        self.offsets: List[int] = []
+        offset = 0
+        for index in indexes:
+            self.offsets.append(offset)
+            offset += (len(index.chunks) if index is not None else 0) + 1
+        self._length = offset
+
+    def global_id(self, position: int, chunk_id: int) -> int:
+        return self.offsets[position] + chunk_id
+
+    def locate(self, global_id: int) -> tuple[int, int]:
+        """(document position, chunk id) of a global id"""
+        position = bisect.bisect_right(self.offsets, global_id) - 1
+        return position, global_id - self.offsets[position]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, global_id: int) -> str:
+        position, chunk_id = self.locate(global_id)
+        return self.indexes[position].chunks[chunk_id]
+
+
+class LibraryRetriever:
+    """Global top-k retrieval across all of one user's documents.
+
+    Notes:
+    - Every ingested document already has its own index (a shard). A
+      question loads the user's shards from the index cache and searches
+      them in parallel; each returns its best dense and BM25 candidates.
+    - Candidates are ranked globally per signal, by embedding distance
+      (comparable across documents since they share one model) and by
+      BM25 score (IDF is per document, so an approximation), then fused
+      with the same weighted RRF as single-document retrieval.
+    - Only indexes that already exist are searched. A document whose index
+      is missing is reported back, never chunked or embedded at query time.
+    """
+    def __init__(self, index_cache, candidates_per_document: int | None = None, max_workers: int | None = None):
+        self.index_cache = index_cache
+        self.candidates_per_document = candidates_per_document or int(os.getenv("LIBRARY_CANDIDATES_PER_DOCUMENT", "8"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("LIBRARY_SEARCH_WORKERS", "4")),
+            thread_name_prefix="ai-library",
+        )
+
+    def _search_shard(self, key: str | None, question: str, query_vector) -> tuple[DocumentIndex | None, list, list]:
+        index = self.index_cache.get_cached(key) if key else None
+        if index is None:
+            return None, [], []
+        count = self.candidates_per_document
+        return index, index.dense_search(query_vector, count), index.bm25.search(question, count)
+
+    def search(self, question: str, query_vector, keys: List[str | None], k: int, bm25_weight: float = 1.0,
+               dense_weight: float = 1.0, rrf_k: int = 60) -> tuple[List[DocumentIndex | None], List[tuple[int, int, float]]]:
+        """Search the indexes stored under `keys`.
+
+        Returns the loaded indexes (None where an index is missing) and up
+        to `k` hits as (position in `keys`, chunk id, fused score), best first.
+        """
+        # Each task runs in its own copy of the request context so its spans are counted
+        futures = [
+            self.executor.submit(contextvars.copy_context().run, self._search_shard, key, question, query_vector)
+            for key in keys
+        ]
+        results = [future.result() for future in futures]
+        indexes = [index for index, _, _ in results]
+
+        dense = sorted(
+            (distance, position, chunk_id)
+            for position, (_, dense_hits, _) in enumerate(results)
+            for chunk_id, distance in dense_hits
+        )
+        sparse = sorted(
+            (-score, position, chunk_id)
+            for position, (_, _, sparse_hits) in enumerate(results)
+            for chunk_id, score in sparse_hits
+        )
+
+        fused: Dict[tuple[int, int], float] = {}
+        for weight, ranking in ((dense_weight, dense), (bm25_weight, sparse)):
+            if weight <= 0:
+                continue
+            for rank, (_, position, chunk_id) in enumerate(ranking):
+                fused[(position, chunk_id)] = fused.get((position, chunk_id), 0.0) + weight / (rrf_k + rank + 1)
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return indexes, [(position, chunk_id, score) for (position, chunk_id), score in top]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
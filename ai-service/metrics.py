@@ -0,0 +1,160 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List
+
+# Latency buckets in seconds, from a cached lookup up to a long map-reduce summary
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: List["_Metric"] = []
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+# Per-request stage timings for the Server-Timing header (None outside a request)
+_request_timings: contextvars.ContextVar[Dict[str, float] | None] = contextvars.ContextVar("request_timings", default=None)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, sum, count)
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def register_collector(collector: Callable[[], Iterable[str]]) -> None:
+    """Add a function that returns exposition lines computed at scrape time"""
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, documentation: str, samples: Dict[str, float], label: str | None = None, kind: str = "gauge") -> List[str]:
+    """Exposition lines for values read from another component's stats"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for label_value, value in samples.items():
+        labels = f'{{{label}="{_escape(label_value)}"}}' if label else ""
+        lines.append(f"{name}{labels} {value}")
+    return lines
+
+
+STAGE_SECONDS = Histogram("ai_stage_duration_seconds", "Time spent in each processing stage", ["stage"])
+LLM_TIME_TO_FIRST_TOKEN = Histogram("ai_llm_time_to_first_token_seconds", "Time from request to first streamed token", ["provider"])
+LLM_TOKENS = Counter("ai_llm_tokens_total", "LLM tokens by kind (streamed completions count deltas)", ["provider", "kind"])
+LLM_RETRIES = Counter("ai_llm_retries_total", "Retried provider calls by reason", ["reason"])
+QUEUE_WAIT_SECONDS = Histogram("ai_scheduler_queue_wait_seconds", "Time requests wait for a scheduler slot", ["priority"])
+QUEUE_REJECTIONS = Counter("ai_scheduler_rejections_total", "Requests rejected with 429", ["priority"])
+HTTP_SECONDS = Histogram("ai_http_request_duration_seconds", "Time to produce a response (streams: until headers)", ["endpoint", "status"])
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block as `stage`, for the histogram and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Collect spans of the current request (and the tasks and threads it spawns)"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format timings as a `Server-Timing` header value, in milliseconds"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
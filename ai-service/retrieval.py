@@ -0,0 +1,205 @@
+import json
+import math
+import os
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from utils import tokenize
+from vector_store import CompactVectorStore
+
+
+class BM25Index:
+    """Compact per-document inverted index scored with Okapi BM25.
+
+    Notes:
+    - Postings are stored as parallel `array` buffers (chunk ids and term
+      frequencies) rather than Python lists of tuples, so an index over a
+      few hundred chunks costs kilobytes.
+    - Terms come from `utils.tokenize`, which applies the same
+      normalization and stopword lists to chunks and queries.
+    """
+    def __init__(self, postings: Dict[str, tuple[array, array]], chunk_lengths: array, k1: float = 1.5, b: float = 0.75):
+        self.postings = postings
+        self.chunk_lengths = chunk_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(chunk_lengths) / len(chunk_lengths)) if chunk_lengths else 0.0
+        count = len(chunk_lengths)
+        self.idf = {
+            term: math.log(1 + (count - len(ids) + 0.5) / (len(ids) + 0.5))
+            for term, (ids, _) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, chunks: Iterable[str]) -> "BM25Index":
+        builder = BM25Builder()
+        builder.add(chunks)
+        return builder.build()
+
+    def search(self, query: str, k: int) -> List[tuple[int, float]]:
+        """Return up to `k` (chunk id, score) pairs, best first"""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            idf = self.idf[term]
+            for chunk_id, frequency in zip(*entry):
+                norm = self.k1 * (1 - self.b + self.b * self.chunk_lengths[chunk_id] / (self.avg_length or 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def nbytes(self) -> int:
+        postings_bytes = sum(len(term) + ids.itemsize * len(ids) + tfs.itemsize * len(tfs) for term, (ids, tfs) in self.postings.items())
+        return postings_bytes + self.chunk_lengths.itemsize * len(self.chunk_lengths)
+
+    def save(self, path: str) -> None:
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "chunk_lengths": self.chunk_lengths.tolist(),
+            "postings": {term: [ids.tolist(), tfs.tolist()] for term, (ids, tfs) in self.postings.items()},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        postings = {term: (array("I", ids), array("H", tfs)) for term, (ids, tfs) in data["postings"].items()}
+        return cls(postings, array("I", data["chunk_lengths"]), k1=data["k1"], b=data["b"])
+
+
+class BM25Builder:
+    """Accumulates BM25 postings batch by batch, in chunk id order"""
+    def __init__(self):
+        self.postings: Dict[str, tuple[array, array]] = {}
+        self.chunk_lengths = array("I")
+
+    def add(self, chunks: Iterable[str]) -> None:
+        for chunk in chunks:
+            chunk_id = len(self.chunk_lengths)
+            terms = tokenize(chunk)
+            self.chunk_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                entry = self.postings.get(term)
+                if entry is None:
+                    entry = self.postings[term] = (array("I"), array("H"))
+                entry[0].append(chunk_id)
+                entry[1].append(min(frequency, 65535))
+
+    def build(self) -> BM25Index:
+        return BM25Index(self.postings, self.chunk_lengths)
+
+
+class FaissVectors:
+    """Dense search over a LangChain FAISS store (float32 `IndexFlatL2`)"""
+    def __init__(self, vector_store):
+        self.vector_store = vector_store
+
+    @classmethod
+    def build(cls, chunks: List[str], vectors, embeddings) -> "FaissVectors":
+        from langchain_community.vectorstores import FAISS
+
+        return cls(FAISS.from_embeddings(list(zip(chunks, vectors)), embeddings))
+
+    def add(self, chunks: List[str], vectors) -> None:
+        """Append chunks after the existing ones (row numbers stay in insertion order)"""
+        self.vector_store.add_embeddings(list(zip(chunks, vectors)))
+
+    def chunks(self) -> List[str]:
+        store = self.vector_store
+        return [store.docstore.search(store.index_to_docstore_id[i]).page_content for i in range(len(store.index_to_docstore_id))]
+
+    def search(self, query_vector, k: int) -> List[tuple[int, float]]:
+        query = np.asarray([query_vector], dtype=np.float32)
+        distances, ids = self.vector_store.index.search(query, k)
+        return [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i != -1]
+
+    def vectors(self, chunk_ids: List[int]) -> np.ndarray:
+        index = self.vector_store.index
+        return np.vstack([index.reconstruct(int(chunk_id)) for chunk_id in chunk_ids]) if chunk_ids else np.empty((0, index.d), dtype=np.float32)
+
+    def nbytes(self) -> int:
+        # Vectors only; the docstore's copy of the texts is counted with the chunks
+        index = self.vector_store.index
+        return index.ntotal * index.d * 4
+
+    def save(self, path: str) -> None:
+        self.vector_store.save_local(path)
+
+    @classmethod
+    def load(cls, path: str, embeddings) -> "FaissVectors":
+        from langchain_community.vectorstores import FAISS
+
+        # Only indexes written by IndexCache live here, so unpickling the docstore is safe
+        return cls(FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True))
+
+
+class DocumentIndex:
+    """Dense and sparse (BM25) indexes over one document's chunks.
+
+    `dense` is a `FaissVectors` or a memory-mapped `CompactVectorStore`
+    (see `vector_store.py`). Chunk ids are positions in `chunks`, which
+    match dense row numbers because both are built from the chunks in order.
+    """
+    def __init__(self, dense, bm25: BM25Index, chunks: Sequence[str]):
+        self.dense = dense
+        self.bm25 = bm25
+        self.chunks = chunks
+
+    def dense_search(self, query_vector, k: int) -> List[tuple[int, float]]:
+        """Nearest chunks by embedding distance as (chunk id, distance)"""
+        return self.dense.search(query_vector, min(k, len(self.chunks)))
+
+    def vectors(self, chunk_ids: List[int]) -> np.ndarray:
+        """Stored embeddings of the given chunks, one row per id"""
+        return self.dense.vectors(chunk_ids)
+
+    def hybrid_search(self, query: str, query_vector, k: int, bm25_weight: float = 1.0,
+                      dense_weight: float = 1.0, candidates: int | None = None, rrf_k: int = 60) -> List[tuple[int, float]]:
+        """Fuse dense and BM25 rankings with weighted reciprocal rank fusion.
+
+        RRF only looks at ranks, so FAISS distances and BM25 scores never
+        have to be put on a common scale.
+        """
+        if not self.chunks:
+            return []
+        candidates = candidates or max(k * 4, 20)
+        fused: Dict[int, float] = {}
+        for weight, ranking in (
+            (dense_weight, self.dense_search(query_vector, candidates)),
+            (bm25_weight, self.bm25.search(query, candidates)),
+        ):
+            if weight <= 0:
+                continue
+            for rank, (chunk_id, _) in enumerate(ranking):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (rrf_k + rank + 1)
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path: str) -> None:
+        self.dense.save(path)
+        self.bm25.save(os.path.join(path, "bm25.json"))
+
+    @classmethod
+    def load(cls, path: str, embeddings) -> "DocumentIndex":
+        if CompactVectorStore.exists(path):
+            dense = CompactVectorStore.load(path)
+            chunks = dense.chunks
+        else:
+            dense = FaissVectors.load(path, embeddings)
+            chunks = dense.chunks()
+        bm25_path = os.path.join(path, "bm25.json")
+        bm25 = BM25Index.load(bm25_path) if os.path.exists(bm25_path) else BM25Index.build(list(chunks))
+        return cls(dense, bm25, chunks)
+
+    def nbytes(self) -> int:
+        if isinstance(self.dense, CompactVectorStore):
+            # Texts live in the store's buffer; nothing is held twice
+            return self.dense.nbytes() + self.bm25.nbytes()
+        text_bytes = sum(len(chunk) for chunk in self.chunks)
+        return self.dense.nbytes() + text_bytes + self.bm25.nbytes()
@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from typing import Dict
+
+from metrics import QUEUE_WAIT_SECONDS, QUEUE_REJECTIONS
+
+# Priority classes, served strictly in this order
+INTERACTIVE = 0  # /ask, /ask-pdf, /translate
+DOCUMENT = 1     # /summarize
+BULK = 2         # /generate-exercise
+PRIORITY_NAMES = {INTERACTIVE: "interactive", DOCUMENT: "document", BULK: "bulk"}
+
+# Default concurrent requests per provider: a local Ollama model serves a couple
+# of generations at a time, Groq is bounded by its rate limit
+DEFAULT_CONCURRENCY = {"ollama": 2, "groq": 8}
+
+
+class QueueFull(Exception):
+    """Raised when a request cannot be queued; carries a Retry-After estimate in seconds"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A granted slot; release it exactly once when the request finishes"""
+    def __init__(self, scheduler: "FairScheduler", priority: int):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class _Waiter:
+    def __init__(self, user: str, priority: int):
+        self.user = user
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class FairScheduler:
+    """Admission control in front of the LLM provider.
+
+    Notes:
+    - At most `concurrency` requests run at once. Waiting requests are
+      served by priority class first (interactive before document before
+      bulk), and within a class by start-time fair queueing over users, so
+      one user with fifty queued exercises delays another user's request by
+      at most one turn.
+    - Users get weight 1 unless listed in `SCHEDULER_USER_WEIGHTS`
+      ("user-a:2,user-b:0.5"); a weight-2 user gets twice the share.
+    - Bulk requests may hold at most `bulk_limit` slots, so there is always
+      room for interactive traffic.
+    - A full queue (per user or per class) raises `QueueFull` with a
+      Retry-After estimate from the recent service time.
+    """
+    def __init__(self, provider: str, concurrency: int | None = None, max_queued: int | None = None,
+                 max_queued_per_user: int | None = None, bulk_limit: int | None = None):
+        self.concurrency = concurrency or int(os.getenv("SCHEDULER_CONCURRENCY", str(DEFAULT_CONCURRENCY.get(provider, 4))))
+        self.max_queued = max_queued or int(os.getenv("SCHEDULER_MAX_QUEUED", "200"))
+        self.max_queued_per_user = max_queued_per_user or int(os.getenv("SCHEDULER_MAX_QUEUED_PER_USER", "10"))
+        self.bulk_limit = bulk_limit or int(os.getenv("SCHEDULER_BULK_LIMIT", str(max(1, self.concurrency // 2))))
+        self.weights = self._parse_weights(os.getenv("SCHEDULER_USER_WEIGHTS", ""))
+
+        self._queues: Dict[int, list] = {priority: [] for priority in PRIORITY_NAMES}
+        self._sequence = itertools.count()
+        self._virtual_time: Dict[int, float] = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self._last_finish: Dict[tuple[int, str], float] = {}
+        self._queued_per_user: Dict[str, int] = {}
+        self._active: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+
+        # Queue wait and service time observations per class
+        self._waits: Dict[int, deque] = {priority: deque(maxlen=1000) for priority in PRIORITY_NAMES}
+        self._service_time: Dict[int, float] = {priority: 1.0 for priority in PRIORITY_NAMES}
+        self.admitted = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _parse_weights(spec: str) -> Dict[str, float]:
+        weights = {}
+        for item in spec.split(","):
+            user, _, weight = item.strip().rpartition(":")
+            if user and weight:
+                weights[user] = float(weight)
+        return weights
+
+    @property
+    def running(self) -> int:
+        return sum(self._active.values())
+
+    def queued(self, priority: int | None = None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _retry_after(self, priority: int) -> int:
+        ahead = sum(len(self._queues[p]) for p in PRIORITY_NAMES if p <= priority) + 1
+        return max(1, math.ceil(ahead * self._service_time[priority] / self.concurrency))
+
+    async def acquire(self, user: str | None, priority: int = INTERACTIVE) -> Ticket:
+        """Wait for a slot; raises QueueFull if the request cannot even be queued"""
+        user = user or "anonymous"
+        if self._can_start(priority) and not any(self._queues[p] for p in PRIORITY_NAMES if p <= priority):
+            self._next_start_tag(priority, user)
+            self._record_wait(priority, 0.0)
+            return self._start(priority)
+
+        if self._queued_per_user.get(user, 0) >= self.max_queued_per_user:
+            self.rejected += 1
+            QUEUE_REJECTIONS.inc(priority=PRIORITY_NAMES[priority])
+            raise QueueFull(f"Too many queued requests for user {user}", self._retry_after(priority))
+        if self.queued() >= self.max_queued:
+            self.rejected += 1
+            QUEUE_REJECTIONS.inc(priority=PRIORITY_NAMES[priority])
+            raise QueueFull("The service is at capacity", self._retry_after(priority))
+
+        waiter = _Waiter(user, priority)
+        heapq.heappush(self._queues[priority], (self._next_start_tag(priority, user), next(self._sequence), waiter))
+        self._queued_per_user[user] = self._queued_per_user.get(user, 0) + 1
+
+        try:
+            return await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the client went away: hand the slot back
+                waiter.future.result().release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def _next_start_tag(self, priority: int, user: str) -> float:
+        """Start-time fair queueing: a user's next request starts after their previous one finishes"""
+        flow = (priority, user)
+        start_tag = max(self._virtual_time[priority], self._last_finish.get(flow, 0.0))
+        self._last_finish[flow] = start_tag + 1.0 / self.weights.get(user, 1.0)
+        if len(self._last_finish) > 10 * self.max_queued:
+            # Tags at or behind virtual time carry no information; drop idle users
+            self._last_finish = {
+                key: finish for key, finish in self._last_finish.items() if finish > self._virtual_time[key[0]]
+            }
+        return start_tag
+
+    def _record_wait(self, priority: int, seconds: float) -> None:
+        self._waits[priority].append(seconds)
+        QUEUE_WAIT_SECONDS.observe(seconds, priority=PRIORITY_NAMES[priority])
+
+    def _can_start(self, priority: int) -> bool:
+        if self.running >= self.concurrency:
+            return False
+        return priority != BULK or self._active[BULK] < self.bulk_limit
+
+    def _start(self, priority: int) -> Ticket:
+        self._active[priority] += 1
+        self.admitted += 1
+        return Ticket(self, priority)
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.priority]
+        for index, (_, _, queued) in enumerate(queue):
+            if queued is waiter:
+                queue.pop(index)
+                heapq.heapify(queue)
+                self._dequeued(waiter)
+                break
+
+    def _dequeued(self, waiter: _Waiter) -> None:
+        remaining = self._queued_per_user[waiter.user] - 1
+        if remaining:
+            self._queued_per_user[waiter.user] = remaining
+        else:
+            del self._queued_per_user[waiter.user]
+
+    def _release(self, ticket: Ticket) -> None:
+        self._active[ticket.priority] -= 1
+        elapsed = time.monotonic() - ticket.started
+        self._service_time[ticket.priority] = 0.8 * self._service_time[ticket.priority] + 0.2 * elapsed
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for priority in sorted(PRIORITY_NAMES):
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                start_tag, _, waiter = heapq.heappop(queue)
+                self._dequeued(waiter)
+                if waiter.future.done():
+                    continue
+                self._virtual_time[priority] = start_tag
+                self._record_wait(priority, time.monotonic() - waiter.enqueued)
+                waiter.future.set_result(self._start(priority))
+
+    def stats(self) -> Dict[str, object]:
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = sorted(self._waits[priority])
+            classes[name] = {
+                "running": self._active[priority],
+                "queued": len(self._queues[priority]),
+                "waitP50": waits[len(waits) // 2] if waits else 0.0,
+                "waitP95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "waitMax": waits[-1] if waits else 0.0,
+            }
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": self.queued(),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "classes": classes,
+        }
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List
+
+import numpy as np
+
+
+class _ScopeVectors:
+    """Unit vectors of one scope's entries, kept in a growable matrix.
+
+    Rows are appended in amortized O(dimensions); a removed row is replaced
+    by the last one, so nothing is ever rebuilt by scanning every entry.
+    """
+    def __init__(self, dimensions: int):
+        self.ids: List[int] = []
+        self.positions: Dict[int, int] = {}
+        self.rows = np.empty((8, dimensions), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.rows[:len(self.ids)]
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        if len(self.ids) == len(self.rows):
+            rows = np.empty((2 * len(self.rows), self.rows.shape[1]), dtype=np.float32)
+            rows[:len(self.ids)] = self.rows
+            self.rows = rows
+        self.positions[entry_id] = len(self.ids)
+        self.rows[len(self.ids)] = vector
+        self.ids.append(entry_id)
+
+    def remove(self, entry_id: int) -> None:
+        position = self.positions.pop(entry_id)
+        last_id = self.ids.pop()
+        if last_id != entry_id:
+            self.rows[position] = self.rows[len(self.ids)]
+            self.ids[position] = last_id
+            self.positions[last_id] = position
+
+
+class SemanticCache:
+    """Answer cache that matches questions by embedding similarity.
+
+    Notes:
+    - Entries live in scopes (e.g. `("general", "french")` or
+      `("pdf", "french", <document hash>)`); a lookup only ever matches
+      entries from its own scope.
+    - A hit is the nearest cached question whose cosine similarity is at
+      least `threshold`. Entries expire after `ttl` seconds and the cache
+      holds at most `max_entries`, evicting the least recently used.
+    - Each scope's vectors are kept in one matrix that stores and evictions
+      update in place, so a lookup is a single matrix-vector product. It
+      still costs O(entries in scope); async callers run it in an executor.
+    """
+    def __init__(self, threshold: float | None = None, ttl: float | None = None, max_entries: int | None = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+
+        # (scope, entry id) -> (answer, created_at), in LRU order
+        self._entries: "OrderedDict[tuple[Hashable, int], tuple[str, float]]" = OrderedDict()
+        # scope -> vectors of its entries
+        self._scopes: Dict[Hashable, _ScopeVectors] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, vector, scope: Hashable) -> str | None:
+        """Return the cached answer for the closest question in `scope`, if close enough"""
+        query = self._normalize(vector)
+        now = time.time()
+
+        with self._lock:
+            answer = None
+            expired = []
+            vectors = self._scopes.get(scope)
+            if vectors is not None:
+                scores = vectors.matrix @ query
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+                    key = (scope, vectors.ids[position])
+                    cached, created_at = self._entries[key]
+                    if now - created_at > self.ttl:
+                        expired.append(key)
+                        continue
+                    self._entries.move_to_end(key)
+                    answer = cached
+                    break
+            # Removing rows reorders the matrix, so only after the scan
+            for key in expired:
+                self._remove(key)
+
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, vector, scope: Hashable, answer: str) -> None:
+        """Cache `answer` for the question embedded as `vector`"""
+        vector = self._normalize(vector)
+        with self._lock:
+            key = (scope, self._next_id)
+            self._next_id += 1
+            self._entries[key] = (answer, time.time())
+            vectors = self._scopes.get(scope)
+            if vectors is None:
+                vectors = self._scopes[scope] = _ScopeVectors(len(vector))
+            vectors.add(key[1], vector)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def _remove(self, key: tuple[Hashable, int]) -> None:
+        del self._entries[key]
+        scope, entry_id = key
+        vectors = self._scopes[scope]
+        vectors.remove(entry_id)
+        if not len(vectors):
+            del self._scopes[scope]
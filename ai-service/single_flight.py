@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable
+
+
+def _nothing() -> None:
+    pass
+
+
+class _Flight:
+    """Items produced so far by one shared stream"""
+    def __init__(self):
+        self.items: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Shares one in-flight generation between concurrent identical requests.
+
+    Notes:
+    - Keys are a SHA-256 of the endpoint and its inputs, with strings
+      whitespace-normalized; generation parameters are fixed per endpoint,
+      so anything a caller can vary (language, mode, ...) belongs in the inputs.
+      Keys are computed on the event loop: pass documents by their hash
+      (index key or document id), never their text.
+    - `call` awaits a shared task; `stream` runs the leader's iterator in a
+      background task and every subscriber replays the items produced so
+      far, then follows live. The work is cancelled only when every
+      subscriber has gone away.
+    - Nothing is kept once a flight finishes; repeated requests are the
+      semantic cache's job.
+    - `SINGLE_FLIGHT_ENDPOINTS` lists the endpoints that coalesce; leave
+      out high-temperature ones where each caller should get its own sample.
+    """
+    def __init__(self, endpoints: Iterable[str] | None = None):
+        if endpoints is None:
+            endpoints = os.getenv(
+                "SINGLE_FLIGHT_ENDPOINTS",
+                "/ask,/ask/stream,/ask-pdf,/ask-pdf/stream,/ask-library,/translate,/translate/stream,/summarize,/summarize/stream",
+            ).split(",")
+        self.endpoints = {endpoint.strip() for endpoint in endpoints if endpoint.strip()}
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def enabled_for(self, endpoint: str) -> bool:
+        return endpoint in self.endpoints
+
+    @staticmethod
+    def key_for(endpoint: str, inputs: Iterable[Any]) -> str:
+        normalized = [" ".join(value.split()) if isinstance(value, str) else value for value in inputs]
+        payload = json.dumps([endpoint, normalized], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def call(self, endpoint: str, inputs: Iterable[Any], factory: Callable[[], Awaitable[Any]],
+                   release: Callable[[], None] | None = None) -> Any:
+        """Await `factory()`, or the identical call already in flight.
+
+        `release` gives back whatever the caller reserved to run the work
+        (a scheduler slot): at once when it joins, when the shared work
+        finishes when it leads.
+        """
+        release = release or _nothing
+        if not self.enabled_for(endpoint):
+            try:
+                return await factory()
+            finally:
+                release()
+        key = self.key_for(endpoint, inputs)
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish_call(key, done))
+            task.add_done_callback(lambda done: release())
+        else:
+            self.followers += 1
+            release()
+        # Shielded so one caller disconnecting does not cancel the others' result
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every caller left
+
+    def stream(self, endpoint: str, inputs: Iterable[Any], factory: Callable[[], AsyncIterator[Any]],
+               release: Callable[[], None] | None = None) -> AsyncIterator[Any]:
+        """Iterate `factory()`, or attach to the identical stream already in flight.
+
+        Leading or joining is decided here, not when the returned iterator
+        is first read, so a response body that starts late still follows
+        the flight it was admitted for. `release` is handled as in `call`.
+        """
+        release = release or _nothing
+        enabled = self.enabled_for(endpoint)
+        key = self.key_for(endpoint, inputs) if enabled else None
+        flight = self._streams.get(key) if enabled else None
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(self._produce(key, flight, factory))
+            # A done callback also runs for a task cancelled before its first step
+            flight.task.add_done_callback(lambda done: release())
+            if enabled:
+                self.leaders += 1
+                self._streams[key] = flight
+        else:
+            self.followers += 1
+            release()
+        flight.subscribers += 1
+        return self._follow(key, flight)
+
+    async def _follow(self, key: str | None, flight: _Flight) -> AsyncIterator[Any]:
+        index = 0
+        try:
+            while True:
+                if index < len(flight.items):
+                    index += 1
+                    yield flight.items[index - 1]
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    async def _produce(self, key: str | None, flight: _Flight, factory: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async for item in factory():
+                flight.items.append(item)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(key, flight)
+            flight.notify()
+
+    def _forget(self, key: str | None, flight: _Flight) -> None:
+        if key is not None and self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "inFlight": len(self._calls) + len(self._streams),
+        }
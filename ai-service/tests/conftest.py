@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Service modules are flat files in ai-service/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from benchmark.hashing_embeddings import HashingEmbeddings
+
+
+@pytest.fixture
+def embeddings() -> HashingEmbeddings:
+    # Small vectors keep the tests fast; the benchmark uses the model's 384
+    return HashingEmbeddings(dimensions=64)
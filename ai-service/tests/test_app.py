@@ -0,0 +1,170 @@
+import asyncio
+import os
+import tempfile
+import threading
+
+import httpx
+import pytest
+
+# The app creates its stores at import time; keep them out of the working tree
+_STATE_DIR = tempfile.mkdtemp(prefix="ai-service-test-")
+os.environ.setdefault("DOCUMENT_STORE_DIR", os.path.join(_STATE_DIR, "documents"))
+os.environ.setdefault("TRANSLATION_MEMORY_PATH", "")
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+
+import app  # noqa: E402
+from document_store import DocumentStore  # noqa: E402
+from index_cache import IndexCache  # noqa: E402
+from scheduler import FairScheduler  # noqa: E402
+
+DOCUMENT = "Photosynthesis turns light energy into chemical energy. " * 400
+
+
+@pytest.fixture
+def service(embeddings, tmp_path, monkeypatch):
+    """The app with test embeddings, an empty document store and recorded coalescing keys"""
+    assistant = app.ai_assistant
+    monkeypatch.setattr(assistant, "_embeddings", embeddings)
+    monkeypatch.setattr(assistant, "_index_cache", IndexCache(embeddings, "test", cache_dir=""))
+    monkeypatch.setattr(app, "document_store", DocumentStore(str(tmp_path / "documents")))
+
+    keyed = []
+    key_for = app.single_flight.key_for
+    monkeypatch.setattr(app.single_flight, "key_for", lambda endpoint, inputs: keyed.append((endpoint, inputs)) or key_for(endpoint, inputs))
+    return assistant, keyed
+
+
+def request(method: str, path: str, **kwargs) -> httpx.Response:
+    async def send():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, **kwargs)
+
+    return asyncio.run(send())
+
+
+def test_pdf_questions_are_keyed_by_hash_off_the_event_loop(service, monkeypatch):
+    assistant, keyed = service
+    seen = {}
+
+    async def aask_pdf(question, pdf_content, language, doc_key=None):
+        seen.update(content=pdf_content, doc_key=doc_key)
+        return "answer"
+
+    hashed_on = []
+    key_for = assistant.index_cache.key_for
+    monkeypatch.setattr(assistant.index_cache, "key_for", lambda text: hashed_on.append(threading.current_thread()) or key_for(text))
+    monkeypatch.setattr(assistant, "aask_pdf", aask_pdf)
+
+    response = request("POST", "/ask-pdf", json={"question": "What is photosynthesis?", "pdfContent": DOCUMENT})
+    assert response.json() == {"response": "answer"}
+    assert seen == {"content": DOCUMENT, "doc_key": key_for(DOCUMENT)}
+    assert keyed == [("/ask-pdf", ("What is photosynthesis?", key_for(DOCUMENT), "darija"))]
+    assert hashed_on and threading.main_thread() not in hashed_on
+
+
+def test_summaries_are_keyed_by_document_id(service, monkeypatch):
+    _, keyed = service
+
+    async def asummarize_content(content, language):
+        return f"{len(content)} characters"
+
+    monkeypatch.setattr(app.ai_assistant, "asummarize_content", asummarize_content)
+    document_id = DocumentStore.document_id(DOCUMENT)
+
+    response = request("POST", "/summarize", json={"pdfContent": DOCUMENT, "language": "english"})
+    assert response.json() == {"summary": f"{len(DOCUMENT)} characters"}
+    app.document_store.add(DOCUMENT, {"userId": "u1"})
+    response = request("POST", "/summarize", json={"documentId": document_id, "language": "english"})
+    assert response.json() == {"summary": f"{len(DOCUMENT)} characters"}
+    assert keyed == [("/summarize", (document_id, "english"))] * 2
+    assert request("POST", "/summarize", json={"documentId": "0" * 64}).status_code == 404
+    assert app.scheduler.running == 0
+
+
+def test_ready_documents_use_their_stored_index_key(service, monkeypatch):
+    assistant, keyed = service
+    record, _ = app.document_store.add(DOCUMENT, {"userId": "u1"})
+    index_key = assistant.index_document(DOCUMENT)
+    app.document_store.set_status(record["documentId"], "ready", index_key=index_key)
+    seen = {}
+
+    async def aask_pdf(question, pdf_content, language, doc_key=None):
+        seen.update(content=pdf_content, doc_key=doc_key)
+        return "answer"
+
+    monkeypatch.setattr(assistant.index_cache, "key_for", lambda text: pytest.fail("the document was hashed again"))
+    monkeypatch.setattr(assistant, "aask_pdf", aask_pdf)
+    response = request("POST", "/ask-pdf", json={"question": "q", "documentId": record["documentId"]})
+    assert response.json() == {"response": "answer"}
+    assert seen["doc_key"] == index_key and callable(seen["content"])
+    assert keyed == [("/ask-pdf", ("q", index_key, "darija"))]
+
+
+def test_document_text_is_loaded_only_to_rebuild_an_index(service):
+    assistant, _ = service
+    index_key = assistant.index_document(DOCUMENT)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return DOCUMENT
+
+    question = "light energy"
+    vector = assistant.embeddings.embed_query(question)
+    context = assistant._pdf_context(question, load, vector, index_key)
+    assert "light energy" in context and loads == []
+
+    assistant.index_cache.evict(index_key)
+    assert assistant._pdf_context(question, load, vector, index_key) == context
+    assert loads == [1]
+
+
+def test_document_status_is_private_to_its_owners(service):
+    record, _ = app.document_store.add(DOCUMENT, {"userId": "alice", "title": "Alice's notes"})
+    app.document_store.add(DOCUMENT, {"userId": "bob", "title": "Bob's notes"})
+    path = f"/documents/{record['documentId']}"
+
+    assert request("GET", path).status_code == 422
+    assert request("GET", path, params={"userId": "mallory"}).status_code == 404
+    body = request("GET", path, params={"userId": "bob"}).json()
+    assert body["title"] == "Bob's notes" and "owners" not in body
+    assert request("DELETE", path, params={"userId": "mallory"}).status_code == 404
+    assert request("GET", path, params={"userId": "alice"}).json()["title"] == "Alice's notes"
+
+
+def test_overflow_is_answered_with_429_and_retry_after(service, monkeypatch):
+    assistant, _ = service
+    monkeypatch.setattr(app, "scheduler", FairScheduler("test", concurrency=1, max_queued=1))
+
+    async def aask_general(question, language):
+        return "answer"
+
+    monkeypatch.setattr(assistant, "aask_general", aask_general)
+
+    async def scenario():
+        holder = await app.scheduler.acquire("holder")
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            queued = asyncio.create_task(client.post("/ask", json={"question": "q1", "userId": "alice"}))
+            while not app.scheduler.queued():
+                await asyncio.sleep(0)
+            rejected = await client.post("/ask", json={"question": "q2", "userId": "bob"})
+            holder.release()
+            return rejected, await queued
+
+    rejected, served = asyncio.run(scenario())
+    assert rejected.status_code == 429 and int(rejected.headers["Retry-After"]) >= 1
+    assert served.json() == {"response": "answer"}
+
+
+def test_translation_memory_row_count_is_read_off_the_event_loop(service, monkeypatch):
+    memory = app.ai_assistant.translation_memory
+    counted_on = []
+    stats = memory.stats
+    monkeypatch.setattr(memory, "stats", lambda: counted_on.append(threading.current_thread()) or stats())
+
+    assert "ai_translation_memory_sentences_total" in request("GET", "/metrics").text
+    assert counted_on == []
+    assert request("GET", "/cache/stats").json()["translationMemory"]["entries"] >= 0
+    assert counted_on and threading.main_thread() not in counted_on
@@ -0,0 +1,64 @@
+import numpy as np
+
+from context_packing import ContextPacker, TokenCounter, overlap_length
+
+CHUNKS = [
+    "Photosynthesis happens in the chloroplasts of plant cells.",
+    "of plant cells. Light energy is captured by chlorophyll.",
+    "Mitochondria release energy through cellular respiration.",
+    "Photosynthesis happens in the chloroplasts of plant cells!",
+    "The Krebs cycle takes place in the mitochondrial matrix.",
+]
+
+
+def unit(*values):
+    vector = np.array(values + (0.0,) * (4 - len(values)), dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+VECTORS = np.vstack([unit(1, 0.1), unit(0.9, 0.4), unit(0, 1), unit(1, 0.1), unit(0.1, 1, 0.3)])
+
+
+def test_overlap_length():
+    assert overlap_length("abc of plant cells.", "of plant cells. Light", 400) == len("of plant cells.")
+    assert overlap_length("abc", "xyz", 400) == 0
+    assert overlap_length("aaaa", "aaaa", 2) == 2
+
+
+def test_near_duplicates_are_dropped_and_neighbours_merged():
+    packer = ContextPacker(token_budget=1000)
+    hits = [(0, 0.9), (3, 0.85), (1, 0.8), (2, 0.5)]
+    context, selected = packer.select(hits, CHUNKS, VECTORS[[0, 3, 1, 2]])
+
+    assert 3 not in selected and sorted(selected) == [0, 1, 2]
+    # Chunks 0 and 1 share "of plant cells." which is sent once; 1 and 2 share nothing
+    assert context == (
+        "Photosynthesis happens in the chloroplasts of plant cells. Light energy is captured by chlorophyll."
+        "\nMitochondria release energy through cellular respiration."
+    )
+    context, _ = packer.select([(4, 0.9), (0, 0.5)], CHUNKS)
+    assert context == f"{CHUNKS[0]}\n\n{CHUNKS[4]}"
+
+
+def test_context_fits_the_token_budget():
+    counter = TokenCounter("")
+    budget = counter.count(CHUNKS[0]) + counter.count(CHUNKS[2]) + 2
+    packer = ContextPacker(token_budget=budget, token_counter=counter)
+    # Chunk 4 does not fit next to chunk 0, but the smaller chunk 2 after it does
+    context, selected = packer.select([(0, 0.9), (4, 0.8), (2, 0.7)], CHUNKS)
+    assert selected == [0, 2] and counter.count(context) <= budget
+
+
+def test_oversized_best_chunk_is_cut_to_the_budget():
+    packer = ContextPacker(token_budget=20)
+    long_chunk = "word " * 200
+    context, selected = packer.select([(0, 1.0), (1, 0.5)], [long_chunk, "short"])
+    assert selected == [0] and long_chunk.startswith(context)
+    assert packer.token_counter.count(context) <= 20
+
+
+def test_passages_are_labelled_with_their_source():
+    packer = ContextPacker(token_budget=1000)
+    context, _ = packer.select([(2, 0.9), (4, 0.5)], CHUNKS, label=lambda chunk_id: f"Source {chunk_id}")
+    assert context == f"[Source 2]\n{CHUNKS[2]}\n\n[Source 4]\n{CHUNKS[4]}"
+    assert packer.select([], CHUNKS) == ("", [])
@@ -0,0 +1,47 @@
+from document_store import DocumentStore
+
+
+def test_remove_owner_keeps_the_document_for_other_users(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    record, _ = store.add("shared text", {"userId": "alice", "title": "Alice's notes"})
+    store.add("shared text", {"userId": "bob", "title": "Bob's notes"})
+    document_id = record["documentId"]
+
+    assert store.remove_owner(document_id, "mallory") == (None, False)
+
+    record, deleted = store.remove_owner(document_id, "alice")
+    assert not deleted
+    assert set(record["owners"]) == {"bob"}
+    assert store.library("alice") == []
+    assert [document["title"] for document in store.library("bob")] == ["Bob's notes"]
+    assert store.get_text(document_id) == "shared text"
+    # A fresh store (another worker) sees the same owners
+    assert set(DocumentStore(str(tmp_path)).get(document_id)["owners"]) == {"bob"}
+
+    record, deleted = store.remove_owner(document_id, "bob")
+    assert deleted
+    assert store.get(document_id) is None
+    assert store.get_text(document_id) is None
+    assert store.remove_owner(document_id, "bob") == (None, False)
+
+
+def test_users_only_see_their_own_entry(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    record, _ = store.add("shared text", {"userId": "alice", "title": "Alice's notes", "tags": ["bio"]})
+    store.add("shared text", {"userId": "bob", "title": "Bob's notes"})
+    document_id = record["documentId"]
+
+    view = store.get_for_user(document_id, "bob")
+    assert view["title"] == "Bob's notes" and view["userId"] == "bob" and view["tags"] == []
+    assert "owners" not in view and "Alice's notes" not in str(view)
+    assert store.get_for_user(document_id, "mallory") is None
+    assert [document["title"] for document in store.library("alice")] == ["Alice's notes"]
+    assert "owners" not in store.library("alice")[0]
+
+
+def test_nobody_can_delete_an_ownerless_document(tmp_path):
+    store = DocumentStore(str(tmp_path))
+    record, _ = store.add("anonymous text")
+    assert store.remove_owner(record["documentId"], "mallory") == (None, False)
+    assert store.get_text(record["documentId"]) == "anonymous text"
+    assert store.get_for_user(record["documentId"], "mallory") is None
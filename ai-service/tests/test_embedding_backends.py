@@ -0,0 +1,91 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from embedding_backends import OnnxEmbeddings
+
+# Embedding of the padding token; it must never reach a pooled vector
+PAD_VECTOR = [1000.0, -1000.0, 1000.0]
+
+
+class FakeEncoding:
+    def __init__(self, ids, length):
+        self.ids = ids + [0] * (length - len(ids))
+        self.attention_mask = [1] * len(ids) + [0] * (length - len(ids))
+
+
+class FakeTokenizer:
+    """One token per word, whose id is the word's length"""
+    @staticmethod
+    def from_file(path):
+        return FakeTokenizer()
+
+    def enable_truncation(self, max_length):
+        self.max_length = max_length
+
+    def enable_padding(self, pad_id, pad_token):
+        pass
+
+    def token_to_id(self, token):
+        return 0
+
+    def encode_batch(self, texts):
+        ids = [[len(word) for word in text.split()][:self.max_length] for text in texts]
+        length = max(len(item) for item in ids)
+        return [FakeEncoding(item, length) for item in ids]
+
+
+class FakeSession:
+    def __init__(self, path, options, providers):
+        self.batches = []
+
+    def get_inputs(self):
+        return [types.SimpleNamespace(name=name) for name in ("input_ids", "attention_mask", "token_type_ids")]
+
+    def run(self, outputs, feeds):
+        assert feeds["token_type_ids"].shape == feeds["input_ids"].shape
+        self.batches.append(feeds["attention_mask"].sum(axis=1).tolist())
+        ids = feeds["input_ids"].astype(np.float32)
+        tokens = np.stack([ids, 2 * ids + 1, np.ones_like(ids)], axis=-1)
+        tokens[feeds["attention_mask"] == 0] = PAD_VECTOR
+        return [tokens]
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    (tmp_path / "model_int8.onnx").write_bytes(b"")
+    (tmp_path / "tokenizer.json").write_text("{}")
+    onnxruntime = types.SimpleNamespace(
+        SessionOptions=types.SimpleNamespace,
+        GraphOptimizationLevel=types.SimpleNamespace(ORT_ENABLE_ALL=99),
+        InferenceSession=FakeSession,
+    )
+    monkeypatch.setitem(sys.modules, "onnxruntime", onnxruntime)
+    monkeypatch.setitem(sys.modules, "tokenizers", types.SimpleNamespace(Tokenizer=FakeTokenizer))
+    return OnnxEmbeddings(str(tmp_path), threads=1, batch_size=2)
+
+
+def expected(text):
+    ids = np.array([len(word) for word in text.split()], dtype=np.float32)
+    pooled = np.stack([ids, 2 * ids + 1, np.ones_like(ids)], axis=-1).mean(axis=0)
+    return pooled / np.linalg.norm(pooled)
+
+
+def test_mean_pools_non_padding_tokens_and_normalizes(model):
+    texts = ["a bb ccc dddd", "hello", "x yy", "long text with many words in it"]
+    vectors = np.array(model.embed_documents(texts))
+    for text, vector in zip(texts, vectors):
+        assert np.allclose(vector, expected(text), atol=1e-6)
+    assert np.allclose(model.embed_query("x yy"), expected("x yy"), atol=1e-6)
+
+
+def test_batches_by_length_and_returns_input_order(model):
+    texts = ["seven words in this one right here", "one", "three words here", "two words"]
+    vectors = model.embed_documents(texts)
+    # Shortest texts share a batch, so nothing is padded beyond its neighbours
+    assert model.session.batches == [[1, 2], [3, 7]]
+    for text, vector in zip(texts, vectors):
+        assert np.allclose(vector, expected(text), atol=1e-6)
+    assert model.embed_documents([]) == []
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from embedding_server import EmbeddingClient, EmbeddingServer, RemoteEmbeddings, RemoteIndexCache
+from index_cache import IndexCache
+from library import LibraryRetriever
+
+TEXT = " ".join(f"Paragraph {i} about photosynthesis, chlorophyll and light energy." for i in range(200))
+
+
+class GatedEmbeddings:
+    """Wraps test embeddings; documents containing "slow" wait until `gate` is set"""
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.gate = threading.Event()
+
+    def embed_documents(self, texts):
+        if any("slow" in text for text in texts):
+            self.gate.wait(timeout=10)
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def server(embeddings):
+    # Unix socket paths are limited to ~100 bytes, so not under pytest's tmp_path
+    directory = tempfile.mkdtemp(prefix="es-")
+    socket_path = os.path.join(directory, "s.sock")
+    gated = GatedEmbeddings(embeddings)
+    index_cache = IndexCache(gated, "test", cache_dir="", vector_format="float16")
+    server = EmbeddingServer(socket_path, gated, index_cache, LibraryRetriever(index_cache), threads=2, build_threads=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    clients = []
+
+    def connect(**kwargs) -> EmbeddingClient:
+        client = EmbeddingClient(socket_path, connect_timeout=5, **kwargs)
+        clients.append(client)
+        return client
+
+    yield server, gated, connect
+    gated.gate.set()
+    for client in clients:
+        client.close()
+    server.close()
+    thread.join(timeout=5)
+    os.rmdir(directory)
+
+
+def test_embed_build_search_and_evict(server, embeddings):
+    _, _, connect = server
+    client = connect()
+    remote = RemoteEmbeddings(client)
+    assert np.allclose(remote.embed_documents(["a b", "c"]), embeddings.embed_documents(["a b", "c"]), atol=1e-6)
+
+    cache = RemoteIndexCache(client)
+    key = cache.key_for(TEXT)
+    assert cache.get_cached(key) is None
+    index = cache.get_or_build(TEXT, key=key)
+    hits = index.hybrid_search("chlorophyll", embeddings.embed_query("chlorophyll"), 3)
+    assert len(hits) == 3 and "chlorophyll" in index.chunks[hits[0][0]]
+
+    cache.evict(key)
+    assert cache.get_cached(key) is None
+
+
+def test_builds_do_not_hold_up_query_embeddings(server):
+    _, gated, connect = server
+    cache = RemoteIndexCache(connect())
+    builds = [
+        threading.Thread(target=cache.get_or_build, args=(f"slow document {i} " * 50,), daemon=True)
+        for i in range(3)
+    ]
+    for build in builds:
+        build.start()
+    time.sleep(0.2)
+
+    # The only build thread is taken and two builds wait behind it
+    started = time.monotonic()
+    assert len(RemoteEmbeddings(connect()).embed_query("quick question")) == 64
+    assert time.monotonic() - started < 2
+    gated.gate.set()
+    for build in builds:
+        build.join(timeout=10)
+
+
+def test_unanswered_request_times_out_as_connection_error(server):
+    _, gated, connect = server
+    client = connect(request_timeout=0.3)
+    started = time.monotonic()
+    with pytest.raises(ConnectionError):
+        RemoteEmbeddings(client).embed_documents(["slow query"])
+    assert time.monotonic() - started < 2
+    gated.gate.set()
+    # The connection stays usable and the late answer is dropped
+    assert len(RemoteEmbeddings(client).embed_query("next")) == 64
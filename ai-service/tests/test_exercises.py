@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from agent import AIAssistant
+from utils import iter_json_objects, validate_question
+
+QUESTION = {
+    "question": " What absorbs light in a leaf? ",
+    "options": ["Chlorophyll", "Glucose", "Water", "Oxygen"],
+    "correctAnswer": "A",
+    "explanation": "Chlorophyll is the pigment.",
+}
+
+
+def test_json_objects_are_found_among_prose_fences_and_truncation():
+    first = json.dumps(QUESTION)
+    second = json.dumps({**QUESTION, "question": "Where does it happen? {not json}"})
+    text = f"Here are your questions:\n```json\n{first}\n```\nand {{broken, then {second}\n{{\"question\": \"cut off"
+    assert [obj["question"] for obj in iter_json_objects(text)] == [QUESTION["question"], "Where does it happen? {not json}"]
+    assert list(iter_json_objects("[1, 2] no objects")) == []
+
+
+@pytest.mark.parametrize("answer,expected", [
+    ("A", "A"), ("b", "B"), (" C) Water", "C"), ("D.", "D"), ("Glucose", "B"),
+])
+def test_answers_are_normalized_to_a_letter(answer, expected):
+    question = validate_question({**QUESTION, "correctAnswer": answer})
+    assert question["correctAnswer"] == expected
+    assert question["question"] == "What absorbs light in a leaf?"
+
+
+def test_legacy_answer_key_and_missing_explanation():
+    item = {key: value for key, value in QUESTION.items() if key not in ("correctAnswer", "explanation")}
+    assert validate_question({**item, "answer": "B"}) == {
+        "question": "What absorbs light in a leaf?",
+        "options": QUESTION["options"],
+        "correctAnswer": "B",
+        "explanation": "",
+    }
+
+
+@pytest.mark.parametrize("item", [
+    None,
+    "A question",
+    {**QUESTION, "question": "  "},
+    {**QUESTION, "options": ["a", "b", "c"]},
+    {**QUESTION, "options": ["a", "b", "c", " "]},
+    {**QUESTION, "options": "a, b, c, d"},
+    {**QUESTION, "correctAnswer": "E"},
+    {**QUESTION, "correctAnswer": "Apple"},
+    {**QUESTION, "correctAnswer": 1},
+])
+def test_unusable_questions_are_rejected(item):
+    assert validate_question(item) is None
+
+
+def test_exercise_responses_keep_every_valid_question():
+    wrapped = json.dumps({"questions": [QUESTION, {**QUESTION, "options": []}, {**QUESTION, "correctAnswer": "D"}]})
+    bare = json.dumps({**QUESTION, "correctAnswer": "Water"})
+    questions = AIAssistant._parse_questions(f"{wrapped}\n{bare}", limit=10)
+    assert [question["correctAnswer"] for question in questions] == ["A", "D", "C"]
+    assert len(AIAssistant._parse_questions(f"{wrapped}\n{bare}", limit=2)) == 2
+
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from utils import GroqClient
+
+
+def sse(text: str) -> bytes:
+    return f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n".encode("utf-8")
+
+
+class DroppingStream(httpx.AsyncByteStream):
+    """Sends the given SSE chunks, then fails like a reset connection"""
+    def __init__(self, chunks, drop: bool):
+        self.chunks = chunks
+        self.drop = drop
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.drop:
+            raise httpx.ReadError("connection reset")
+
+
+def make_client(handler) -> GroqClient:
+    client = GroqClient(api_key="test", api_url="http://groq.test/v1", backoff_base=0, backoff_max=0)
+    client._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+async def collect(client: GroqClient) -> list:
+    client._async_loop = asyncio.get_running_loop()
+    return [delta async for delta in client.astream("hi", timeout=10)]
+
+
+def test_drop_after_first_token_is_raised_not_retried():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, stream=DroppingStream([sse("Hello ")], drop=len(requests) == 1))
+
+    client = make_client(handler)
+    received = []
+
+    async def run():
+        client._async_loop = asyncio.get_running_loop()
+        async for delta in client.astream("hi", timeout=10):
+            received.append(delta)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    assert received == ["Hello "]
+    assert len(requests) == 1
+
+
+def test_drop_before_first_token_is_retried():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if len(requests) == 1:
+            return httpx.Response(200, stream=DroppingStream([], drop=True))
+        return httpx.Response(200, stream=DroppingStream([sse("Hello "), sse("world"), b"data: [DONE]\n\n"], drop=False))
+
+    assert "".join(asyncio.run(collect(make_client(handler)))) == "Hello world"
+    assert len(requests) == 2
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+
+import pytest
+
+from index_cache import IndexCache
+
+TEXT = " ".join(f"word{i % 97} sentence {i}." for i in range(2000))
+
+
+def test_failed_build_releases_its_lock(embeddings, tmp_path):
+    def fail(texts):
+        raise RuntimeError("model unavailable")
+
+    embeddings.embed_documents = fail
+    cache = IndexCache(embeddings, "test", cache_dir=str(tmp_path), vector_format="float16")
+    with pytest.raises(RuntimeError):
+        cache.get_or_build(TEXT)
+    assert cache._build_locks == {}
+    assert os.listdir(tmp_path) == []
+
+
+def test_waiters_of_a_failed_build_still_share_its_lock(embeddings):
+    fail, proceed = threading.Event(), threading.Event()
+    builders, inside, most_inside = [], [0], [0]
+    lock = threading.Lock()
+    embed_documents = embeddings.embed_documents
+
+    def embed(texts):
+        name = threading.current_thread().name
+        with lock:
+            if name not in builders:
+                builders.append(name)
+            inside[0] += 1
+            most_inside[0] = max(most_inside[0], inside[0])
+        try:
+            (fail if name == "first" else proceed).wait(timeout=10)
+            if name == "first":
+                raise RuntimeError("model unavailable")
+            return embed_documents(texts)
+        finally:
+            with lock:
+                inside[0] -= 1
+
+    def get_or_build():
+        try:
+            cache.get_or_build(TEXT)
+        except RuntimeError:
+            pass
+
+    embeddings.embed_documents = embed
+    cache = IndexCache(embeddings, "test", cache_dir="", vector_format="float16")
+    threads = []
+    for name in ("first", "waiter", "late"):
+        if name == "late":
+            # The first build fails and the waiter builds again; then a newcomer arrives
+            fail.set()
+            time.sleep(0.2)
+        threads.append(threading.Thread(target=get_or_build, name=name, daemon=True))
+        threads[-1].start()
+        time.sleep(0.2)
+    proceed.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert builders == ["first", "waiter"] and most_inside[0] == 1
+    assert cache.get_cached(cache.key_for(TEXT)) is not None
+    assert cache._build_locks == {}
+
+
+def test_evict_drops_memory_and_disk_copies(embeddings, tmp_path):
+    cache = IndexCache(embeddings, "test", cache_dir=str(tmp_path), vector_format="float16")
+    key = cache.key_for(TEXT)
+    cache.get_or_build(TEXT, key=key)
+    assert cache.get_cached(key) is not None
+
+    cache.evict(key)
+    assert cache.get_cached(key) is None
+    assert cache._total_bytes == 0
+    assert not os.path.exists(os.path.join(tmp_path, key))
+
+
+@pytest.mark.parametrize("vector_format", ["faiss", "float16", "int8"])
+def test_batched_build_matches_one_shot_build(embeddings, tmp_path, vector_format):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from retrieval import BM25Index
+
+    text = "\n\n".join(f"Paragraph {p}. " + TEXT[p * 150:p * 150 + 900 + 37 * p] for p in range(40))
+    expected_chunks = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len).split_text(text)
+
+    def build(batch_size: int, cache_dir: str):
+        cache = IndexCache(embeddings, "test", cache_dir=cache_dir, vector_format=vector_format, build_batch_size=batch_size)
+        return cache.get_or_build(text)
+
+    one_shot = build(10_000, "")
+    calls = embeddings.calls
+    batched = build(3, str(tmp_path))
+    assert embeddings.calls - calls == -(-len(expected_chunks) // 3) > 5
+    for index in (one_shot, batched):
+        assert list(index.chunks) == expected_chunks
+    postings = lambda bm25: {term: (list(ids), list(counts)) for term, (ids, counts) in bm25.postings.items()}
+    reference = BM25Index.build(expected_chunks)
+    for index in (one_shot, batched):
+        assert postings(index.bm25) == postings(reference)
+        assert list(index.bm25.chunk_lengths) == list(reference.chunk_lengths)
+    all_ids = list(range(len(expected_chunks)))
+    assert (batched.vectors(all_ids) == one_shot.vectors(all_ids)).all()
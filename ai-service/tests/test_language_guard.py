@@ -0,0 +1,63 @@
+import pytest
+
+from language_guard import LanguageGuard, classify_language
+
+# About a third Arabic letters: the old "more than half foreign" check flagged both of these
+CODE_SWITCHED_DARIJA = (
+    "باش تحسب la dérivée ديال la fonction polynôme، خاصك تستعمل la formule de la puissance: "
+    "f(x)=3x^2+2x-5 كتولي f'(x)=6x+2، وهادي هي la pente ديال la tangente."
+)
+FORMULA_ANSWER = (
+    "الحل: Δ=b^2-4ac=25-24=1 إذن x1=(-b-√Δ)/2a=2 و x2=(-b+√Δ)/2a=3. "
+    "f(x)=ax^2+bx+c مع a=1, b=-5, c=6 و S={2,3}."
+)
+FRENCH_ANSWER = (
+    "Pour calculer la dérivée de la fonction, il faut utiliser la formule de la puissance "
+    "et appliquer les règles de dérivation à chaque terme du polynôme."
+)
+
+
+def verdict(language: str, text: str, chunk: int = 7) -> bool:
+    """Feed text in small streamed pieces, as the model would produce it"""
+    guard = LanguageGuard(language, min_letters=60)
+    for start in range(0, len(text), chunk):
+        if guard.feed(text[start:start + chunk]):
+            return True
+    return guard.finish()
+
+
+@pytest.mark.parametrize("language", ["darija", "arabic"])
+def test_code_switched_and_formula_answers_are_not_drift(language):
+    assert not verdict(language, CODE_SWITCHED_DARIJA)
+    assert not verdict(language, FORMULA_ANSWER)
+    assert not verdict(language, "f(x)=ax^2+bx+c , g(x)=2x+1 , h(x)=x/3")
+
+
+def test_latin_prose_is_drift_for_arabic_script_targets():
+    assert verdict("darija", FRENCH_ANSWER)
+    # A few Arabic words around French prose are still drift
+    assert verdict("darija", "ها هو: " + FRENCH_ANSWER)
+
+
+def test_latin_targets_still_flag_arabic():
+    assert verdict("french", CODE_SWITCHED_DARIJA)
+    assert not verdict("french", FRENCH_ANSWER)
+    assert not verdict("english", "f(x)=ax^2+bx+c gives the parabola of the function for all real x values here.")
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 1000])
+def test_verdict_does_not_depend_on_how_the_stream_is_cut(chunk):
+    guard = LanguageGuard("darija", min_letters=60)
+    whole = LanguageGuard("darija", min_letters=60)
+    for start in range(0, len(CODE_SWITCHED_DARIJA), chunk):
+        guard.feed(CODE_SWITCHED_DARIJA[start:start + chunk])
+    guard.finish()
+    whole.feed(CODE_SWITCHED_DARIJA)
+    whole.finish()
+    assert (guard.stats.arabic_word_letters, guard.stats.latin_word_letters) == (whole.stats.arabic_word_letters, whole.stats.latin_word_letters)
+
+
+def test_classify_language():
+    assert classify_language(CODE_SWITCHED_DARIJA) == "arabic"
+    assert classify_language(FRENCH_ANSWER) == "french"
+    assert classify_language("12 + 3 = 15") == "english"
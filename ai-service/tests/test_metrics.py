@@ -0,0 +1,82 @@
+import contextvars
+import threading
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics created by a test stay out of the service's registry"""
+    monkeypatch.setattr(metrics, "_registry", [])
+    monkeypatch.setattr(metrics, "_collectors", [])
+
+
+def test_counters_render_one_sample_per_label_set():
+    tokens = metrics.Counter("test_tokens_total", "Tokens", ["provider", "kind"])
+    tokens.inc(3, provider="groq", kind="prompt")
+    tokens.inc(2, provider="groq", kind="prompt")
+    tokens.inc(provider='we"ird\\\n', kind="completion")
+    assert metrics.render() == (
+        "# HELP test_tokens_total Tokens\n"
+        "# TYPE test_tokens_total counter\n"
+        'test_tokens_total{provider="groq",kind="prompt"} 5.0\n'
+        'test_tokens_total{provider="we\\"ird\\\\\\n",kind="completion"} 1.0\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = metrics.Histogram("test_seconds", "Latency", ["stage"], buckets=(1.0, 0.1))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, stage="embed")
+    assert latency.render()[2:] == [
+        'test_seconds_bucket{stage="embed",le="0.1"} 2',
+        'test_seconds_bucket{stage="embed",le="1.0"} 3',
+        'test_seconds_bucket{stage="embed",le="+Inf"} 4',
+        'test_seconds_sum{stage="embed"} 3.65',
+        'test_seconds_count{stage="embed"} 4',
+    ]
+    unlabelled = metrics.Histogram("test_plain_seconds", "Plain", buckets=(1.0,))
+    unlabelled.observe(2.0)
+    assert unlabelled.render()[2:] == ['test_plain_seconds_bucket{le="1.0"} 0', 'test_plain_seconds_bucket{le="+Inf"} 1',
+                                       "test_plain_seconds_sum 2.0", "test_plain_seconds_count 1"]
+
+
+def test_collectors_are_read_at_scrape_time():
+    queued = {"interactive": 0}
+    metrics.register_collector(lambda: metrics.gauge_lines("test_queued", "Queued", queued, label="priority"))
+    metrics.register_collector(lambda: metrics.gauge_lines("test_hits_total", "Hits", {"": 7}, kind="counter"))
+    queued["interactive"] = 4
+    assert metrics.render().splitlines() == [
+        "# HELP test_queued Queued",
+        "# TYPE test_queued gauge",
+        'test_queued{priority="interactive"} 4',
+        "# HELP test_hits_total Hits",
+        "# TYPE test_hits_total counter",
+        "test_hits_total 7",
+    ]
+
+
+def test_spans_feed_the_histogram_and_the_request_timings(monkeypatch):
+    stages = metrics.Histogram("test_stage_seconds", "Stages", ["stage"])
+    monkeypatch.setattr(metrics, "STAGE_SECONDS", stages)
+
+    with metrics.span("outside"):
+        pass
+    timings = metrics.start_request_timings()
+    with metrics.span("embed_query"):
+        pass
+    def retrieve():
+        with metrics.span("retrieve"):
+            pass
+
+    # Work run in a thread with the request's context adds to the same timings
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(retrieve,))
+    worker.start()
+    worker.join()
+
+    assert set(timings) == {"embed_query", "retrieve"}
+    assert {line.split('"')[1] for line in stages.render() if line.startswith("test_stage_seconds_count")} == {"outside", "embed_query", "retrieve"}
+    header = metrics.server_timing_header({"embed_query": 0.0123, "generate": 1.5})
+    assert header == "embed_query;dur=12.3, generate;dur=1500.0"
@@ -0,0 +1,69 @@
+import pytest
+
+from retrieval import BM25Builder, BM25Index, DocumentIndex
+
+CHUNKS = [
+    "Photosynthesis converts light energy into chemical energy in chloroplasts.",
+    "Cellular respiration releases energy stored in glucose.",
+    "Chlorophyll absorbs red and blue light; chlorophyll reflects green light.",
+    "The mitochondria are the site of cellular respiration.",
+    "الكلوروفيل كيمتص الضوء باش النبتة تصاوب الطاقة.",
+]
+
+
+class RankedDense:
+    """Dense search that returns a fixed ranking"""
+    def __init__(self, ranking):
+        self.ranking = ranking
+
+    def search(self, query_vector, k):
+        return [(chunk_id, float(rank)) for rank, chunk_id in enumerate(self.ranking[:k])]
+
+
+def test_bm25_ranks_rarer_and_more_frequent_terms_higher():
+    index = BM25Index.build(CHUNKS)
+    hits = index.search("chlorophyll light", 5)
+    assert hits[0][0] == 2
+    assert {chunk_id for chunk_id, _ in hits} == {0, 2}
+    assert [chunk_id for chunk_id, _ in index.search("respiration mitochondria", 2)] == [3, 1]
+    # Arabic is normalized and the definite article dropped on both sides
+    assert index.search("كلوروفيل", 1)[0][0] == 4
+    assert index.search("the and of", 5) == [] and index.search("unknown", 5) == []
+
+
+def test_bm25_batched_build_and_saved_copy_score_the_same(tmp_path):
+    builder = BM25Builder()
+    builder.add(CHUNKS[:2])
+    builder.add(CHUNKS[2:])
+    index = BM25Index.build(CHUNKS)
+    assert builder.build().search("light energy respiration", 5) == index.search("light energy respiration", 5)
+
+    index.save(str(tmp_path / "bm25.json"))
+    loaded = BM25Index.load(str(tmp_path / "bm25.json"))
+    assert loaded.search("light energy respiration", 5) == index.search("light energy respiration", 5)
+
+
+def test_reciprocal_rank_fusion():
+    index = DocumentIndex(RankedDense([3, 1, 0, 2, 4]), BM25Index.build(CHUNKS), CHUNKS)
+    bm25 = [chunk_id for chunk_id, _ in index.bm25.search("cellular respiration energy", 5)]
+    assert bm25[:2] == [1, 3]
+
+    fused = index.hybrid_search("cellular respiration energy", None, 5, rrf_k=60)
+    expected = {}
+    for ranking in ([3, 1, 0, 2, 4], bm25):
+        for rank, chunk_id in enumerate(ranking):
+            expected[chunk_id] = expected.get(chunk_id, 0.0) + 1 / (60 + rank + 1)
+    assert fused == pytest.approx(sorted(expected.items(), key=lambda item: item[1], reverse=True))
+    # Chunks ranked near the top by both searches beat one ranked first by only one
+    assert {chunk_id for chunk_id, _ in fused[:2]} == {1, 3}
+
+
+def test_fusion_weights_and_limits():
+    index = DocumentIndex(RankedDense([4, 3, 2, 1, 0]), BM25Index.build(CHUNKS), CHUNKS)
+    dense_only = index.hybrid_search("chlorophyll", None, 3, bm25_weight=0)
+    assert [chunk_id for chunk_id, _ in dense_only] == [4, 3, 2]
+    bm25_only = index.hybrid_search("chlorophyll", None, 3, dense_weight=0)
+    assert [chunk_id for chunk_id, _ in bm25_only] == [2]
+    weighted = index.hybrid_search("chlorophyll", None, 1, bm25_weight=3)
+    assert [chunk_id for chunk_id, _ in weighted] == [2]
+    assert DocumentIndex(RankedDense([]), BM25Index.build([]), []).hybrid_search("q", None, 3) == []
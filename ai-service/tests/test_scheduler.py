@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from scheduler import BULK, DOCUMENT, INTERACTIVE, FairScheduler, QueueFull
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def serve_in_order(scheduler: FairScheduler, requests) -> list:
+    """Queue (label, user, priority) requests behind one held slot; return the order they start in"""
+    holder = await scheduler.acquire("holder")
+    order = []
+
+    async def request(label, user, priority):
+        ticket = await scheduler.acquire(user, priority)
+        order.append(label)
+        await settle()
+        ticket.release()
+
+    tasks = [asyncio.create_task(request(*item)) for item in requests]
+    await settle()
+    holder.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+async def acquire_and_release(scheduler: FairScheduler, user: str) -> None:
+    (await scheduler.acquire(user)).release()
+
+
+def test_one_busy_user_delays_another_by_at_most_one_turn():
+    scheduler = FairScheduler("test", concurrency=1, max_queued_per_user=50)
+    requests = [(f"a{i}", "alice", BULK) for i in range(20)] + [("b0", "bob", BULK), ("b1", "bob", BULK)]
+    order = run(lambda: serve_in_order(scheduler, requests))
+    assert order.index("b0") <= 1 and order.index("b1") <= 3
+    assert [label for label in order if label.startswith("a")] == [f"a{i}" for i in range(20)]
+
+
+def test_weighted_users_get_a_larger_share(monkeypatch):
+    monkeypatch.setenv("SCHEDULER_USER_WEIGHTS", "alice:2")
+    scheduler = FairScheduler("test", concurrency=1, max_queued_per_user=50)
+    requests = [(f"a{i}", "alice", INTERACTIVE) for i in range(10)] + [(f"b{i}", "bob", INTERACTIVE) for i in range(10)]
+    first_nine = run(lambda: serve_in_order(scheduler, requests))[:9]
+    assert sum(label.startswith("a") for label in first_nine) == 6
+
+
+def test_classes_are_served_by_priority():
+    scheduler = FairScheduler("test", concurrency=1)
+    requests = [("bulk", "alice", BULK), ("document", "alice", DOCUMENT), ("interactive", "bob", INTERACTIVE)]
+    assert run(lambda: serve_in_order(scheduler, requests)) == ["interactive", "document", "bulk"]
+
+
+def test_bulk_requests_leave_room_for_interactive_ones():
+    async def scenario():
+        scheduler = FairScheduler("test", concurrency=3, bulk_limit=1)
+        bulk = await scheduler.acquire("alice", BULK)
+        queued = asyncio.create_task(scheduler.acquire("alice", BULK))
+        await settle()
+        assert not queued.done() and scheduler.queued(BULK) == 1
+
+        interactive = [await scheduler.acquire(user, INTERACTIVE) for user in ("bob", "carol")]
+        assert scheduler.running == 3
+        bulk.release()
+        second = await asyncio.wait_for(queued, 1)
+        assert scheduler.stats()["classes"]["bulk"]["running"] == 1
+        for ticket in interactive + [second]:
+            ticket.release()
+        assert scheduler.running == 0
+
+    run(scenario)
+
+
+def test_full_queues_are_rejected_with_a_retry_after():
+    async def scenario():
+        scheduler = FairScheduler("test", concurrency=1, max_queued=3, max_queued_per_user=2)
+        holder = await scheduler.acquire("holder")
+        waiting = [asyncio.create_task(acquire_and_release(scheduler, "alice")) for _ in range(2)]
+        await settle()
+
+        with pytest.raises(QueueFull, match="alice") as per_user:
+            await scheduler.acquire("alice")
+        waiting.append(asyncio.create_task(acquire_and_release(scheduler, "bob")))
+        await settle()
+        with pytest.raises(QueueFull, match="capacity") as total:
+            await scheduler.acquire("carol")
+        # Four requests are ahead of the next one, served one at a time
+        assert per_user.value.retry_after >= 1 and total.value.retry_after >= 4
+        assert scheduler.stats()["rejected"] == 2
+
+        holder.release()
+        await asyncio.wait_for(asyncio.gather(*waiting), 1)
+        assert scheduler.queued() == 0 and scheduler.running == 0
+
+    run(scenario)
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        scheduler = FairScheduler("test", concurrency=1, max_queued_per_user=1)
+        holder = await scheduler.acquire("holder")
+        waiter = asyncio.create_task(scheduler.acquire("alice"))
+        await settle()
+        waiter.cancel()
+        await settle()
+        assert scheduler.queued() == 0
+        # The slot in alice's queue is free again
+        again = asyncio.create_task(scheduler.acquire("alice"))
+        await settle()
+        holder.release()
+        (await asyncio.wait_for(again, 1)).release()
+        assert scheduler.running == 0
+
+    run(scenario)
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from semantic_cache import SemanticCache
+
+
+def vector(*values):
+    return np.array(values + (0.0,) * (8 - len(values)), dtype=np.float32)
+
+
+def test_close_questions_hit_within_their_scope():
+    cache = SemanticCache(threshold=0.9, ttl=60, max_entries=10)
+    cache.store(vector(1, 0), ("general", "french"), "réponse")
+    cache.store(vector(0, 1), ("general", "french"), "autre")
+
+    assert cache.lookup(vector(2, 0.1), ("general", "french")) == "réponse"
+    assert cache.lookup(vector(1, 1), ("general", "french")) is None
+    assert cache.lookup(vector(1, 0), ("general", "english")) is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "misses": 2, "evictions": 0, "hit_ratio": 1 / 3}
+
+
+def test_nearest_question_wins():
+    cache = SemanticCache(threshold=0.8, ttl=60, max_entries=10)
+    cache.store(vector(1, 0.5), "scope", "far")
+    cache.store(vector(1, 0.1), "scope", "near")
+    assert cache.lookup(vector(1, 0), "scope") == "near"
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = SemanticCache(threshold=0.99, ttl=60, max_entries=3)
+    for i in range(3):
+        cache.store(vector(*([0] * i + [1])), "scope", f"answer {i}")
+    assert cache.lookup(vector(1), "scope") == "answer 0"
+    cache.store(vector(0, 0, 0, 1), "scope", "answer 3")
+
+    assert cache.lookup(vector(0, 1), "scope") is None
+    assert [cache.lookup(vector(*([0] * i + [1])), "scope") for i in (0, 2, 3)] == ["answer 0", "answer 2", "answer 3"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_entries_are_dropped_without_hiding_fresh_ones(monkeypatch):
+    cache = SemanticCache(threshold=0.9, ttl=10, max_entries=10)
+    now = [1000.0]
+    monkeypatch.setattr("semantic_cache.time.time", lambda: now[0])
+    cache.store(vector(1, 0), "scope", "old")
+    cache.store(vector(0, 1), "scope", "other")
+    now[0] += 8
+    cache.store(vector(1, 0.05), "scope", "new")
+    now[0] += 5
+    # "old" is closer but expired; it is removed and the fresh answer returned
+    assert cache.lookup(vector(1, 0.01), "scope") == "new"
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(vector(0, 1), "scope") is None
+
+
+def test_matrix_stays_consistent_through_many_writes():
+    rng = np.random.default_rng(0)
+    cache = SemanticCache(threshold=0.999, ttl=60, max_entries=50)
+    stored = {}
+    for i in range(300):
+        scope = i % 3
+        question = rng.normal(size=16).astype(np.float32)
+        cache.store(question, scope, f"answer {i}")
+        stored[i] = (question, scope)
+    # The 50 most recent answers remain, each found from its own question
+    for i in range(250, 300):
+        question, scope = stored[i]
+        assert cache.lookup(question, scope) == f"answer {i}"
+    assert cache.lookup(stored[10][0], stored[10][1]) is None
+    assert sum(len(vectors) for vectors in cache._scopes.values()) == 50
+
+
+def test_general_questions_are_looked_up_off_the_event_loop(embeddings, monkeypatch):
+    monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "true")
+    monkeypatch.setenv("TRANSLATION_MEMORY_ENABLED", "false")
+    from agent import AIAssistant
+
+    assistant = AIAssistant()
+    monkeypatch.setattr(assistant, "_embeddings", embeddings)
+    assistant.response_cache.store(embeddings.embed_query("What is a cell?"), ("general", "english"), "cached answer")
+    looked_up_on = []
+    lookup = assistant.response_cache.lookup
+    monkeypatch.setattr(assistant.response_cache, "lookup", lambda *args: looked_up_on.append(threading.current_thread()) or lookup(*args))
+
+    assert asyncio.run(assistant.aask_general("What is a cell?", "english")) == "cached answer"
+    assert looked_up_on and threading.main_thread() not in looked_up_on
@@ -0,0 +1,103 @@
+import asyncio
+
+from scheduler import FairScheduler
+from single_flight import SingleFlight
+
+
+async def tokens(release: asyncio.Event, items=("a", "b")):
+    await release.wait()
+    for item in items:
+        yield item
+
+
+def test_follower_gives_its_slot_back_when_it_joins():
+    async def run():
+        scheduler = FairScheduler("groq", concurrency=2)
+        flights = SingleFlight(["/ask/stream"])
+        go = asyncio.Event()
+
+        leader = await scheduler.acquire("a")
+        first = flights.stream("/ask/stream", ("q",), lambda: tokens(go), release=leader.release)
+        follower = await scheduler.acquire("b")
+        second = flights.stream("/ask/stream", ("q",), lambda: tokens(go), release=follower.release)
+        assert scheduler.running == 1
+        assert flights.stats()["followers"] == 1
+
+        go.set()
+        assert [item async for item in first] == ["a", "b"]
+        assert [item async for item in second] == ["a", "b"]
+        await asyncio.sleep(0)
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+
+def test_late_stream_follows_the_flight_it_was_admitted_for():
+    async def run():
+        scheduler = FairScheduler("groq", concurrency=2)
+        flights = SingleFlight(["/ask/stream"])
+        go = asyncio.Event()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return tokens(go)
+
+        leader = await scheduler.acquire("a")
+        first = flights.stream("/ask/stream", ("q",), factory, release=leader.release)
+        follower = await scheduler.acquire("b")
+        second = flights.stream("/ask/stream", ("q",), factory, release=follower.release)
+
+        # The leader finishes before the follower's body is first read
+        go.set()
+        assert [item async for item in first] == ["a", "b"]
+        assert [item async for item in second] == ["a", "b"]
+        assert len(calls) == 1
+        await asyncio.sleep(0)
+        assert scheduler.running == 0
+
+    asyncio.run(run())
+
+
+def test_stream_never_read_still_releases_its_slot():
+    async def run():
+        scheduler = FairScheduler("groq", concurrency=1)
+        flights = SingleFlight([])
+        go = asyncio.Event()
+        go.set()
+
+        ticket = await scheduler.acquire("a")
+        flights.stream("/ask/stream", ("q",), lambda: tokens(go), release=ticket.release)
+        await asyncio.wait_for(scheduler.acquire("b"), timeout=1)
+
+    asyncio.run(run())
+
+
+def test_leader_holds_its_slot_until_the_shared_call_finishes():
+    async def run():
+        scheduler = FairScheduler("groq", concurrency=2)
+        flights = SingleFlight(["/ask"])
+        go = asyncio.Event()
+
+        async def answer():
+            await go.wait()
+            return "done"
+
+        leader = await scheduler.acquire("a")
+        first = asyncio.ensure_future(flights.call("/ask", ("q",), answer, release=leader.release))
+        await asyncio.sleep(0)
+        follower = await scheduler.acquire("b")
+        second = asyncio.ensure_future(flights.call("/ask", ("q",), answer, release=follower.release))
+        await asyncio.sleep(0)
+        assert scheduler.running == 1
+
+        # The leader's client goes away; the follower still needs the generation
+        first.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.running == 1
+
+        go.set()
+        assert await second == "done"
+        assert scheduler.running == 0
+
+    asyncio.run(run())
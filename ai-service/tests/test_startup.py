@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loading the app must not pay for any of these; they load on first use or /warmup
+HEAVY_MODULES = ("langchain", "faiss", "torch", "transformers", "sentence_transformers")
+
+# Seconds `import app` may take; it is well under one without the heavy modules
+IMPORT_BUDGET_SECONDS = 3.0
+
+PROBE = f"""
+import json, sys, time
+sys.path.insert(0, {SERVICE_DIR!r})
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+heavy = sorted({{name for name in sys.modules if name.split(".")[0].startswith({HEAVY_MODULES!r})}})
+print(json.dumps({{"elapsed": elapsed, "heavy": heavy}}))
+"""
+
+
+def test_import_app_loads_no_models_or_langchain(tmp_path):
+    env = {
+        **os.environ,
+        "DOCUMENT_STORE_DIR": str(tmp_path / "documents"),
+        "TRANSLATION_MEMORY_PATH": str(tmp_path / "translation_memory.sqlite3"),
+        "AI_WARMUP_ON_STARTUP": "false",
+    }
+    result = subprocess.run([sys.executable, "-c", PROBE], cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report["heavy"] == []
+    assert report["elapsed"] < IMPORT_BUDGET_SECONDS
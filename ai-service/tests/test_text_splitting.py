@@ -0,0 +1,42 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from text_splitting import StreamingTextSplitter
+
+# Pieces that hit every separator level, whitespace stripping and words longer
+# than a chunk (the long one is rare: splitting it char by char dominates the run time)
+ALPHABET = ["a", "b", "word", " ", "  ", "\n", "\n\n", "\n\n\n", "\t", "é", "ش", ".", "x" * 50, " \n "] * 4 + ["y" * 1050]
+
+SETTINGS = [(1000, 200), (100, 20), (50, 0), (300, 150), (7, 3)]
+
+# Overlap equal to the size re-emits nearly every character; too slow to fuzz
+EDGE_SETTINGS = SETTINGS + [(300, 300)]
+
+EDGE_CASES = ["", " ", "\n\n", "x" * 5000, ("a" * 999 + "\n") * 5, ("a " * 700) + "\n\n" + "b" * 2500]
+
+
+def random_texts(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 200)))
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", EDGE_SETTINGS)
+def test_edge_cases_match_langchain(chunk_size, chunk_overlap):
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    splitter = StreamingTextSplitter(chunk_size, chunk_overlap)
+    for text in EDGE_CASES:
+        assert splitter.split_text(text) == reference.split_text(text)
+
+
+def test_random_texts_match_langchain():
+    references = {
+        settings: RecursiveCharacterTextSplitter(chunk_size=settings[0], chunk_overlap=settings[1], length_function=len)
+        for settings in SETTINGS
+    }
+    splitters = {settings: StreamingTextSplitter(*settings) for settings in SETTINGS}
+    for i, text in enumerate(random_texts(3000)):
+        settings = SETTINGS[i % len(SETTINGS)]
+        assert splitters[settings].split_text(text) == references[settings].split_text(text), (settings, text)
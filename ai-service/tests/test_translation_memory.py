@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from agent import AIAssistant
+from translation_memory import split_sentences
+
+MISSES = ["s1", "s2", "s3"]
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "One. Two! Three? Four… Five",
+    "Dr. Smith met Mr. Jones at 5 p.m. today. Then they left.",
+    "first line\nsecond line\n\n  third after a gap  ",
+    "واش فهمتي؟ إيه فهمت. Merci!",
+])
+def test_split_sentences_joins_back_to_the_text(text):
+    assert "".join(sentence + separator for sentence, separator in split_sentences(text)) == text
+
+
+def test_split_sentences_boundaries():
+    assert [s for s, _ in split_sentences("Dr. Smith arrived. He sat down.")] == ["Dr. Smith arrived.", "He sat down."]
+    assert [s for s, _ in split_sentences("Vitamin A. B. is next.\nNew line")] == ["Vitamin A. B. is next.", "New line"]
+    assert [s for s, _ in split_sentences("واش فهمتي؟ إيه")] == ["واش فهمتي؟", "إيه"]
+
+
+def test_numbered_translations_map_back_exactly():
+    response = "1. t1\n\n2) t2\n3 - t3\n"
+    assert AIAssistant._parse_numbered_translations(response, MISSES) == ({"s1": "t1", "s2": "t2", "s3": "t3"}, True)
+
+
+@pytest.mark.parametrize("response", [
+    "1. t1 t2\n2. t3",           # two sentences merged, later numbers shifted
+    "1. t1\n2. t2",              # a sentence dropped
+    "1. t1\n2. t2\n2. t2\n3. t3",  # a number repeated
+    "1. t1\n3. t3\n2. t2",       # out of order
+    "Here you go:\n1. t1\n2. t2\n3. t3",  # extra text
+    "1. t1\n2. t2\n3. t3\n4. t4",  # a number past the end
+])
+def test_numbered_translations_are_not_exact_when_lines_do_not_line_up(response):
+    _, exact = AIAssistant._parse_numbered_translations(response, MISSES)
+    assert not exact
+
+
+SENTENCES = ["One is here.", "Two is there.", "Three is everywhere."]
+TEXT = " ".join(SENTENCES)
+EXPECTED = " ".join(f"fr({sentence})" for sentence in SENTENCES)
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    """An assistant whose model merges the first two lines of every batch"""
+    monkeypatch.setenv("SEMANTIC_CACHE_ENABLED", "false")
+    monkeypatch.setenv("TRANSLATION_MEMORY_PATH", "")
+    assistant = AIAssistant()
+    monkeypatch.setattr(assistant, "_batch_translation_prompt", lambda sentences, language: "batch")
+    monkeypatch.setattr(assistant, "_translation_prompt", lambda sentence, language: sentence)
+
+    def answer(prompt, language, **kwargs):
+        return "1. un deux\n2. trois" if prompt == "batch" else f"fr({prompt})"
+
+    async def aanswer(prompt, language, **kwargs):
+        return answer(prompt, language)
+
+    async def astream(prompt, language, **kwargs):
+        for token in answer(prompt, language).split(" "):
+            yield token + " "
+
+    monkeypatch.setattr(assistant, "_generate_checked", answer)
+    monkeypatch.setattr(assistant, "_agenerate_checked", aanswer)
+    monkeypatch.setattr(assistant, "_astream_checked", astream)
+    yield assistant
+    assistant.translation_memory.close()
+
+
+def remembered(assistant):
+    return assistant.translation_memory.lookup(SENTENCES, "french")
+
+
+def test_merged_batch_is_translated_one_by_one(assistant):
+    assert assistant.translate_text(TEXT, "french") == EXPECTED
+    assert remembered(assistant) == {sentence: f"fr({sentence})" for sentence in SENTENCES}
+
+
+def test_merged_batch_is_translated_one_by_one_async(assistant):
+    assert asyncio.run(assistant.atranslate_text(TEXT, "french")) == EXPECTED
+    assert remembered(assistant) == {sentence: f"fr({sentence})" for sentence in SENTENCES}
+
+
+def test_streamed_merged_batch_is_never_remembered(assistant):
+    async def collect():
+        return "".join([chunk async for chunk in assistant._astream_translation_memory(TEXT, "french")])
+
+    streamed = asyncio.run(collect())
+    # Sentences already sent from the bad batch cannot be taken back, but are not stored
+    assert streamed.endswith("fr(Three is everywhere.)")
+    memory = remembered(assistant)
+    assert memory and all(translation == f"fr({sentence})" for sentence, translation in memory.items())
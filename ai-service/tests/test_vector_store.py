@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from vector_store import CompactVectorStore, CompactVectorWriter, MappedChunks
+
+CHUNKS = [f"Chunk {i}: " + " ".join(f"topic{(i * 7 + j) % 53}" for j in range(12)) for i in range(150)]
+CHUNKS[3] = "Arabic and accents: الفوتوسنتيز، chlorophylle, Δ=b²-4ac 🌱"
+CHUNKS[10] = ""
+
+
+def exact_top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> list:
+    distances = np.square(matrix - query).sum(axis=1)
+    return [int(i) for i in np.argsort(distances, kind="stable")[:k]]
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_search_matches_exact_float32_search(dtype):
+    # 30 topics of 5 chunks each, like passages of a document about different things
+    rng = np.random.default_rng(0)
+    centers = np.repeat(rng.normal(size=(30, 64)), 5, axis=0)
+    vectors = (centers + rng.normal(scale=0.3, size=centers.shape)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    store = CompactVectorStore.build(CHUNKS, vectors, dtype)
+    for chunk_id in range(0, len(CHUNKS), 3):
+        # A question about one passage: close to it, and to the rest of its topic
+        query = vectors[chunk_id] + rng.normal(scale=0.02, size=64).astype(np.float32)
+        hits = store.search(query, 5)
+        expected = exact_top_k(vectors, query, 5)
+        assert hits[0][0] == expected[0] == chunk_id
+        assert {hit for hit, _ in hits} == set(expected)
+        exact = np.square(vectors[[hit for hit, _ in hits]] - query).sum(axis=1)
+        assert np.allclose([distance for _, distance in hits], exact, atol=0.02 if dtype == "int8" else 1e-3)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_saved_store_is_mapped_back_unchanged(embeddings, tmp_path, dtype):
+    vectors = embeddings.embed_documents(CHUNKS)
+    store = CompactVectorStore.build(CHUNKS, vectors, dtype)
+    store.save(str(tmp_path))
+
+    loaded = CompactVectorStore.load(str(tmp_path))
+    assert isinstance(loaded.codes, np.memmap) and loaded.dtype == dtype
+    assert list(loaded.chunks) == CHUNKS
+    assert np.array_equal(loaded.vectors([0, 3, 149]), store.vectors([0, 3, 149]))
+    query = embeddings.embed_query("topic5 topic12")
+    assert loaded.search(query, 5) == store.search(query, 5)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 150])
+def test_written_chunk_offsets_round_trip(embeddings, tmp_path, batch_size):
+    vectors = embeddings.embed_documents(CHUNKS)
+    writer = CompactVectorWriter("int8", str(tmp_path))
+    for start in range(0, len(CHUNKS), batch_size):
+        writer.add(CHUNKS[start:start + batch_size], vectors[start:start + batch_size])
+    chunks = writer.finish().chunks
+
+    assert len(chunks) == len(CHUNKS) and list(chunks) == CHUNKS
+    assert chunks[3] == CHUNKS[3] and chunks[-1] == CHUNKS[-1] and chunks[10:13] == CHUNKS[10:13]
+    with pytest.raises(IndexError):
+        chunks[len(CHUNKS)]
+    # Offsets are byte positions, so multi-byte characters must not shift later chunks
+    reloaded = MappedChunks.load(str(tmp_path / "chunks.bin"), str(tmp_path / "offsets.bin"), len(CHUNKS))
+    assert list(reloaded) == CHUNKS and reloaded.nbytes() == chunks.nbytes()
@@ -0,0 +1,95 @@
+from collections import deque
+from typing import Iterator, List
+
+
+def _iter_splits(text: str, separator: str) -> Iterator[str]:
+    """Pieces of `text` with each separator kept at the start of the piece after it"""
+    if not separator:
+        yield from text
+        return
+    start = 0
+    index = text.find(separator)
+    while index != -1:
+        if index > start:
+            yield text[start:index]
+        start = index
+        index = text.find(separator, index + len(separator))
+    if start < len(text):
+        yield text[start:]
+
+
+class _ChunkMerger:
+    """Incremental form of `TextSplitter._merge_splits` (empty separator, stripped chunks)"""
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.current: deque = deque()
+        self.total = 0
+
+    def add(self, split: str) -> Iterator[str]:
+        length = len(split)
+        if self.total + length > self.chunk_size and self.current:
+            chunk = "".join(self.current).strip()
+            if chunk:
+                yield chunk
+            # Keep at most `chunk_overlap` characters, and only what still fits with the new split
+            while self.total > self.chunk_overlap or (self.total + length > self.chunk_size and self.total > 0):
+                self.total -= len(self.current.popleft())
+        self.current.append(split)
+        self.total += length
+
+    def flush(self) -> Iterator[str]:
+        chunk = "".join(self.current).strip()
+        self.current.clear()
+        self.total = 0
+        if chunk:
+            yield chunk
+
+
+class StreamingTextSplitter:
+    """Lazy equivalent of LangChain's `RecursiveCharacterTextSplitter`.
+
+    Produces exactly the chunks of `RecursiveCharacterTextSplitter(
+    chunk_size, chunk_overlap, length_function=len)` with the default
+    separators, but yields them one at a time: pieces are found with
+    `str.find` instead of `re.split`, and runs of small pieces are merged as
+    they arrive instead of being collected first. Memory held at any point
+    is one chunk plus the piece being recursed into, not the chunk list.
+    """
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, separators: List[str] | None = None):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = separators or ["\n\n", "\n", " ", ""]
+
+    def iter_split(self, text: str) -> Iterator[str]:
+        return self._split(text, self.separators)
+
+    def split_text(self, text: str) -> List[str]:
+        return list(self.iter_split(text))
+
+    def _split(self, text: str, separators: List[str]) -> Iterator[str]:
+        # The first separator that occurs anywhere in the text, as LangChain chooses it
+        separator = separators[-1]
+        remaining: List[str] = []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if candidate in text:
+                separator = candidate
+                remaining = separators[i + 1:]
+                break
+
+        merger = _ChunkMerger(self.chunk_size, self.chunk_overlap)
+        for piece in _iter_splits(text, separator):
+            if len(piece) < self.chunk_size:
+                yield from merger.add(piece)
+                continue
+            yield from merger.flush()
+            if remaining:
+                yield from self._split(piece, remaining)
+            else:
+                yield piece
+        yield from merger.flush()
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+# A sentence ends at . ! ? … or the Arabic question mark, followed by whitespace;
+# line breaks always end a segment
+_BOUNDARY_RE = re.compile(r"(?<=[.!?…؟])[ \t]+|[ \t]*\n\s*")
+# Tokens after which a period does not end the sentence
+_ABBREVIATIONS = frozenset({"e.g", "i.e", "etc", "cf", "vs", "mr", "mrs", "dr", "pr", "prof", "m", "mme", "mlle", "p", "fig", "no", "ex"})
+_LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+def split_sentences(text: str) -> List[tuple[str, str]]:
+    """Split text into (sentence, following whitespace) pairs that join back to `text`"""
+    segments: List[tuple[str, str]] = []
+    start = 0
+    pending = ""
+    for match in _BOUNDARY_RE.finditer(text):
+        piece = text[start:match.start()]
+        last_word = piece.rsplit(None, 1)[-1].rstrip(".").lower() if piece.strip() else ""
+        abbreviation = last_word in _ABBREVIATIONS or (len(last_word) == 1 and last_word.isalnum())
+        if "\n" not in match.group() and piece.endswith(".") and abbreviation:
+            # "M. Dupont", "e.g. this": keep going
+            pending += piece + match.group()
+        else:
+            segments.append((pending + piece, match.group()))
+            pending = ""
+        start = match.end()
+    tail = pending + text[start:]
+    if tail or not segments:
+        segments.append((tail, ""))
+    return segments
+
+
+def normalize_sentence(sentence: str) -> str:
+    return " ".join(sentence.split())
+
+
+def needs_translation(sentence: str) -> bool:
+    """Numbers, bullets and punctuation are copied through as they are"""
+    return bool(_LETTER_RE.search(sentence))
+
+
+class TranslationMemory:
+    """Sentence-level translation cache backed by SQLite.
+
+    Notes:
+    - Entries are keyed by (SHA-256 of the normalized sentence, target
+      language); recently used ones are also kept in an in-process LRU so
+      hot passages never touch the database.
+    - The database holds at most `max_entries` rows; least recently used
+      rows are deleted when it grows past that.
+    - Set `TRANSLATION_MEMORY_PATH` to an empty string to keep the memory
+      in process only.
+    """
+    def __init__(self, path: str | None = None, max_entries: int | None = None, hot_entries: int | None = None):
+        self.path = path if path is not None else os.getenv("TRANSLATION_MEMORY_PATH", ".translation_memory.sqlite3")
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("TRANSLATION_MEMORY_MAX_ENTRIES", "100000"))
+        self.hot_entries = hot_entries if hot_entries is not None else int(os.getenv("TRANSLATION_MEMORY_HOT_ENTRIES", "5000"))
+
+        self._hot: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "source_hash TEXT NOT NULL, language TEXT NOT NULL, translation TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (source_hash, language))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)")
+        self._db.commit()
+        # Upper bound on the row count, so pruning only runs when it may be needed
+        self._rows = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(sentence: str) -> str:
+        return hashlib.sha256(normalize_sentence(sentence).encode("utf-8")).hexdigest()
+
+    def lookup(self, sentences: Iterable[str], language: str) -> Dict[str, str]:
+        """Return {sentence: translation} for the sentences already in memory"""
+        sentences = set(sentences)
+        found: Dict[str, str] = {}
+        cold: Dict[str, str] = {}
+        with self._lock:
+            for sentence in sentences:
+                key = (self._hash(sentence), language)
+                if key in self._hot:
+                    self._hot.move_to_end(key)
+                    found[sentence] = self._hot[key]
+                else:
+                    cold[key[0]] = sentence
+
+            if cold:
+                placeholders = ",".join("?" * len(cold))
+                rows = self._db.execute(
+                    f"SELECT source_hash, translation FROM translations WHERE language = ? AND source_hash IN ({placeholders})",
+                    [language, *cold],
+                ).fetchall()
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE translations SET last_used = ? WHERE source_hash = ? AND language = ?",
+                    [(now, source_hash, language) for source_hash, _ in rows],
+                )
+                self._db.commit()
+                for source_hash, translation in rows:
+                    found[cold[source_hash]] = translation
+                    self._remember((source_hash, language), translation)
+
+            self.hits += len(found)
+            self.misses += len(sentences) - len(found)
+        return found
+
+    def store(self, translations: Dict[str, str], language: str) -> None:
+        """Save {sentence: translation} pairs"""
+        if not translations:
+            return
+        now = time.time()
+        rows = [(self._hash(sentence), language, translation, now) for sentence, translation in translations.items()]
+        with self._lock:
+            for source_hash, _, translation, _ in rows:
+                self._remember((source_hash, language), translation)
+            self._db.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", rows)
+            self._rows += len(rows)
+            if self._rows > self.max_entries:
+                # Keep the table bounded, dropping the least recently used rows
+                self._db.execute(
+                    "DELETE FROM translations WHERE rowid IN ("
+                    "SELECT rowid FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self._rows = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            self._db.commit()
+
+    def _remember(self, key: tuple[str, str], translation: str) -> None:
+        self._hot[key] = translation
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_entries:
+            self._hot.popitem(last=False)
+
+    def counters(self) -> Dict[str, int]:
+        """Hit and miss counts, read without the lock or the database (safe on the event loop)"""
+        return {"hits": self.hits, "misses": self.misses}
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus the row count, which queries the database"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,7 +1,39 @@
 import re
-from typing import List, Dict, Any
+from collections import Counter
+from typing import List, Dict, Any, AsyncIterator
 import os
+import json
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
+import httpx
+from language_guard import language_stats
+from metrics import LLM_RETRIES, LLM_TOKENS
+
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
 
 
 class GroqClient:
@@ -12,8 +44,15 @@ class GroqClient:
     - Do NOT hard-code API keys in source. Keep keys out of git.
     - Payload/response parsing is intentionally permissive to support
       different Groq response shapes. Adjust according to your account.
+    - Connections are pooled and kept alive across calls (`GROQ_POOL_SIZE`).
+      429/5xx responses and network errors are retried with jittered
+      exponential backoff (`GROQ_MAX_RETRIES`), honoring `Retry-After`, and
+      every attempt fits inside the caller's overall `timeout`.
+    - Any OpenAI-compatible server works as `api_url`, including a local stub.
     """
-    def __init__(self, api_key: str | None = None, api_url: str | None = None, model: str | None = None):
+    def __init__(self, api_key: str | None = None, api_url: str | None = None, model: str | None = None,
+                 pool_size: int | None = None, max_retries: int | None = None,
+                 backoff_base: float | None = None, backoff_max: float | None = None):
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
         self.api_url = api_url or os.getenv("GROQ_API_URL")
         self.model = model or os.getenv("GROQ_MODEL") or "llama-3.3-70b-versatile"
@@ -21,55 +60,300 @@ class GroqClient:
         if not self.api_key or not self.api_url:
             raise ValueError("GROQ_API_KEY and GROQ_API_URL environment variables must be set to use GroqClient")
 
-    def generate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, timeout: int = 60, system_message: str = None) -> str:
-        headers = {
+        self.pool_size = pool_size or int(os.getenv("GROQ_POOL_SIZE", "20"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("GROQ_MAX_RETRIES", "3"))
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.getenv("GROQ_BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max if backoff_max is not None else float(os.getenv("GROQ_BACKOFF_MAX", "8"))
+
+        # Groq uses OpenAI-compatible endpoint
+        self.endpoint = self.api_url
+        if not self.endpoint.endswith('/chat/completions'):
+            self.endpoint = self.endpoint.rstrip('/') + '/chat/completions'
+
+        self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
+        # Long-lived pooled session; urllib3 keeps connections alive between calls
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+
+        # The async client binds to the running event loop, so create it on first use
+        self._async_client: httpx.AsyncClient | None = None
+        self._async_loop = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client.is_closed or self._async_loop is not loop:
+            self._async_loop = loop
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+        return self._async_client
+
+    def close(self) -> None:
+        self.session.close()
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _build_payload(self, prompt: str, max_tokens: int, temperature: float, system_message: str = None) -> Dict[str, Any]:
         # Use OpenAI-compatible format for Groq API
         messages = []
         if system_message:
             messages.append({"role": "system", "content": system_message})
         messages.append({"role": "user", "content": prompt})
-        
-        payload = {
+
+        return {
             "model": self.model,
             "messages": messages,
             "max_tokens": max_tokens,
             "temperature": temperature,
         }
 
+    @staticmethod
+    def _parse_response(data: Any) -> str:
+        # Extract from OpenAI-compatible response
+        if isinstance(data, dict):
+            if "choices" in data and len(data["choices"]) > 0:
+                choice = data["choices"][0]
+                if "message" in choice and "content" in choice["message"]:
+                    return choice["message"]["content"].strip()
+                if "text" in choice:
+                    return choice["text"].strip()
+
+            # Fallback patterns
+            if "output" in data and isinstance(data["output"], str):
+                return data["output"].strip()
+            if "text" in data and isinstance(data["text"], str):
+                return data["text"].strip()
+
+        # Fallback: return raw JSON string
+        return str(data)
+
+    def _retry_delay(self, attempt: int, retry_after: float | None, deadline: float) -> float | None:
+        """Seconds to wait before the next attempt, or None if we must give up"""
+        if attempt >= self.max_retries:
+            return None
+        # Full jitter keeps a burst of failing requests from retrying in lockstep
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        # Leave the next attempt at least a little time before the deadline
+        if time.monotonic() + delay + 0.1 >= deadline:
+            return None
+        return delay
+
+    @staticmethod
+    def _record_usage(data: Any) -> None:
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if isinstance(usage, dict):
+            LLM_TOKENS.inc(usage.get("prompt_tokens") or 0, provider="groq", kind="prompt")
+            LLM_TOKENS.inc(usage.get("completion_tokens") or 0, provider="groq", kind="completion")
+
+    @staticmethod
+    def _connection_error(detail: Any) -> ConnectionError:
+        return ConnectionError(f"Unable to connect to Groq API: {detail}. Please check your internet connection and API configuration.")
+
+    def generate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, timeout: int = 60, system_message: str = None) -> str:
+        payload = self._build_payload(prompt, max_tokens, temperature, system_message)
+        deadline = time.monotonic() + timeout
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            retry_after = None
+            try:
+                resp = self.session.post(self.endpoint, json=payload, timeout=remaining)
+                if resp.status_code not in RETRYABLE_STATUS_CODES:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    self._record_usage(data)
+                    return self._parse_response(data)
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                error = f"{resp.status_code} {resp.reason}"
+                reason = str(resp.status_code)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = str(e)
+                reason = type(e).__name__
+            except requests.exceptions.RequestException as e:
+                # Non-retryable HTTP error (e.g. 400/401)
+                raise self._connection_error(str(e))
+
+            delay = self._retry_delay(attempt, retry_after, deadline)
+            if delay is None:
+                raise self._connection_error(error)
+            LLM_RETRIES.inc(reason=reason)
+            time.sleep(delay)
+            attempt += 1
+
+    async def agenerate(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, timeout: int = 60, system_message: str = None) -> str:
+        """Async version of `generate`; waits on the network without blocking the event loop"""
+        payload = self._build_payload(prompt, max_tokens, temperature, system_message)
+        client = self._get_async_client()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            retry_after = None
+            try:
+                resp = await client.post(self.endpoint, json=payload, timeout=remaining)
+                if resp.status_code not in RETRYABLE_STATUS_CODES:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    self._record_usage(data)
+                    return self._parse_response(data)
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                error = f"{resp.status_code} {resp.reason_phrase}"
+                reason = str(resp.status_code)
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+                reason = type(e).__name__
+            except httpx.HTTPError as e:
+                raise self._connection_error(str(e))
+
+            delay = self._retry_delay(attempt, retry_after, deadline)
+            if delay is None:
+                raise self._connection_error(error)
+            LLM_RETRIES.inc(reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def astream(self, prompt: str, max_tokens: int = 1024, temperature: float = 0.7, timeout: int = 60, system_message: str = None) -> AsyncIterator[str]:
+        """Stream completion text deltas as they arrive (`stream: true`).
+
+        Retries only happen before the first token; once output has been
+        yielded a failure is raised to the caller.
+        """
+        payload = self._build_payload(prompt, max_tokens, temperature, system_message)
+        payload["stream"] = True
+        client = self._get_async_client()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        streamed = False
+
+        while True:
+            remaining = deadline - time.monotonic()
+            retry_after = None
+            try:
+                async with client.stream("POST", self.endpoint, json=payload, timeout=remaining) as resp:
+                    if resp.status_code not in RETRYABLE_STATUS_CODES:
+                        resp.raise_for_status()
+                        async for line in resp.aiter_lines():
+                            delta = self._parse_stream_line(line)
+                            if delta is None:
+                                return
+                            if delta:
+                                streamed = True
+                                yield delta
+                        return
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                    error = f"{resp.status_code} {resp.reason_phrase}"
+                    reason = str(resp.status_code)
+            except httpx.TransportError as e:
+                if streamed:
+                    # A retry would repeat the text the caller already has
+                    raise self._connection_error(str(e) or type(e).__name__) from e
+                error = str(e) or type(e).__name__
+                reason = type(e).__name__
+            except httpx.HTTPError as e:
+                raise self._connection_error(str(e))
+
+            delay = self._retry_delay(attempt, retry_after, deadline)
+            if delay is None:
+                raise self._connection_error(error)
+            LLM_RETRIES.inc(reason=reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _parse_stream_line(line: str) -> str | None:
+        """Return the text delta in an SSE line, "" for no text, None at end of stream"""
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
         try:
-            # Groq uses OpenAI-compatible endpoint
-            api_endpoint = self.api_url
-            if not api_endpoint.endswith('/chat/completions'):
-                api_endpoint = api_endpoint.rstrip('/') + '/chat/completions'
-            
-            resp = requests.post(api_endpoint, json=payload, headers=headers, timeout=timeout)
-            resp.raise_for_status()
-            data = resp.json()
-
-            # Extract from OpenAI-compatible response
-            if isinstance(data, dict):
-                if "choices" in data and len(data["choices"]) > 0:
-                    choice = data["choices"][0]
-                    if "message" in choice and "content" in choice["message"]:
-                        return choice["message"]["content"].strip()
-                    if "text" in choice:
-                        return choice["text"].strip()
-                
-                # Fallback patterns
-                if "output" in data and isinstance(data["output"], str):
-                    return data["output"].strip()
-                if "text" in data and isinstance(data["text"], str):
-                    return data["text"].strip()
-
-            # Fallback: return raw JSON string
-            return str(data)
-        except requests.exceptions.RequestException as e:
-            # Network error - provide helpful fallback
-            raise ConnectionError(f"Unable to connect to Groq API: {str(e)}. Please check your internet connection and API configuration.")
+            chunk = json.loads(data)
+        except json.JSONDecodeError:
+            return ""
+        choices = chunk.get("choices") or []
+        if not choices:
+            return ""
+        choice = choices[0]
+        delta = choice.get("delta") or {}
+        return delta.get("content") or choice.get("text") or ""
+
+# Stopword lists for keyword extraction and BM25 retrieval, built once at import
+FRENCH_STOPWORDS = frozenset("""
+le la les de des du un une et à a au aux en est sont dans sur pour avec par qui que quoi ce cet cette ces
+il elle ils elles on nous vous je tu me te se moi toi lui leur leurs son sa ses mon ma mes ton ta tes
+notre nos votre vos ceci cela ça celui celle ceux celles tout toute tous toutes chaque chacun chacune
+aucun aucune personne rien jamais toujours souvent parfois rarement maintenant hier demain aujourd
+ici là où quand comment pourquoi combien quel quelle quels quelles quelque quelques autre autres même
+mêmes tel telle tels telles tellement assez très plus moins autant tant si aussi ainsi donc alors car
+mais ou ni or puis ensuite abord enfin ne pas sans sous entre vers chez être avoir fait faire été
+comme dont peut peuvent
+""".split())
+
+ENGLISH_STOPWORDS = frozenset("""
+the a an and or but if of to in on at by for with from as is are was were be been being it its this
+that these those there here what which who whom whose when where why how all any both each few more
+most other some such no nor not only own same so than too very can will just do does did have has had
+i you he she we they me him her us them my your his our their into about over under again further
+then once also may might must should would could
+""".split())
+
+ARABIC_STOPWORDS = frozenset("""
+في من على إلى الى عن أن ان إن هذا هذه ذلك تلك التي الذي الذين هو هي هم هن نحن أنا انا أنت انت كان كانت
+يكون مع كل بعض ما ماذا لماذا كيف متى أين اين هل لا لم لن قد ثم أو او بين عند حتى إذا اذا كما لكن
+ديال ديالو ديالها هاد هادي هادو واش شنو علاش كيفاش فين فاش حيت باش غير بزاف شي والو را راه راها
+""".split())
+
+STOPWORDS = {
+    "french": FRENCH_STOPWORDS,
+    "english": ENGLISH_STOPWORDS,
+    "arabic": ARABIC_STOPWORDS,
+    "darija": ARABIC_STOPWORDS,
+}
+ALL_STOPWORDS = FRENCH_STOPWORDS | ENGLISH_STOPWORDS | ARABIC_STOPWORDS
+
+# Letters and digits in any script; apostrophes split French elisions (l'énergie -> énergie)
+_TOKEN_RE = re.compile(r"[^\W_]+")
+# Arabic diacritics (tashkeel) and tatweel carry no meaning for matching
+_ARABIC_MARKS_RE = re.compile(r"[\u064B-\u065F\u0670\u0640]")
+_ARABIC_NORMALIZE = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ى": "ي", "ة": "ه"})
+
+
+def tokenize(text: str, language: str | None = None) -> List[str]:
+    """Lowercase, normalize and split text into index terms without stopwords.
+
+    `language` selects one stopword list; by default stopwords from every
+    supported language are removed, which suits mixed French/Arabic courses.
+    """
+    stopwords = STOPWORDS.get(language, ALL_STOPWORDS)
+    text = _ARABIC_MARKS_RE.sub("", text.lower()).translate(_ARABIC_NORMALIZE)
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        # Light Arabic stemming: drop the definite article
+        if token.startswith("ال") and len(token) > 4:
+            token = token[2:]
+        if len(token) > 1 and token not in stopwords:
+            terms.append(token)
+    return terms
+
 
 def clean_text(text: str) -> str:
     """Clean and preprocess text"""
@@ -81,29 +365,75 @@ def clean_text(text: str) -> str:
 
 def detect_language_advanced(text: str) -> str:
     """Advanced language detection using character frequency"""
-    arabic_chars = len(re.findall(r'[\u0600-\u06FF]', text))
-    french_chars = len(re.findall(r'[a-zA-Z]', text))
-    total_chars = len(re.findall(r'[a-zA-Z\u0600-\u06FF]', text))
-    
-    if total_chars == 0:
+    stats = language_stats(text)
+
+    if stats.letters == 0:
         return 'english'
-    
-    arabic_ratio = arabic_chars / total_chars
-    
-    if arabic_ratio > 0.3:
+
+    if stats.arabic_ratio > 0.3:
         return 'arabic'
     else:
         return 'french'  # Default to French for Moroccan context
 
-def extract_key_terms(text: str) -> List[str]:
-    """Extract key terms from text"""
-    # Simple term extraction - in production, use NLP libraries
-    words = re.findall(r'\b\w+\b', text.lower())
-    # Remove common words
-    common_words = {'le', 'la', 'de', 'et', 'à', 'en', 'est', 'du', 'des', 'les', 'un', 'une', 'dans', 'sur', 'pour', 'avec', 'par', 'qui', 'que', 'ce', 'cette', 'ces', 'il', 'elle', 'ils', 'elles', 'nous', 'vous', 'moi', 'toi', 'lui', 'leur', 'son', 'sa', 'ses', 'mon', 'ma', 'mes', 'ton', 'ta', 'tes', 'notre', 'nos', 'votre', 'vos', 'leur', 'leurs', 'ceci', 'cela', 'celui', 'celle', 'ceux', 'celles', 'tout', 'toute', 'tous', 'toutes', 'chaque', 'chacun', 'chacune', 'aucun', 'aucune', 'personne', 'rien', 'jamais', 'toujours', 'souvent', 'parfois', 'rarement', 'maintenant', 'hier', 'demain', 'aujourd', 'ici', 'là', 'où', 'quand', 'comment', 'pourquoi', 'combien', 'quel', 'quelle', 'quels', 'quelles', 'quel', 'quelle', 'quels', 'quelles', 'quelque', 'quelques', 'autre', 'autres', 'même', 'mêmes', 'tel', 'telle', 'tels', 'telles', 'tellement', 'tellement', 'assez', 'très', 'plus', 'moins', 'autant', 'tant', 'si', 'aussi', 'ainsi', 'donc', 'alors', 'car', 'mais', 'ou', 'ni', 'donc', 'or', 'et', 'puis', 'ensuite', 'd\'abord', 'enfin', 'tout', 'tous', 'toutes', 'chacun', 'chacune', 'aucun', 'aucune', 'personne', 'rien', 'jamais', 'toujours', 'souvent', 'parfois', 'rarement', 'maintenant', 'hier', 'demain', 'aujourd', 'ici', 'là', 'où', 'quand', 'comment', 'pourquoi', 'combien', 'quel', 'quelle', 'quels', 'quelles', 'quel', 'quelle', 'quels', 'quelles', 'quelque', 'quelques', 'autre', 'autres', 'même', 'mêmes', 'tel', 'telle', 'tels', 'telles', 'tellement', 'tellement', 'assez', 'très', 'plus', 'moins', 'autant', 'tant', 'si', 'aussi', 'ainsi', 'donc', 'alors', 'car', 'mais', 'ou', 'ni', 'donc', 'or', 'et', 'puis', 'ensuite', 'd\'abord', 'enfin'}
-    
-    terms = [word for word in words if word not in common_words and len(word) > 2]
-    return list(set(terms))[:20]  # Return top 20 unique terms
+def extract_key_terms(text: str, limit: int = 20) -> List[str]:
+    """Extract key terms from text, most frequent first"""
+    terms = [term for term in tokenize(text) if len(term) > 2]
+    return [term for term, _ in Counter(terms).most_common(limit)]
+
+_json_decoder = json.JSONDecoder()
+
+
+def iter_json_objects(text: str):
+    """Yield every top-level JSON object embedded in `text`.
+
+    Unlike a greedy `{.*}` regex this decodes objects one at a time, so
+    surrounding prose, code fences or a truncated trailing object do not
+    spoil the objects that did parse.
+    """
+    position = text.find("{")
+    while position != -1:
+        try:
+            obj, end = _json_decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            position = text.find("{", position + 1)
+            continue
+        if isinstance(obj, dict):
+            yield obj
+        position = text.find("{", end)
+
+
+def validate_question(item: Any) -> Dict[str, Any] | None:
+    """Normalize one generated multiple-choice question, or return None if unusable"""
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    options = item.get("options")
+    answer = item.get("correctAnswer", item.get("answer"))
+    explanation = item.get("explanation", "")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4 or not all(isinstance(o, str) and o.strip() for o in options):
+        return None
+    if not isinstance(answer, str):
+        return None
+
+    letters = ["A", "B", "C", "D"]
+    answer = answer.strip()
+    if answer.upper()[:1] in letters and (len(answer) == 1 or not answer[1].isalnum()):
+        answer = answer.upper()[0]
+    elif answer in options:
+        # Some models answer with the option text instead of its letter
+        answer = letters[options.index(answer)]
+    else:
+        return None
+
+    return {
+        "question": question.strip(),
+        "options": [o.strip() for o in options],
+        "correctAnswer": answer,
+        "explanation": explanation.strip() if isinstance(explanation, str) else "",
+    }
+
 
 def format_response_for_frontend(response: str, language: str) -> Dict[str, Any]:
     """Format AI response for frontend display"""
@@ -0,0 +1,254 @@
+import json
+import mmap
+import os
+from typing import Iterator, List, Sequence
+
+import numpy as np
+
+# Formats a document's embeddings can be stored in; "faiss" keeps LangChain's FAISS store
+VECTOR_FORMATS = ("faiss", "float16", "int8")
+
+_META_FILE = "compact.json"
+_VECTORS_FILE = "vectors.bin"
+_SCALES_FILE = "scales.bin"
+_NORMS_FILE = "norms.bin"
+_TEXT_FILE = "chunks.bin"
+_OFFSETS_FILE = "offsets.bin"
+
+# Rows scored per step in `search`, so int8 rows are never all dequantized at once
+_SEARCH_BLOCK = 4096
+
+
+def _map_array(path: str, dtype, shape: tuple) -> np.ndarray:
+    """Read-only memory map of a raw array file (empty arrays cannot be mapped)"""
+    if not shape[0]:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class MappedChunks(Sequence[str]):
+    """Chunk texts stored back to back in one UTF-8 buffer, sliced by offsets.
+
+    The buffer may be a `mmap` of the text file, so the texts are decoded
+    on access instead of being held as Python strings.
+    """
+    def __init__(self, buffer, offsets: np.ndarray):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "MappedChunks":
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return bytes(self._buffer[start:end]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def nbytes(self) -> int:
+        return len(self._buffer) + self._offsets.nbytes
+
+    def save(self, text_path: str, offsets_path: str) -> None:
+        with open(text_path, "wb") as f:
+            f.write(self._buffer)
+        np.ascontiguousarray(self._offsets).tofile(offsets_path)
+
+    @classmethod
+    def load(cls, text_path: str, offsets_path: str, count: int) -> "MappedChunks":
+        buffer = b""
+        if os.path.getsize(text_path):
+            with open(text_path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, _map_array(offsets_path, np.uint64, (count + 1,)))
+
+
+class CompactVectorStore:
+    """Exact nearest-neighbour search over float16 or int8 embeddings.
+
+    Notes:
+    - int8 rows are quantized symmetrically with one float32 scale per row;
+      float16 rows are stored as is. Either way a row costs a half or a
+      quarter of FAISS's float32, and there is no LangChain docstore
+      holding a second copy of each chunk.
+    - `save` writes raw arrays plus the chunk texts and their offsets;
+      `load` only memory-maps them, so opening an index is O(1) and every
+      uvicorn worker reading the same document shares its pages through
+      the OS page cache instead of copying them onto its own heap.
+    - Distances are squared L2 like FAISS `IndexFlatL2`, computed from the
+      dequantized rows, so rankings match the float32 index up to
+      quantization error.
+    """
+    def __init__(self, codes: np.ndarray, scales: np.ndarray | None, norms: np.ndarray, chunks: MappedChunks):
+        self.codes = codes
+        self.scales = scales
+        self.norms = norms
+        self.chunks = chunks
+
+    @property
+    def dtype(self) -> str:
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def dimensions(self) -> int:
+        return self.codes.shape[1]
+
+    @classmethod
+    def build(cls, chunks: List[str], vectors, dtype: str = "float16") -> "CompactVectorStore":
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(chunks), -1) if chunks else np.empty((0, 0), dtype=np.float32)
+        if dtype == "int8":
+            scales = np.abs(matrix).max(axis=1, initial=0.0) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+            scales = scales.astype(np.float32)
+        elif dtype == "float16":
+            codes = matrix.astype(np.float16)
+            scales = None
+        else:
+            raise ValueError(f"Unsupported compact vector dtype: {dtype}")
+        store = cls(codes, scales, np.empty(len(chunks), dtype=np.float32), MappedChunks.from_texts(chunks))
+        store.norms = np.square(store._decode(0, len(chunks))).sum(axis=1).astype(np.float32)
+        return store
+
+    def _decode(self, start: int, end: int) -> np.ndarray:
+        rows = np.asarray(self.codes[start:end], dtype=np.float32)
+        if self.scales is not None:
+            rows *= np.asarray(self.scales[start:end])[:, None]
+        return rows
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query_vector, k: int) -> List[tuple[int, float]]:
+        """Nearest chunks as (chunk id, squared L2 distance), closest first"""
+        count = len(self)
+        k = min(k, count)
+        if k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        distances = np.empty(count, dtype=np.float32)
+        for start in range(0, count, _SEARCH_BLOCK):
+            end = min(start + _SEARCH_BLOCK, count)
+            distances[start:end] = np.asarray(self.norms[start:end]) - 2.0 * (self._decode(start, end) @ query)
+        distances += float(query @ query)
+        top = np.argpartition(distances, k - 1)[:k] if k < count else np.arange(count)
+        top = top[np.argsort(distances[top], kind="stable")]
+        return [(int(i), float(max(distances[i], 0.0))) for i in top]
+
+    def vectors(self, chunk_ids: List[int]) -> np.ndarray:
+        """Dequantized embeddings of the given chunks, one row per id"""
+        if not chunk_ids:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return np.vstack([self._decode(int(chunk_id), int(chunk_id) + 1) for chunk_id in chunk_ids])
+
+    def nbytes(self) -> int:
+        scale_bytes = self.scales.nbytes if self.scales is not None else 0
+        return self.codes.nbytes + scale_bytes + self.norms.nbytes + self.chunks.nbytes()
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.ascontiguousarray(self.codes).tofile(os.path.join(path, _VECTORS_FILE))
+        if self.scales is not None:
+            np.ascontiguousarray(self.scales).tofile(os.path.join(path, _SCALES_FILE))
+        np.ascontiguousarray(self.norms).tofile(os.path.join(path, _NORMS_FILE))
+        self.chunks.save(os.path.join(path, _TEXT_FILE), os.path.join(path, _OFFSETS_FILE))
+        with open(os.path.join(path, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "count": len(self), "dimensions": self.dimensions}, f)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, _META_FILE))
+
+    @classmethod
+    def load(cls, path: str) -> "CompactVectorStore":
+        with open(os.path.join(path, _META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        count, dimensions = meta["count"], meta["dimensions"]
+        int8 = meta["dtype"] == "int8"
+
+        codes = _map_array(os.path.join(path, _VECTORS_FILE), np.int8 if int8 else np.float16, (count, dimensions))
+        scales = _map_array(os.path.join(path, _SCALES_FILE), np.float32, (count,)) if int8 else None
+        norms = _map_array(os.path.join(path, _NORMS_FILE), np.float32, (count,))
+        chunks = MappedChunks.load(os.path.join(path, _TEXT_FILE), os.path.join(path, _OFFSETS_FILE), count)
+        return cls(codes, scales, norms, chunks)
+
+
+class CompactVectorWriter:
+    """Builds a `CompactVectorStore` from batches of chunks and embeddings.
+
+    With a `path`, each batch is quantized and appended to the store's files
+    as it arrives, so building never holds more than one batch however long
+    the document is; `finish` then memory-maps the files. Without one, the
+    quantized batches are joined in memory.
+    """
+    def __init__(self, dtype: str, path: str | None = None):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported compact vector dtype: {dtype}")
+        self.dtype = dtype
+        self.path = path
+        self.count = 0
+        self.dimensions = 0
+        self._text_size = 0
+        self._batches: List[CompactVectorStore] = []
+        self._files = {}
+        if path:
+            os.makedirs(path, exist_ok=True)
+            names = [_VECTORS_FILE, _NORMS_FILE, _TEXT_FILE, _OFFSETS_FILE] + ([_SCALES_FILE] if dtype == "int8" else [])
+            self._files = {name: open(os.path.join(path, name), "wb") for name in names}
+            np.zeros(1, dtype=np.uint64).tofile(self._files[_OFFSETS_FILE])
+
+    def add(self, chunks: List[str], vectors) -> None:
+        if not chunks:
+            return
+        batch = CompactVectorStore.build(chunks, vectors, self.dtype)
+        self.count += len(batch)
+        self.dimensions = batch.dimensions
+        if not self.path:
+            self._batches.append(batch)
+            return
+        batch.codes.tofile(self._files[_VECTORS_FILE])
+        if batch.scales is not None:
+            batch.scales.tofile(self._files[_SCALES_FILE])
+        batch.norms.tofile(self._files[_NORMS_FILE])
+        self._files[_TEXT_FILE].write(batch.chunks._buffer)
+        (batch.chunks._offsets[1:] + np.uint64(self._text_size)).tofile(self._files[_OFFSETS_FILE])
+        self._text_size += len(batch.chunks._buffer)
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def finish(self) -> CompactVectorStore:
+        if not self.path:
+            if not self._batches:
+                return CompactVectorStore.build([], [], self.dtype)
+            offsets = [np.zeros(1, dtype=np.uint64)]
+            text_size = 0
+            for batch in self._batches:
+                offsets.append(batch.chunks._offsets[1:] + np.uint64(text_size))
+                text_size += len(batch.chunks._buffer)
+            return CompactVectorStore(
+                np.vstack([batch.codes for batch in self._batches]),
+                np.concatenate([batch.scales for batch in self._batches]) if self.dtype == "int8" else None,
+                np.concatenate([batch.norms for batch in self._batches]),
+                MappedChunks(b"".join(batch.chunks._buffer for batch in self._batches), np.concatenate(offsets)),
+            )
+        self.close()
+        with open(os.path.join(self.path, _META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "count": self.count, "dimensions": self.dimensions}, f)
+        return CompactVectorStore.load(self.path)
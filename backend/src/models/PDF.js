@@ -36,6 +36,9 @@ const pdfSchema = new mongoose.Schema({
   subject: {
     type: String
   },
+  aiDocumentId: {
+    type: String
+  },
   createdAt: {
     type: Date,
     default: Date.now
@@ -3,13 +3,44 @@ const axios = require('axios');
 const PDF = require('../models/PDF');
 const router = express.Router();
 
+const AI_URL = process.env.PYTHON_AI_URL || 'http://localhost:8000';
+
+// Send the PDF text to the AI service once and remember the returned document id
+const ingestPdf = async (pdfId) => {
+  const pdf = await PDF.findById(pdfId).select('textContent originalName userId subject tags');
+  const { data } = await axios.post(`${AI_URL}/documents`, {
+    content: pdf.textContent,
+    title: pdf.originalName,
+    userId: pdf.userId,
+    subject: pdf.subject,
+    tags: pdf.tags
+  });
+  await PDF.updateOne({ _id: pdfId }, { aiDocumentId: data.documentId });
+  return data.documentId;
+};
+
+// Call an AI endpoint by document id instead of re-sending the PDF text,
+// re-ingesting once if the AI service no longer knows the document
+const postForPdf = async (path, pdf, body) => {
+  const documentId = pdf.aiDocumentId || await ingestPdf(pdf._id);
+  try {
+    return await axios.post(`${AI_URL}${path}`, { ...body, documentId });
+  } catch (error) {
+    if (error.response && error.response.status === 404) {
+      const freshId = await ingestPdf(pdf._id);
+      return axios.post(`${AI_URL}${path}`, { ...body, documentId: freshId });
+    }
+    throw error;
+  }
+};
+
 // Ask general question
 router.post('/ask', async (req, res) => {
   try {
     const { question, language = 'darija' } = req.body;
     
     // Forward to Python AI agent
-    const aiResponse = await axios.post(`${process.env.PYTHON_AI_URL || 'http://localhost:8000'}/ask`, {
+    const aiResponse = await axios.post(`${AI_URL}/ask`, {
       question,
       language,
       userId: req.user._id
@@ -30,20 +61,19 @@ router.post('/pdf-query', async (req, res) => {
   try {
     const { question, pdfId, language = 'darija' } = req.body;
 
-    // Get PDF content
+    // Get PDF (the text itself is only loaded if it has to be ingested)
     const pdf = await PDF.findOne({
       _id: pdfId,
       userId: req.user._id
-    });
+    }).select('-textContent');
 
     if (!pdf) {
       return res.status(404).json({ message: 'PDF not found' });
     }
 
     // Forward to Python AI agent
-    const aiResponse = await axios.post(`${process.env.PYTHON_AI_URL || 'http://localhost:8000'}/ask-pdf`, {
+    const aiResponse = await postForPdf('/ask-pdf', pdf, {
       question,
-      pdfContent: pdf.textContent,
       language,
       userId: req.user._id
     });
@@ -58,25 +88,66 @@ router.post('/pdf-query', async (req, res) => {
   }
 });
 
+// Ask across all of the user's PDFs, optionally narrowed by subject or tags
+router.post('/library-query', async (req, res) => {
+  try {
+    const { question, subject, tags, language = 'darija' } = req.body;
+
+    const filter = { userId: req.user._id };
+    if (subject) filter.subject = subject;
+    if (tags && tags.length) filter.tags = { $in: tags };
+    const pdfs = await PDF.find(filter).select('originalName aiDocumentId');
+
+    if (!pdfs.length) {
+      return res.status(404).json({ message: 'No PDFs match this query' });
+    }
+
+    // PDFs uploaded before background ingestion existed are ingested once here
+    const documentIds = await Promise.all(pdfs.map((pdf) => pdf.aiDocumentId || ingestPdf(pdf._id)));
+
+    // The AI service searches only these documents, so deleted PDFs never leak into answers
+    const aiResponse = await axios.post(`${AI_URL}/ask-library`, {
+      question,
+      language,
+      documentIds,
+      userId: req.user._id
+    });
+
+    // Map AI document ids back to the user's PDFs for attribution
+    const pdfByDocumentId = new Map(pdfs.map((pdf, i) => [documentIds[i], pdf]));
+    const sources = aiResponse.data.sources.map((source) => {
+      const pdf = pdfByDocumentId.get(source.documentId);
+      return { ...source, pdfId: pdf && pdf._id, originalName: pdf && pdf.originalName };
+    });
+
+    res.json({ ...aiResponse.data, sources });
+  } catch (error) {
+    console.error('Library AI request error:', error);
+    const status = error.response && error.response.status === 404 ? 404 : 500;
+    res.status(status).json({
+      message: 'Error processing library AI request',
+      error: error.message
+    });
+  }
+});
+
 // Summarize specific PDF
 router.post('/summarize-pdf', async (req, res) => {
   try {
     const { pdfId, language = 'darija' } = req.body;
 
-    // Get PDF content
+    // Get PDF (the text itself is only loaded if it has to be ingested)
     const pdf = await PDF.findOne({
       _id: pdfId,
       userId: req.user._id
-    });
+    }).select('-textContent');
 
     if (!pdf) {
       return res.status(404).json({ message: 'PDF not found' });
     }
 
     // Forward to Python AI agent's summarize endpoint
-    const aiResponse = await axios.post(`${process.env.PYTHON_AI_URL || 'http://localhost:8000'}/summarize`, {
-      question: "summarize", // Placeholder question as it's required by the Pydantic model
-      pdfContent: pdf.textContent,
+    const aiResponse = await postForPdf('/summarize', pdf, {
       language,
       userId: req.user._id
     });
@@ -2,6 +2,7 @@ const express = require('express');
 const multer = require('multer');
 const cloudinary = require('cloudinary').v2;
 const pdfParse = require('pdf-parse');
+const axios = require('axios');
 const PDF = require('../models/PDF');
 const authMiddleware = require('../middleware/authMiddleware');
 
@@ -44,6 +45,9 @@ router.post('/upload', upload.single('pdf'), async (req, res) => {
       uploadStream.end(buffer);
     });
 
+    // Optional library metadata sent as form fields; tags as a comma-separated list
+    const tags = (req.body.tags || '').split(',').map((tag) => tag.trim()).filter(Boolean);
+
     // Create PDF document
     const pdf = new PDF({
       filename: uploadResult.public_id,
@@ -52,11 +56,24 @@ router.post('/upload', upload.single('pdf'), async (req, res) => {
       textContent: pdfData.text,
       wordCount: pdfData.text.split(/\s+/).length,
       pageCount: pdfData.numpages || 0,
-      userId: req.user._id
+      userId: req.user._id,
+      subject: req.body.subject,
+      tags
     });
 
     await pdf.save();
 
+    // Ingest into the AI service in the background so the first question is fast
+    axios.post(`${process.env.PYTHON_AI_URL || 'http://localhost:8000'}/documents`, {
+      content: pdf.textContent,
+      title: pdf.originalName,
+      userId: pdf.userId,
+      subject: pdf.subject,
+      tags: pdf.tags
+    })
+      .then(({ data }) => PDF.updateOne({ _id: pdf._id }, { aiDocumentId: data.documentId }))
+      .catch((error) => console.error('AI document ingestion error:', error.message));
+
     res.status(201).json({
       message: 'PDF uploaded successfully',
       pdf: {
@@ -65,6 +82,8 @@ router.post('/upload', upload.single('pdf'), async (req, res) => {
         originalName: pdf.originalName,
         wordCount: pdf.wordCount,
         pageCount: pdf.pageCount,
+        subject: pdf.subject,
+        tags: pdf.tags,
         createdAt: pdf.createdAt
       }
     });
@@ -78,7 +97,7 @@ router.post('/upload', upload.single('pdf'), async (req, res) => {
 router.get('/', async (req, res) => {
   try {
     const pdfs = await PDF.find({ userId: req.user._id })
-      .select('filename originalName wordCount pageCount createdAt')
+      .select('filename originalName wordCount pageCount subject tags createdAt')
       .sort({ createdAt: -1 });
 
     res.json({ pdfs });
@@ -123,6 +142,15 @@ router.delete('/:id', async (req, res) => {
     // Delete from database
     await PDF.findByIdAndDelete(req.params.id);
 
+    // The AI service keeps the text and index until no other user has the same PDF;
+    // the same user may also have uploaded it twice
+    if (pdf.aiDocumentId && !await PDF.exists({ userId: pdf.userId, aiDocumentId: pdf.aiDocumentId })) {
+      axios.delete(`${process.env.PYTHON_AI_URL || 'http://localhost:8000'}/documents/${pdf.aiDocumentId}`, {
+        params: { userId: String(pdf.userId) }
+      })
+        .catch((error) => console.error('AI document deletion error:', error.message));
+    }
+
     res.json({ message: 'PDF deleted successfully' });
   } catch (error) {
     res.status(500).json({ message: error.message });